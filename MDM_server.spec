@@ -1,5 +1,7 @@
 # -*- mode: python -*-
 
+from PyInstaller.utils.hooks import collect_submodules
+
 block_cipher = None
 
 added_files = [('.\\streamlink\\plugins', 'plugins')]
@@ -8,7 +10,8 @@ a = Analysis(['app.py'],
              pathex=['E:\Language\Python\hydrax\MDM_server'],
              binaries=[],
              datas=added_files,
-             hiddenimports=[],
+             # plugins and stream types are imported on first use
+             hiddenimports=collect_submodules('streamlink.plugins') + collect_submodules('streamlink.stream'),
              hookspath=[],
              runtime_hooks=[],
              excludes=[],
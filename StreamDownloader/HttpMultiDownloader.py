@@ -1,31 +1,37 @@
+import os
 import logging
 from time import time
 from threading import Lock
-from collections import deque
 from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError
-from StreamDownloader.utils import FormatFileSize, FormatSeconds, FormatPercent
+from streamlink.governor import host_governor
+from streamlink.bandwidth import bandwidth_scheduler
+from StreamDownloader.journal import RangeJournal
+from StreamDownloader.scheduler import PieceScheduler
+from StreamDownloader.compat import pwrite, preallocate
+from StreamDownloader.meter import TransferMeter
 DEFAULT_CHUNK_SIZE = 2048
 DEFAULT_BUFFER_SIZE = 4096
+MIN_READ_SIZE = 262144
+MAX_READ_SIZE = 4194304
+READ_TARGET_TIME = 0.25
+PIECE_RETRIES = 3
 log = logging.getLogger(__name__)
 
 class Downloader(object):
     __doc__ = 'docstring for Chunk'
 
-    def __init__(self, url, http_client, file, max_workers=5, reporter=None, requests_params=None):
+    def __init__(self, url, http_client, file, max_workers=5, reporter=None, requests_params=None, bandwidth=None):
         self.max_workers = max_workers
         self.url = url
         self.http_client = http_client
         self.file = file
-        self.__lock = Lock()
-        self.__dl_bytes = 0
         self.file_size = 0
-        self.speed = ''
-        self.eta = ''
-        self.percent = ''
-        self._start_time = 0
-        self._pre_time = 0
-        self._speeds = deque(maxlen=5)
-        self._etas = deque(maxlen=5)
+        self.journal = None
+        self.scheduler = None
+        self.fd = None
+        self._shutdown_lock = Lock()
+        self.meter = TransferMeter()
+        self.bandwidth = bandwidth or bandwidth_scheduler.owner()
         self.reporter = reporter
         self.thread_pool = None
         self.futures = []
@@ -37,10 +43,34 @@ class Downloader(object):
         else:
             self.request_params = {}
 
-    def shutdown(self, wait=True):
+    def shutdown(self, wait=True, keep_journal=True):
+        '''Stops the workers, with *wait* saves the journal of an incomplete
+        download unless *keep_journal* is False, then closes the file once.
+        '''
         self.closed = True
         if self.thread_pool:
             self.thread_pool.shutdown(wait)
+        if not wait:
+            return
+        with self._shutdown_lock:
+            journal = self.journal
+            if not keep_journal:
+                self.journal = None
+            if keep_journal and journal and not self.download_completed:
+                journal.save()
+            (fd, self.fd) = (self.fd, None)
+        if fd is not None:
+            os.close(fd)
+
+    def discard(self):
+        'Shuts the download down without saving its journal, the caller removes the files.'
+        self.shutdown(keep_journal=False)
+
+    def isClosed(self):
+        return self.closed
+
+    def acquireSlot(self):
+        return host_governor.acquire(self.url, self.http_client, self.isClosed)
 
     def wrapCallbackError(self, state):
         try:
@@ -50,55 +80,47 @@ class Downloader(object):
 
     @property
     def dl_bytes(self):
-        return self.__dl_bytes
-
-    @dl_bytes.setter
-    def dl_bytes(self, num):
-        with self.__lock:
-            self.__dl_bytes = num
-        now = time()
-        if now - self._pre_time > 0.2:
-            self._pre_time = now
-            speed = float(num)/(now - self._start_time)
-            self._speeds.appendleft(speed)
-            speed_avg = sum(self._speeds)/5
-            self.speed = '%s/s' % FormatFileSize(speed_avg)
-            if self.file_size != -1:
-                if speed_avg > 0.0:
-                    eta = (self.file_size - num)/speed_avg
-                    self._etas.appendleft(eta)
-                    self.eta = FormatSeconds(int(sum(self._etas)/5))
-                self.percent = FormatPercent(float(num/self.file_size)*100.0)
-
-    def firstChunk(self, response, start, end):
-        recv_bytes = 0
-        total = end - start + 1
-        f = None
+        return self.meter.bytes()
+
+    def writeRange(self, response, piece, view, counter):
+        '''Writes the body of *response* to *piece* until it reaches the piece end.
+
+        The body is read with readinto into *view*, a buffer reused by the
+        connection, and written with pwrite on the shared descriptor. The
+        read size adapts between MIN_READ_SIZE and MAX_READ_SIZE so a read
+        takes about READ_TARGET_TIME. The end may shrink while writing
+        when another connection steals part of the piece. A body ending
+        before the piece end raises IOError, so it counts as a retry.
+        '''
+        raw = response.raw
+        raw.decode_content = True
+        size = MIN_READ_SIZE
+        pos = piece.start
+        while not (self.closed or piece.cancelled):
+            want = min(size, piece.end - pos)
+            if want <= 0:
+                return
+            read_start = time()
+            n = raw.readinto(view[:want])
+            if not n:
+                raise IOError('Connection closed at %d of %d' % (pos, piece.end))
+            self.bandwidth.consume(n, self.isClosed)
+            pwrite(self.fd, view[:n], pos)
+            pos += n
+            piece.cursor = piece.pos = pos
+            counter.value += n
+            elapsed = time() - read_start
+            if n == want and elapsed < READ_TARGET_TIME/2 and size < MAX_READ_SIZE:
+                size *= 2
+            elif elapsed > READ_TARGET_TIME and size > MIN_READ_SIZE:
+                size //= 2
+
+    def firstChunk(self, response, piece, view, counter):
+        piece.response = response
         try:
-            f = open(self.file, 'r+b', buffering=DEFAULT_BUFFER_SIZE)
-            f.seek(start)
-            for chunk in response.iter_content(DEFAULT_CHUNK_SIZE):
-                if self.closed:
-                    return
-                chunk_len = len(chunk)
-                recv_bytes += chunk_len
-                if recv_bytes > total:
-                    remain = chunk_len - (recv_bytes - total)
-                    f.write(chunk[:remain])
-                    self.dl_bytes += remain
-                    return
-                f.write(chunk)
-                self.dl_bytes += chunk_len
-                if recv_bytes == total:
-                    return
-        except Exception as err:
-            self.closed = True
-            raise err
+            self.writeRange(response, piece, view, counter)
         finally:
             response.close()
-            if f:
-                f.flush()
-                f.close()
 
     def create_request_params(self, start=None, end=None, is_first_segment=False):
         request_params = dict(self.request_params)
@@ -113,45 +135,87 @@ class Downloader(object):
         request_params['headers'] = headers
         return request_params
 
-    def down(self, start, end):
-        f = None
+    def down(self, piece, view, counter):
+        r = None
+        slot = self.acquireSlot()
+        if not slot:
+            return
         try:
-            request_params = self.create_request_params(start, end)
-            r = self.http_client.get(self.url, stream=True, **request_params)
-            f = open(self.file, 'r+b', buffering=DEFAULT_BUFFER_SIZE)
-            f.seek(start)
-            for chunk in r.iter_content(DEFAULT_CHUNK_SIZE):
-                if self.closed:
-                    return
-                f.write(chunk)
-                self.dl_bytes += len(chunk)
-        except Exception as err:
-            self.closed = True
-            raise err
+            if piece.cancelled:
+                return
+            request_params = self.create_request_params(piece.start, piece.end - 1)
+            r = piece.response = self.http_client.get(self.url, stream=True, **request_params)
+            if r.status_code != 206:
+                raise Exception('Server ignored range request bytes=%d-%d status %d' % (piece.start, piece.end - 1, r.status_code))
+            self.writeRange(r, piece, view, counter)
         finally:
-            if f:
-                f.flush()
-                f.close()
+            if r is not None:
+                r.close()
+            slot.release()
+
+    def work(self, piece=None, response=None):
+        '''Downloads pieces from the scheduler until none are left.
+
+        A failed piece is queued again for any connection, the download
+        fails after PIECE_RETRIES errors on this connection.
+        '''
+        errors = 0
+        view = memoryview(bytearray(MAX_READ_SIZE))
+        counter = self.meter.counter()
+        while not self.closed:
+            if piece is None:
+                piece = self.scheduler.next()
+                if piece is None:
+                    return
+            try:
+                show_range(piece.start, piece.end - 1)
+                if response is not None:
+                    self.firstChunk(response, piece, view, counter)
+                else:
+                    self.down(piece, view, counter)
+            except Exception as err:
+                if not (self.closed or piece.cancelled):
+                    errors += 1
+                    if errors > PIECE_RETRIES:
+                        self.closed = True
+                        raise err
+                    log.warning('Download piece %d-%d error %s, retrying', piece.start, piece.end - 1, err)
+            finally:
+                response = None
+                self.scheduler.done(piece)
+                piece = None
 
     def downInfinite(self, response):
         self.file_size = -1
-        with open(self.file, 'wb', buffering=DEFAULT_BUFFER_SIZE) as f:
-            for chunk in response.iter_content(DEFAULT_CHUNK_SIZE):
-                if self.closed:
+        counter = self.meter.counter()
+        try:
+            with open(self.file, 'wb', buffering=DEFAULT_BUFFER_SIZE) as f:
+                for chunk in response.iter_content(DEFAULT_CHUNK_SIZE):
+                    if self.closed:
+                        f.flush()
+                        return
+                    self.bandwidth.consume(len(chunk), self.isClosed)
+                    f.write(chunk)
+                    counter.value += len(chunk)
                     f.flush()
-                    return
-                f.write(chunk)
-                self.dl_bytes += len(chunk)
-                f.flush()
+        finally:
+            response.close()
 
     def run(self):
         self.wrapCallbackError({'state': 'start'})
-        self.__dl_bytes = 0
+        self.meter = TransferMeter()
         self.file_size = -1
         self.futures = []
-        self._start_time = self._pre_time = time()
         request_params = self.create_request_params(is_first_segment=True)
-        res = self.http_client.get(self.url, stream=True, **request_params)
+        slot = self.acquireSlot()
+        if not slot:
+            return
+        try:
+            res = self.http_client.get(self.url, stream=True, **request_params)
+        except Exception:
+            slot.release()
+            raise
+        host_governor.track(res, slot)
         self.url = res.url
         if res.status_code == 200:
             self.file_size = int(res.headers.get('Content-Length', -1))
@@ -169,23 +233,31 @@ class Downloader(object):
             self.thread_pool = ThreadPoolExecutor(1)
             self.futures.append(self.thread_pool.submit(self.downInfinite, res))
             return
+        self.meter.total = self.file_size
+        etag = res.headers.get('ETag')
+        last_modified = res.headers.get('Last-Modified')
+        self.journal = RangeJournal.load(self.file, self.file_size, etag, last_modified)
+        if self.journal:
+            self.meter.resume(self.journal.done_bytes())
+            log.info('Resume %s at %d of %d bytes', self.file, self.meter.initial, self.file_size)
+        self.fd = os.open(self.file, os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0))
+        if not self.journal:
+            self.journal = RangeJournal(self.file, self.file_size, etag, last_modified)
+            preallocate(self.fd, self.file_size)
+        missing = self.journal.missing()
+        if not missing:
+            res.close()
+            return
         if self.file_size <= 10485760:
             self.max_workers = 1
-        with open(self.file, 'wb') as f:
-            f.truncate(self.file_size)
+        self.scheduler = PieceScheduler(self.journal, missing, self.max_workers)
         self.thread_pool = ThreadPoolExecutor(self.max_workers)
-        chunk_size = -(-self.file_size//self.max_workers)
-        for i in range(self.max_workers):
-            start = i*chunk_size
-            end = start + chunk_size - 1
-            if end >= self.file_size:
-                end = self.file_size - 1
-            show_range(start, end)
-            if i == 0:
-                future = self.thread_pool.submit(self.firstChunk, res, start, end)
-            else:
-                future = self.thread_pool.submit(self.down, start, end)
-            self.futures.append(future)
+        if missing[0][0] == 0 and res.status_code == 200:
+            self.futures.append(self.thread_pool.submit(self.work, self.scheduler.next(), res))
+        else:
+            res.close()
+        while len(self.futures) < self.max_workers:
+            self.futures.append(self.thread_pool.submit(self.work))
 
     def wait(self):
         s = 'Downloading'
@@ -193,15 +265,27 @@ class Downloader(object):
             try:
                 for f in as_completed(self.futures, timeout=1):
                     f.result()
+                if self.closed:
+                    break
+                if self.journal and self.journal.missing():
+                    raise IOError('Download incomplete, missing %s' % self.journal.missing()[:5])
+                if self.scheduler:
+                    log.debug('Piece scheduler %s', self.scheduler.stats())
                 s = 'done'
+                self.download_completed = True
+                if self.journal:
+                    self.journal.remove()
                 break
             except TimeoutError:
+                if self.journal:
+                    self.journal.maybe_save()
                 continue
             except Exception as err:
                 log.debug('Download segment http error %s', err, exc_info=True)
                 raise err
             finally:
-                self.wrapCallbackError({'state': s, 'speed': self.speed, 'eta': self.eta, 'per': self.percent, 'total': self.file_size, 'bytes': self.dl_bytes})
+                progress = self.meter.sample()
+                self.wrapCallbackError({'state': s, 'speed': progress['speed'], 'eta': progress['eta'], 'per': progress['percent'], 'total': self.file_size, 'bytes': progress['bytes']})
 
 def show_range(start, end):
     log.debug('start %d - end %d has bytes %d' % (start, end, end - start + 1))
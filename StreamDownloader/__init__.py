@@ -5,20 +5,25 @@ import logging
 from threading import Event
 from time import time, sleep
 from itertools import chain
-from collections import deque
 from functools import partial
 from traceback import format_exc
 from concurrent.futures import ThreadPoolExecutor, wait
 from streamlink import Streamlink, StreamError, PluginError, NoPluginError
+from streamlink.exceptions import TooManySegmentsError
 from streamlink.utils.named_pipe import NamedPipe
 from streamlink.stream.hls import HLSStream, MuxedHLSStream
 from streamlink.stream.http import HTTPStream
 from streamlink.compat import which
+from streamlink.bandwidth import bandwidth_scheduler
+from streamlink.streamcache import stream_cache, response_status, INVALIDATE_STATUS
 from StreamDownloader.constants import STREAM_SYNONYMS
 from StreamDownloader.compat import is_win32
-from StreamDownloader.output import FileOutput, PlayerOutput
+from StreamDownloader.output import FileOutput, PlayerOutput, RemuxOutput
 from StreamDownloader.HttpMultiDownloader import Downloader
-from StreamDownloader.utils import FormatFileSize, FormatSeconds, FormatPercent
+from StreamDownloader.journal import RangeJournal
+from streamlink.stream.spool import SegmentSpool
+from StreamDownloader.meter import TransferMeter
+from StreamDownloader.postprocess import RemuxJob, post_processor
 ACCEPTABLE_ERRNO = (errno.EPIPE, errno.EINVAL, errno.ECONNRESET)
 try:
     ACCEPTABLE_ERRNO += (errno.WSAECONNABORTED,)
@@ -27,10 +32,15 @@ except AttributeError:
 CURRENT_DIR = os.getcwd()
 FFMPEG_LOCATION = os.path.join(CURRENT_DIR, 'data', 'executes', 'ffmpeg.exe')
 NODEJS_LOCATION = os.path.join(CURRENT_DIR, 'data', 'executes', 'node.exe')
+SPOOL_SUFFIX = '.segments'
 
 class StreamDownloaderError(Exception):
     pass
 
+class RemuxError(StreamDownloaderError):
+    __doc__ = 'The final remux of spooled segments failed, the segments are kept to retry it.'
+RESUMABLE_ERRORS = (IOError, OSError, TooManySegmentsError, RemuxError)
+
 log = logging.getLogger('StreamDownloader')
 
 def find_ffmpeg():
@@ -41,6 +51,22 @@ def find_ffmpeg():
         if which(cmd):
             return cmd
 
+def remove_resume_files(filename):
+    'Removes the files kept to resume the download of *filename*, returns True when there were any.'
+    spool_dir = filename + SPOOL_SUFFIX
+    spooled = os.path.isdir(spool_dir)
+    if spooled:
+        SegmentSpool.remove(spool_dir)
+    return RangeJournal.delete(filename) or spooled
+
+def is_resumable_error(err):
+    'Returns True when *err*, or an error it was raised from, is a network error a resume can recover from.'
+    while err is not None:
+        if isinstance(err, RESUMABLE_ERRORS):
+            return True
+        err = err.__cause__
+    return False
+
 def find_nodejs():
     if NODEJS_LOCATION and os.path.exists(NODEJS_LOCATION):
         return NODEJS_LOCATION
@@ -52,13 +78,13 @@ def find_nodejs():
 class StreamDownloader(object):
     __doc__ = 'docstring for StreamDownloader'
 
-    def __init__(self, url, filename, headers, quality='best', threads=5, options=None, del_file_error=True, reporter=None, cookies=None):
+    def __init__(self, url, filename, headers, quality='best', threads=5, options=None, del_file_error=True, reporter=None, cookies=None, bandwidth_owner=None, hls_output='pipe', remuxer='ffmpeg', resumable=False):
         self.url = url
         self.filename = filename
         self.quality = quality
         self.http_threads = threads
         self.streamlink = Streamlink()
-        default_options = {'hls-segment-attempts': 3, 'hls-segment-threads': threads, 'hls-segment-timeout': 30.0, 'dash-segment-attempts': 3, 'dash-segment-timeout': 30.0, 'ringbuffer-size': 33554432, 'http-timeout': 60, 'stream-timeout': 60, 'http-headers': headers}
+        default_options = {'hls-segment-attempts': 3, 'hls-segment-threads': threads, 'hls-segment-timeout': 30.0, 'dash-segment-attempts': 3, 'dash-segment-timeout': 30.0, 'ringbuffer-size': 33554432, 'http-timeout': 60, 'stream-timeout': 60, 'http-headers': headers, 'bandwidth-owner': bandwidth_owner, 'hls-spool-dir': filename + SPOOL_SUFFIX if resumable or hls_output == 'spool' else None}
         threads = int(threads/2)
         if threads < 1:
             threads = 1
@@ -69,14 +95,20 @@ class StreamDownloader(object):
         if cookies:
             for cookie in cookies:
                 self.streamlink.http.cookies.set(cookie['name'], cookie['value'], domain=cookie['domain'])
+        self.cache_key = stream_cache.cache_key(url, self.streamlink.http.headers, self.streamlink.http.cookies.get_dict())
         self.del_file_error = del_file_error
         self.streams = None
         self.plugin = None
+        self.cached = False
         self.reporter = reporter
+        self.bandwidth = bandwidth_scheduler.owner(bandwidth_owner)
         self.stream_fd = None
         self.stream_output = None
         self.subtitle_downloader = None
         self.http_multi_downloader = None
+        self.hls_output = hls_output
+        self.remuxer = remuxer
+        self.remux_job = None
         self.ev_close = Event()
         self.ev_close.clear()
         self.closed = False
@@ -89,8 +121,26 @@ class StreamDownloader(object):
         except:
             log.debug('Call reporter function error', exc_info=True)
 
-    def delFileError(self):
+    def canResume(self, err):
+        '''Returns True when the download, stopped or failed by a network
+        error *err*, leaves a journal or a segment spool to resume from.
+        '''
+        if not (self.closed or is_resumable_error(err)):
+            return False
+        downloader = self.http_multi_downloader
+        if (downloader is not None and downloader.journal is not None) or RangeJournal.exists(self.filename):
+            return True
+        spool_dir = self.streamlink.get_option('hls-spool-dir')
+        return bool(spool_dir) and os.path.isdir(spool_dir)
+
+    def delFileError(self, err=None):
         try:
+            if self.canResume(err):
+                log.info('Keep %s to resume download', self.filename)
+                return
+            if self.http_multi_downloader:
+                self.http_multi_downloader.discard()
+            remove_resume_files(self.filename)
             if self.del_file_error and os.path.exists(self.filename):
                 os.remove(self.filename)
         except Exception as err:
@@ -108,6 +158,8 @@ class StreamDownloader(object):
             self.subtitle_downloader.shutdown()
         if self.http_multi_downloader:
             self.http_multi_downloader.shutdown()
+        if self.remux_job:
+            self.remux_job.cancel()
 
     def close(self, wait=True):
         self.closed = True
@@ -121,10 +173,12 @@ class StreamDownloader(object):
 
     def httpStreamMultiDownload(self, stream):
         max_workers = stream.max_workers or self.http_threads
-        self.http_multi_downloader = Downloader(stream.url, self.streamlink.http, self.filename, max_workers, self.reporter, stream.args)
-        self.http_multi_downloader.run()
-        self.http_multi_downloader.wait()
-        self.http_multi_downloader.shutdown()
+        self.http_multi_downloader = Downloader(stream.url, self.streamlink.http, self.filename, max_workers, self.reporter, stream.args, self.bandwidth)
+        try:
+            self.http_multi_downloader.run()
+            self.http_multi_downloader.wait()
+        finally:
+            self.http_multi_downloader.shutdown()
 
     def getQualities(self):
         validstreams = []
@@ -150,11 +204,21 @@ class StreamDownloader(object):
                     return name
         return stream_name
 
-    def openStream(self, stream):
+    def openStream(self, stream, spool=False):
+        '''Opens *stream* and reads the first bytes of it.
+
+        With *spool* the segments of a VOD playlist are only written to
+        the spool and prebuffer is None.
+        '''
+        self.setOption('hls-spool-only', spool)
         try:
             stream_fd = stream.open()
         except StreamError as err:
             raise StreamError('Could not open stream: %s' % err)
+        finally:
+            self.setOption('hls-spool-only', False)
+        if spool and stream_fd.writer.spool:
+            return (stream_fd, None)
         try:
             log.debug('Pre-buffering 8192 bytes')
             prebuffer = stream_fd.read(8192)
@@ -166,53 +230,49 @@ class StreamDownloader(object):
             raise StreamError('No data returned from stream')
         return (stream_fd, prebuffer)
 
+    def createFFmpegOutput(self):
+        log.debug('create FFmpeg output')
+        try:
+            namedpipe = NamedPipe('streamlinkpipe_%s' % os.getpid())
+        except IOError as err:
+            raise StreamDownloaderError('Failed to create pipe %s' % err)
+        ffmpeg_exe = find_ffmpeg()
+        if not ffmpeg_exe:
+            raise StreamDownloaderError('Did not find ffmpeg')
+        args = '-i %s -y -c copy -bsf:a aac_adtstoasc "%s"' % (namedpipe.path, self.filename)
+        return PlayerOutput(ffmpeg_exe, args=args, namedpipe=namedpipe, kill=False)
+
     def createOutput(self, stream):
-        out = namedpipe = None
+        out = None
         log.debug('createOutput')
         if (isinstance(stream, HLSStream) or isinstance(stream, MuxedHLSStream)) and getattr(stream, 'toMp4', True):
-            log.debug('create FFmpeg output')
-            try:
-                namedpipe = NamedPipe('streamlinkpipe_%s' % os.getpid())
-            except IOError as err:
-                raise StreamDownloaderError('Failed to create pipe %s' % err)
-            ffmpeg_exe = find_ffmpeg()
-            if not ffmpeg_exe:
-                raise StreamDownloaderError('Did not find ffmpeg')
-            args = '-i %s -y -c copy -bsf:a aac_adtstoasc "%s"' % (namedpipe.path, self.filename)
-            out = PlayerOutput(ffmpeg_exe, args=args, namedpipe=namedpipe, kill=False)
+            if self.remuxer == 'native' and isinstance(stream, HLSStream):
+                log.debug('create native remux output')
+                out = RemuxOutput(self.filename, fallback=self.createFFmpegOutput)
+            else:
+                out = self.createFFmpegOutput()
         else:
             log.debug('FileOutput')
             out = FileOutput(self.filename)
         return out
 
     def progress(self, stream_iter, stream):
-        start = pre_time = time()
-        speeds = deque(maxlen=5)
-        etas = deque(maxlen=5)
-        bytes_recv = 0
-        total_bytes = 0
-        speed = ''
-        eta = ''
-        percent = ''
+        meter = TransferMeter()
+        counter = meter.counter()
+        pre_time = time()
         for data in stream_iter:
-            break
             yield data
-            bytes_recv += len(data)
-            total_bytes = stream.total_bytes
+            counter.value += len(data)
+            meter.total = stream.total_bytes or -1
             now = time()
-            if not self.closed or now - pre_time > 0.2:
-                speed = bytes_recv/(now - start)
-                speeds.appendleft(speed)
-                speed_avg = sum(speeds)/5
-                speed = '%s/s' % FormatFileSize(speed_avg)
-                if total_bytes:
-                    if speed_avg > 0.0:
-                        eta = (total_bytes - bytes_recv)/speed_avg
-                        etas.appendleft(eta)
-                        eta = FormatSeconds(int(sum(etas)/5))
-                    percent = FormatPercent(float(bytes_recv/total_bytes)*100.0)
+            if now - pre_time > 0.2:
                 pre_time = now
-            self.wrapCallbackError({'state': 'Downloading', 'speed': speed, 'eta': eta, 'per': percent, 'total': total_bytes, 'bytes': bytes_recv})
+                self.reportProgress(meter, counter, now)
+        self.reportProgress(meter, counter)
+
+    def reportProgress(self, meter, counter, now=None):
+        progress = meter.sample(now)
+        self.wrapCallbackError({'state': 'Downloading', 'speed': progress['speed'], 'eta': progress['eta'], 'per': progress['percent'], 'total': meter.total, 'bytes': counter.value})
 
     def readStream(self, stream, stream_fd, output, prebuffer, chunk_size=32768):
         'Reads data from stream and then writes it to the output.'
@@ -244,14 +304,65 @@ class StreamDownloader(object):
             stream_fd.close()
             log.debug('Stream ended')
 
+    def spoolStream(self, stream, stream_fd):
+        'Waits for all segments to land in the spool, then joins them into the output in one pass.'
+        writer = stream_fd.writer
+        meter = TransferMeter()
+        counter = meter.counter()
+        try:
+            while writer.is_alive() and not self.closed:
+                writer.join(0.2)
+                counter.value = writer.bytes_recv
+                meter.total = stream.total_bytes or -1
+                progress = meter.sample()
+                self.wrapCallbackError({'state': 'Downloading', 'speed': progress['speed'], 'eta': progress['eta'], 'per': progress['percent'], 'total': meter.total, 'bytes': counter.value})
+        finally:
+            stream_fd.close()
+            log.debug('Stream ended')
+        if self.closed:
+            return
+        if writer.error:
+            raise StreamDownloaderError('Error when reading from stream: %s, exiting' % writer.error) from writer.error
+        nums = [num for num in writer.spool_nums if writer.spool.has(num)]
+        if not nums:
+            raise StreamDownloaderError('No data returned from stream')
+        if len(nums) < len(writer.spool_nums):
+            log.warning('%d segments missing from the spool', len(writer.spool_nums) - len(nums))
+        (ffmpeg_exe, native) = (None, False)
+        if getattr(stream, 'toMp4', True):
+            native = self.remuxer == 'native'
+            ffmpeg_exe = find_ffmpeg()
+            if not ffmpeg_exe and not native:
+                raise StreamDownloaderError('Did not find ffmpeg')
+        self.remux(RemuxJob([writer.spool.file(num) for num in nums], self.filename, ffmpeg_exe, native))
+
+    def remux(self, job):
+        'Runs *job* on the post-processing pool, cancelling it when the download is closed.'
+        self.remux_job = job
+        self.wrapCallbackError({'state': 'Remuxing'})
+        future = post_processor.submit(job)
+        while not wait([future], 0.5).done:
+            if self.closed:
+                job.cancel()
+        try:
+            return future.result()
+        except Exception as err:
+            raise RemuxError('Failed to remux segments: %s' % err) from err
+        finally:
+            self.remux_job = None
+
     def outputStream(self, stream):
         if type(stream) == HTTPStream and isinstance(stream, HTTPStream):
             self.httpStreamMultiDownload(stream)
             return True
+        spool = self.hls_output == 'spool' and isinstance(stream, HLSStream)
         try:
-            (stream_fd, prebuffer) = self.openStream(stream)
+            (stream_fd, prebuffer) = self.openStream(stream, spool)
         except StreamError as err:
             raise StreamDownloaderError('Could not open stream %r %s' % (stream, err))
+        if prebuffer is None:
+            self.spoolStream(stream, stream_fd)
+            return True
         output = self.createOutput(stream)
         if not output:
             return False
@@ -295,7 +406,7 @@ class StreamDownloader(object):
         subtitles = plugin.subtitles()
         if not subtitles:
             return
-        self.subtitle_downloader = MultiSubtitlesDownloader(self.streamlink.http)
+        self.subtitle_downloader = MultiSubtitlesDownloader(self.streamlink.http, bandwidth=self.bandwidth)
         for (lang, subtiles_stream) in subtitles.items():
             filename = os.path.splitext(self.filename)[0] + '.%s.srt' % lang
             self.subtitle_downloader.add(subtiles_stream, filename)
@@ -306,9 +417,19 @@ class StreamDownloader(object):
         if self.streams and self.plugin:
             return
         self.streams = self.plugin = None
+        self.cached = False
         if self.closed:
             return
         self.wrapCallbackError({'state': 'analyzing'})
+        try:
+            cached = stream_cache.get(self.streamlink, self.cache_key)
+        except Exception as err:
+            log.warning('Unable to load cached streams of %s: %s', url, err)
+            cached = None
+        if cached:
+            (self.plugin, self.streams) = cached
+            self.cached = True
+            return
         try:
             self.plugin = self.streamlink.resolve_url(url)
         except NoPluginError:
@@ -325,6 +446,10 @@ class StreamDownloader(object):
             raise err
         if not self.streams:
             raise StreamDownloaderError('Streams not found on this url %s' % url)
+        try:
+            stream_cache.set(self.cache_key, self.plugin, self.streams)
+        except Exception as err:
+            log.warning('Unable to cache streams of %s: %s', url, err)
 
     def _download(self):
         self.handleUrl()
@@ -336,11 +461,35 @@ class StreamDownloader(object):
             self.subtitle_downloader.wait()
             self.subtitle_downloader.shutdown()
 
+    def invalidateStreams(self, err):
+        '''Drops the cached streams when *err* was caused by a 403 or 410
+        response, returns True when the failed streams came from the cache.
+        '''
+        status = response_status(err)
+        if status not in INVALIDATE_STATUS:
+            return False
+        log.info('Stream responded %d, invalidating cached streams of %s', status, self.url)
+        stream_cache.invalidate(self.cache_key)
+        cached = self.cached
+        self.streams = self.plugin = None
+        self.cached = False
+        return cached
+
     def download(self):
         try:
-            self._download()
+            try:
+                self._download()
+            except Exception as err:
+                if self.closed or not self.invalidateStreams(err):
+                    raise
+                log.info('Resolving %s again', self.url)
+                self._close_sub_downloader()
+                self._download()
+            spool_dir = self.streamlink.get_option('hls-spool-dir')
+            if spool_dir and not self.closed:
+                SegmentSpool.remove(spool_dir)
         except Exception as err:
-            self.delFileError()
+            self.delFileError(err)
             raise err
         finally:
             self.ev_close.set()
@@ -353,9 +502,10 @@ class StreamDownloader(object):
 class MultiSubtitlesDownloader(object):
     __doc__ = 'docstring for MultiSubtitlesDownloader'
 
-    def __init__(self, http, max_workers=3):
+    def __init__(self, http, max_workers=3, bandwidth=None):
         self.log = logging.getLogger('%s.SubDownloader' % __name__)
         self.http = http
+        self.bandwidth = bandwidth
         self.threadpool = ThreadPoolExecutor(max_workers)
         self.futures = []
         self.downloaders = []
@@ -379,7 +529,7 @@ class MultiSubtitlesDownloader(object):
                 self.log.error('Download subtitles error %s', err, exc_info=log.isEnabledFor(logging.DEBUG))
 
     def download(self, stream, filename):
-        http_multi_downloader = Downloader(stream.url, self.http, filename, 1)
+        http_multi_downloader = Downloader(stream.url, self.http, filename, 1, bandwidth=self.bandwidth)
         self.downloaders.append(http_multi_downloader)
         http_multi_downloader.run()
         http_multi_downloader.wait()
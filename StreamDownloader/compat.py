@@ -1,6 +1,7 @@
 import os
 import re
 import sys
+from threading import Lock
 is_py2 = sys.version_info[0] == 2
 is_py3 = sys.version_info[0] == 3
 is_win32 = os.name == 'nt'
@@ -31,4 +32,33 @@ def shlex_quote(s):
         return s
     return "'" + s.replace("'", '\'"\'"\'') + "'"
 
-__all__ = ['is_py2', 'is_py3', 'is_win32', 'input', 'stdout', 'file', 'shlex_quote', 'get_terminal_size']
+if hasattr(os, 'pwrite'):
+
+    def pwrite(fd, data, offset):
+        'Writes all of *data* at *offset* without moving the file position.'
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(fd, view, offset)
+            view = view[written:]
+            offset += written
+else:
+    _pwrite_lock = Lock()
+
+    def pwrite(fd, data, offset):
+        'Writes all of *data* at *offset*, seek and write under a lock where os.pwrite is missing.'
+        with _pwrite_lock:
+            os.lseek(fd, offset, os.SEEK_SET)
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+
+def preallocate(fd, size):
+    '''Reserves *size* bytes for the file, falls back to a sparse truncate.'''
+    os.ftruncate(fd, size)
+    if size and hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except OSError:
+            pass
+
+__all__ = ['is_py2', 'is_py3', 'is_win32', 'input', 'stdout', 'file', 'shlex_quote', 'get_terminal_size', 'pwrite', 'preallocate']
@@ -0,0 +1,303 @@
+import struct
+import logging
+from streamlink.packages.flashmedia.box import Box, BoxContainer, BoxPayload, RawPayload, SampleFlags, BoxPayloadFTYP, BoxPayloadMVHD, BoxPayloadTKHD, BoxPayloadMDHD, BoxPayloadHDLR, BoxPayloadVMHD, BoxPayloadDREF, BoxPayloadURL, BoxPayloadSTSD, BoxPayloadTREX, BoxPayloadMVEX, BoxPayloadTRAK, BoxPayloadMDIA, BoxPayloadMINF, BoxPayloadSTBL, BoxPayloadMOOV, BoxPayloadMOOF, BoxPayloadDINF
+from streamlink.packages.flashmedia.types import U8, U24BE
+from StreamDownloader.mpegts import TSDemuxer, UnsupportedCodecError, split_nal_units, parse_avc_sps, parse_hevc_sps, parse_adts, adts_config
+VIDEO_TIMESCALE = 90000
+AAC_FRAME_SAMPLES = 1024
+FRAGMENT_DURATION = 90000
+MAX_FRAGMENT_SIZE = 8388608
+MAX_INIT_BUFFER = 16777216
+SAMPLE_SYNC = 33554432
+SAMPLE_NON_SYNC = 16842752
+log = logging.getLogger(__name__)
+
+class FullBoxPayload(BoxPayload):
+    __doc__ = 'Payload of a full box: version, flags and the already packed fields in *data*.'
+
+    def __init__(self, version=0, flags=0, data=b''):
+        self.version = version
+        self.flags = flags
+        self.data = data
+
+    @property
+    def size(self):
+        return 4 + len(self.data)
+
+    def _serialize(self, packet):
+        packet += U8(self.version)
+        packet += U24BE(self.flags)
+        packet += self.data
+
+class BoxPayloadSampleEntry(BoxContainer):
+    __doc__ = 'Sample entry of an stsd box: the packed fields of the entry followed by its boxes.'
+
+    def __init__(self, fields, boxes):
+        self.fields = fields
+        self.boxes = boxes
+
+    @property
+    def size(self):
+        return len(self.fields) + BoxContainer.size.fget(self)
+
+    def _serialize(self, packet):
+        packet += self.fields
+        BoxContainer._serialize(self, packet)
+
+class BoxPayloadTRUN(FullBoxPayload):
+    __doc__ = 'Track fragment run of samples given as (duration, size, flags, composition offset).'
+
+    def __init__(self, samples, composition=False):
+        flags = 1793 | (2048 if composition else 0)
+        fmt = '>IIIi' if composition else '>III'
+        data = b''.join(struct.pack(fmt, *sample[:4 if composition else 3]) for sample in samples)
+        FullBoxPayload.__init__(self, 1, flags, struct.pack('>Ii', len(samples), 0) + data)
+
+    def set_data_offset(self, offset):
+        self.data = self.data[:4] + struct.pack('>i', offset) + self.data[8:]
+
+class Track(object):
+    __doc__ = """Samples of one elementary stream waiting to be written.
+
+    Sample times are kept in 90 kHz units until the fragment is written,
+    *entry* is the stsd sample entry, known once the codec configuration
+    has been seen in the stream.
+    """
+
+    def __init__(self, track_id, codec):
+        self.id = track_id
+        self.codec = codec
+        self.video = codec != 'aac'
+        self.timescale = VIDEO_TIMESCALE
+        self.entry = None
+        self.width = 0
+        self.height = 0
+        self.samples = []
+        self.next_time = None
+        self.next_decode = None
+        self.last_duration = 3000
+        self.parameter_sets = {}
+        self._adts = b''
+
+    def video_sample(self, pts, dts, payload):
+        'Returns the (dts, composition offset, data, keyframe) sample of a video PES packet.'
+        units = split_nal_units(payload)
+        if self.codec == 'h264':
+            types = [unit[0] & 31 for unit in units]
+            (skip, key) = ((9,), 5 in types)
+            for (kind, unit) in zip(types, units):
+                if kind in (7, 8):
+                    self.parameter_sets.setdefault(kind, unit)
+        else:
+            types = [unit[0] >> 1 & 63 for unit in units]
+            (skip, key) = ((35,), any(16 <= kind <= 21 for kind in types))
+            for (kind, unit) in zip(types, units):
+                if kind in (32, 33, 34):
+                    self.parameter_sets.setdefault(kind, unit)
+        if self.entry is None and key:
+            self._video_entry()
+        if self.entry is None or not self.samples and not key and self.next_decode is None:
+            return
+        data = b''.join(struct.pack('>I', len(unit)) + unit for (kind, unit) in zip(types, units) if kind not in skip)
+        return (dts, pts - dts, data, key)
+
+    def _video_entry(self):
+        sets = self.parameter_sets
+        if self.codec == 'h264':
+            if 7 not in sets or 8 not in sets:
+                return
+            info = parse_avc_sps(sets[7])
+            config = Box('avcC', RawPayload(bytes((1, info['profile'], info['compatibility'], info['level'], 255, 225)) + struct.pack('>H', len(sets[7])) + sets[7] + b'\x01' + struct.pack('>H', len(sets[8])) + sets[8]))
+            name = 'avc1'
+        else:
+            if 32 not in sets or 33 not in sets or 34 not in sets:
+                return
+            info = parse_hevc_sps(sets[33])
+            fields = bytes((1,)) + info['profile_tier_level'] + struct.pack('>HBBBBHB', 61440, 252, 252 | info['chroma_format'], 248 | info['depth_luma'] - 8, 248 | info['depth_chroma'] - 8, 0, info['sub_layers'] << 3 | info['nesting'] << 2 | 3)
+            fields += bytes((3,)) + b''.join(struct.pack('>BHH', 128 | kind, 1, len(sets[kind])) + sets[kind] for kind in (32, 33, 34))
+            config = Box('hvcC', RawPayload(fields))
+            name = 'hev1'
+        (self.width, self.height) = (info['width'], info['height'])
+        fields = struct.pack('>6xH16xHHIIIH32sHh', 1, self.width, self.height, 4718592, 4718592, 0, 1, b'', 24, -1)
+        self.entry = Box(name, BoxPayloadSampleEntry(fields, [config]))
+
+    def add_audio(self, pts, payload):
+        if pts is not None and not self._adts:
+            self.next_time = pts
+        (frames, pos) = parse_adts(self._adts + payload)
+        self._adts = (self._adts + payload)[pos:]
+        if not frames or self.next_time is None:
+            return 0
+        if self.entry is None:
+            (config, rate, channels) = adts_config(frames[0][0])
+            self.timescale = rate
+            esds = b'\x03' + bytes((23 + len(config),)) + struct.pack('>HB', self.id, 0)
+            esds += b'\x04' + bytes((15 + len(config),)) + struct.pack('>BB3sII', 64, 21, b'', 0, 0) + b'\x05' + bytes((len(config),)) + config + b'\x06\x01\x02'
+            fields = struct.pack('>6xH8xHHHHI', 1, channels, 16, 0, 0, (rate if rate < 65536 else 0) << 16)
+            self.entry = Box('mp4a', BoxPayloadSampleEntry(fields, [Box('esds', FullBoxPayload(data=esds))]))
+        step = AAC_FRAME_SAMPLES*90000.0/self.timescale
+        size = 0
+        for (header, data) in frames:
+            self.samples.append((self.next_time, 0, data, True))
+            self.next_time += step
+            size += len(data)
+        return size
+
+    def take(self, until=None):
+        'Removes and returns the samples before *until* (90 kHz), all when None.'
+        if until is None or not self.samples or self.samples[-1][0] < until:
+            (samples, self.samples) = (self.samples, [])
+            return samples
+        for (i, sample) in enumerate(self.samples):
+            if sample[0] >= until:
+                break
+        (samples, self.samples) = (self.samples[:i], self.samples[i:])
+        return samples
+
+    def run(self, samples, base, until=None):
+        'Returns the decode time and (duration, size, flags, offset) entries of *samples*.'
+        if self.video:
+            times = [round(sample[0]) - base for sample in samples]
+            decode = times[0]
+            if self.next_decode is not None and decode < self.next_decode:
+                decode = self.next_decode
+            ends = times[1:] + [round(until) - base if until is not None else times[-1] + self.last_duration]
+            entries = []
+            time = decode
+            for (sample, end) in zip(samples, ends):
+                duration = max(1, end - time)
+                entries.append((duration, len(sample[2]), SAMPLE_SYNC if sample[3] else SAMPLE_NON_SYNC, round(sample[1])))
+                time += duration
+            self.last_duration = entries[-1][0]
+        else:
+            decode = round((samples[0][0] - base)*self.timescale/90000.0)
+            if self.next_decode is not None and abs(decode - self.next_decode) < AAC_FRAME_SAMPLES:
+                decode = self.next_decode
+            entries = [(AAC_FRAME_SAMPLES, len(sample[2]), SAMPLE_SYNC, 0) for sample in samples]
+            time = decode + AAC_FRAME_SAMPLES*len(samples)
+        self.next_decode = time
+        return (decode, entries)
+
+    def trak(self):
+        if self.video:
+            (handler, name, header) = ('vide', 'VideoHandler', Box('vmhd', BoxPayloadVMHD()))
+        else:
+            (handler, name, header) = ('soun', 'SoundHandler', Box('smhd', FullBoxPayload(data=bytes(4))))
+        tables = [Box('stsd', BoxPayloadSTSD(descriptions=[self.entry])), Box('stts', FullBoxPayload(data=bytes(4))), Box('stsc', FullBoxPayload(data=bytes(4))), Box('stsz', FullBoxPayload(data=bytes(8))), Box('stco', FullBoxPayload(data=bytes(4)))]
+        minf = [header, Box('dinf', BoxPayloadDINF(Box('dref', BoxPayloadDREF(boxes=[Box('url ', BoxPayloadURL())])))), Box('stbl', BoxPayloadSTBL(tables))]
+        mdia = [Box('mdhd', BoxPayloadMDHD(time_scale=self.timescale, language='und')), Box('hdlr', BoxPayloadHDLR(handler_type=handler, name=name)), Box('minf', BoxPayloadMINF(minf))]
+        tkhd = BoxPayloadTKHD(flags=3, track_id=self.id, volume=0.0 if self.video else 1.0, width=self.width, height=self.height)
+        return Box('trak', BoxPayloadTRAK([Box('tkhd', tkhd), Box('mdia', BoxPayloadMDIA(mdia))]))
+
+class TSRemuxer(object):
+    __doc__ = """Remuxes MPEG-TS with H.264/H.265 video and AAC audio into fragmented MP4.
+
+    Data is fed as it arrives and written to *out* one fragment per GOP
+    of at least FRAGMENT_DURATION (every FRAGMENT_DURATION for audio
+    only streams), so memory is bounded by a fragment and the samples
+    buffered until the codec configuration of every track is known.
+    feed() raises UnsupportedCodecError, before anything is written,
+    when the stream has another audio or video codec.
+    """
+
+    def __init__(self, out):
+        self.out = out
+        self.demuxer = TSDemuxer(self._on_streams, self._on_pes)
+        self.tracks = {}
+        self.order = []
+        self.started = False
+        self.base = None
+        self.sequence = 0
+        self.pending = 0
+        self.fragments = 0
+
+    def feed(self, data):
+        self.demuxer.feed(data)
+
+    def _on_streams(self, streams):
+        pids = sorted(streams, key=lambda pid: (streams[pid] == 'aac', pid))
+        if not pids:
+            raise UnsupportedCodecError('No H.264, H.265 or AAC stream')
+        for (i, pid) in enumerate(pids):
+            self.tracks[pid] = Track(i + 1, streams[pid])
+        self.order = [self.tracks[pid] for pid in pids]
+
+    def _on_pes(self, pid, pts, dts, payload):
+        track = self.tracks.get(pid)
+        if track is None:
+            return
+        if track.video:
+            sample = track.video_sample(pts, dts, payload) if pts is not None else None
+            if sample is None:
+                return
+            if self.started and track.samples and self._cut(track, sample):
+                self._fragment(sample[0])
+            track.samples.append(sample)
+            self.pending += len(sample[2])
+        else:
+            self.pending += track.add_audio(pts, payload)
+            if self.started and not self.order[0].video and track.samples and track.samples[-1][0] - track.samples[0][0] >= FRAGMENT_DURATION:
+                self._fragment(None)
+        if not self.started:
+            self._start()
+
+    def _cut(self, track, sample):
+        'Whether a fragment ends before *sample*, on a keyframe unless the fragment grows too big.'
+        if sample[3]:
+            return sample[0] - track.samples[0][0] >= FRAGMENT_DURATION or self.pending >= MAX_FRAGMENT_SIZE
+        return self.pending >= MAX_FRAGMENT_SIZE*2
+
+    def _start(self, force=False):
+        ready = [track for track in self.order if track.entry is not None]
+        if len(ready) < len(self.order) and not force and self.pending < MAX_INIT_BUFFER:
+            return
+        if not ready:
+            return
+        for track in self.order:
+            if track.entry is None:
+                log.warning('Dropping track %d (%s), its codec configuration was not found', track.id, track.codec)
+        self.order = ready
+        self.tracks = {pid: track for (pid, track) in self.tracks.items() if track in ready}
+        self.base = min(track.samples[0][0] for track in ready if track.samples)
+        mvex = Box('mvex', BoxPayloadMVEX([Box('trex', BoxPayloadTREX(0, track.id, 1, 0, 0, SampleFlags(0, 0, 0, 0, 0, 0))) for track in ready]))
+        moov = Box('moov', BoxPayloadMOOV([Box('mvhd', BoxPayloadMVHD(time_scale=1000, next_track_id=len(ready) + 1))] + [track.trak() for track in ready] + [mvex]))
+        self.out.write(Box('ftyp', BoxPayloadFTYP('isom', 512, ['isom', 'iso6', 'iso2', 'avc1', 'mp41'])).serialize())
+        self.out.write(moov.serialize())
+        self.started = True
+
+    def _fragment(self, until):
+        '''Writes the pending samples before *until* (90 kHz) as one moof and mdat.'''
+        (trafs, runs, chunks) = ([], [], [])
+        size = 0
+        for track in self.order:
+            samples = track.take(None if track.video else until)
+            if not samples:
+                continue
+            (decode, entries) = track.run(samples, self.base, until)
+            trun = BoxPayloadTRUN(entries, track.video)
+            runs.append((trun, size))
+            trafs.append(Box('traf', BoxContainer([Box('tfhd', FullBoxPayload(0, 131072, struct.pack('>I', track.id))), Box('tfdt', FullBoxPayload(1, 0, struct.pack('>Q', decode))), Box('trun', trun)])))
+            for sample in samples:
+                chunks.append(sample[2])
+                size += len(sample[2])
+        if not trafs:
+            return
+        self.sequence += 1
+        moof = Box('moof', BoxPayloadMOOF([Box('mfhd', FullBoxPayload(data=struct.pack('>I', self.sequence)))] + trafs))
+        for (trun, offset) in runs:
+            trun.set_data_offset(moof.size + 8 + offset)
+        self.out.write(moof.serialize())
+        self.out.write(struct.pack('>I4s', size + 8, b'mdat'))
+        for chunk in chunks:
+            self.out.write(chunk)
+        self.pending = sum(len(sample[2]) for track in self.order for sample in track.samples)
+        self.fragments += 1
+
+    def close(self):
+        'Writes what is left of the stream, the output stays open.'
+        self.demuxer.flush()
+        if not self.started:
+            self._start(force=True)
+        if self.started:
+            self._fragment(None)
+__all__ = ['TSRemuxer', 'UnsupportedCodecError']
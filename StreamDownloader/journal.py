@@ -0,0 +1,158 @@
+import os
+import json
+import logging
+from time import time
+from threading import Lock
+JOURNAL_SUFFIX = '.journal'
+JOURNAL_SAVE_INTERVAL = 2.0
+log = logging.getLogger(__name__)
+
+def merge_ranges(ranges):
+    'Sorts and merges overlapping or adjacent [start, end) ranges.'
+    merged = []
+    for (start, end) in sorted(ranges):
+        if end <= start:
+            continue
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return merged
+
+class RangePiece(object):
+    __doc__ = """A byte range [start, end) being written.
+
+    *pos* is the end of the data already flushed, *cursor* the end of the
+    data received. *twin* is the duplicate of the piece in end-game mode.
+    """
+    __slots__ = ('start', 'end', 'pos', 'cursor', 'twin', 'response', 'cancelled')
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        self.pos = start
+        self.cursor = start
+        self.twin = None
+        self.response = None
+        self.cancelled = False
+
+    def remaining(self):
+        return self.end - self.cursor
+
+class RangeJournal(object):
+    __doc__ = """Sidecar file recording which byte ranges of a download are on disk.
+
+    The journal is bound to the remote file by its size, ETag and
+    Last-Modified. Ranges are saved only after the data file is fsynced,
+    so a crash never marks bytes which were not written.
+    """
+
+    def __init__(self, file, size, etag=None, last_modified=None):
+        self.file = file
+        self.path = file + JOURNAL_SUFFIX
+        self.size = size
+        self.etag = etag
+        self.last_modified = last_modified
+        self.completed = []
+        self.pieces = set()
+        self._lock = Lock()
+        self._saved = None
+        self._saved_at = 0
+
+    @classmethod
+    def exists(cls, file):
+        return os.path.exists(file + JOURNAL_SUFFIX)
+
+    @classmethod
+    def delete(cls, file):
+        'Removes the journal of *file*, returns True when there was one.'
+        journal = cls(file, 0)
+        if not os.path.exists(journal.path):
+            return False
+        journal.remove()
+        return True
+
+    @classmethod
+    def load(cls, file, size, etag=None, last_modified=None):
+        '''Returns the journal of *file* if it matches the remote file, otherwise None.'''
+        path = file + JOURNAL_SUFFIX
+        try:
+            with open(path, 'r') as fd:
+                data = json.load(fd)
+            if not os.path.exists(file) or os.path.getsize(file) != size:
+                return
+        except (IOError, OSError, ValueError):
+            return
+        if data.get('size') != size:
+            log.debug('Journal %s size changed, restart download', path)
+            return
+        for (key, value) in (('etag', etag), ('last_modified', last_modified)):
+            if data.get(key) and data.get(key) != value:
+                log.debug('Journal %s %s changed, restart download', path, key)
+                return
+        journal = cls(file, size, etag, last_modified)
+        journal.completed = merge_ranges((start, min(end, size)) for (start, end) in data.get('ranges', []))
+        journal._saved = journal.completed
+        return journal
+
+    def track(self, piece):
+        with self._lock:
+            self.pieces.add(piece)
+        return piece
+
+    def finish(self, piece):
+        with self._lock:
+            self.pieces.discard(piece)
+            self.completed = merge_ranges(self.completed + [[piece.start, piece.pos]])
+
+    def snapshot(self):
+        with self._lock:
+            return merge_ranges(self.completed + [[p.start, p.pos] for p in self.pieces])
+
+    def done_bytes(self):
+        return sum(end - start for (start, end) in self.snapshot())
+
+    def missing(self):
+        'Returns the [start, end) ranges which are not on disk yet.'
+        missing = []
+        pos = 0
+        for (start, end) in self.snapshot():
+            if start > pos:
+                missing.append((pos, start))
+            pos = max(pos, end)
+        if pos < self.size:
+            missing.append((pos, self.size))
+        return missing
+
+    def save(self):
+        ranges = self.snapshot()
+        if ranges == self._saved:
+            return
+        try:
+            fd = os.open(self.file, os.O_RDWR)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'size': self.size, 'etag': self.etag, 'last_modified': self.last_modified, 'ranges': ranges}, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self._saved = ranges
+            self._saved_at = time()
+        except (IOError, OSError) as err:
+            log.warning('Save journal %s error %s', self.path, err)
+
+    def maybe_save(self, interval=JOURNAL_SAVE_INTERVAL):
+        if time() - self._saved_at >= interval:
+            self.save()
+
+    def remove(self):
+        try:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+        except OSError as err:
+            log.warning('Remove journal %s error %s', self.path, err)
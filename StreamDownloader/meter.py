@@ -0,0 +1,75 @@
+from time import time
+from threading import Lock
+SPEED_HALF_LIFE = 3.0
+
+class ByteCounter(object):
+    __doc__ = 'Bytes received by one connection, only written by the thread owning it.'
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+class TransferMeter(object):
+    __doc__ = """Progress of a transfer aggregated from per-connection counters.
+
+    Connections only increment their own ByteCounter, the totals, speed
+    and ETA are computed when sample() is called by the reporter. Speed
+    is an exponentially weighted moving average over the real time
+    between samples, halving the weight of older samples every
+    *half_life* seconds. All values are raw numbers, formatting is left
+    to the caller.
+    """
+
+    def __init__(self, total=-1, initial=0, half_life=SPEED_HALF_LIFE):
+        self.total = total
+        self.initial = initial
+        self.half_life = half_life
+        self.counters = []
+        self.speed = None
+        self._lock = Lock()
+        self._last_bytes = initial
+        self._last_time = time()
+
+    def counter(self):
+        counter = ByteCounter()
+        with self._lock:
+            self.counters.append(counter)
+        return counter
+
+    def resume(self, initial):
+        'Counts *initial* bytes as done without taking them into the speed.'
+        with self._lock:
+            self._last_bytes += initial - self.initial
+            self.initial = initial
+
+    def received(self):
+        'Bytes received in this session, without the initial bytes.'
+        return sum(counter.value for counter in list(self.counters))
+
+    def bytes(self):
+        return self.initial + self.received()
+
+    def sample(self, now=None):
+        '''Returns a dict of bytes, total, speed (bytes/s), eta (seconds) and percent.
+
+        Speed, eta and percent are None until they are known.
+        '''
+        now = now or time()
+        num = self.bytes()
+        with self._lock:
+            elapsed = now - self._last_time
+            if elapsed > 0:
+                rate = (num - self._last_bytes)/elapsed
+                if self.speed is None:
+                    self.speed = rate
+                else:
+                    self.speed += (1 - 0.5**(elapsed/self.half_life))*(rate - self.speed)
+                self._last_bytes = num
+                self._last_time = now
+            speed = self.speed
+        (eta, percent) = (None, None)
+        if self.total > 0:
+            percent = min(100.0, num*100.0/self.total)
+            if speed:
+                eta = max(0.0, (self.total - num)/speed)
+        return {'bytes': num, 'total': self.total, 'speed': speed, 'eta': eta, 'percent': percent}
@@ -0,0 +1,285 @@
+import logging
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE = 71
+PTS_WRAP = 1 << 33
+PTS_HALF = 1 << 32
+STREAM_TYPES = {27: 'h264', 36: 'h265', 15: 'aac'}
+UNSUPPORTED_STREAM_TYPES = {1: 'mpeg1video', 2: 'mpeg2video', 3: 'mp3', 4: 'mp3', 16: 'mpeg4', 17: 'aac_latm', 129: 'ac3', 135: 'eac3', 234: 'vc1'}
+ADTS_SAMPLE_RATES = (96000, 88200, 64000, 48000, 44100, 32000, 24000, 22050, 16000, 12000, 11025, 8000, 7350)
+log = logging.getLogger(__name__)
+
+class UnsupportedCodecError(Exception):
+    pass
+
+class TSDemuxer(object):
+    __doc__ = """Streaming MPEG-TS demuxer.
+
+    Data is fed in chunks of any size, only an incomplete packet and the
+    PES packets being assembled are kept. *on_streams* is called with a
+    dict of pid: codec once the PMT is read, then *on_pes* with the pid,
+    PTS, DTS and payload of every complete PES packet. Timestamps are in
+    90 kHz units and unwrapped, so they keep growing past 2**33.
+    """
+
+    def __init__(self, on_streams, on_pes):
+        self.on_streams = on_streams
+        self.on_pes = on_pes
+        self.pmt_pid = None
+        self.streams = None
+        self.resyncs = 0
+        self._pending = b''
+        self._pes = {}
+        self._last_ts = {}
+        self._wrap = {}
+
+    def feed(self, data):
+        buf = self._pending + data if self._pending else bytes(data)
+        (pos, end) = (0, len(buf))
+        while pos + TS_PACKET_SIZE <= end:
+            if buf[pos] != TS_SYNC_BYTE:
+                pos = buf.find(b'G', pos + 1)
+                self.resyncs += 1
+                if pos < 0:
+                    pos = end
+                continue
+            b1 = buf[pos + 1]
+            pid = (b1 & 31) << 8 | buf[pos + 2]
+            control = buf[pos + 3] >> 4 & 3
+            start = pos + 4
+            if control & 2:
+                start += 1 + buf[start]
+            stop = pos + TS_PACKET_SIZE
+            if control & 1 and start < stop:
+                self._payload(pid, b1 & 64, buf[start:stop])
+            pos = stop
+        self._pending = buf[pos:]
+
+    def _payload(self, pid, unit_start, payload):
+        if pid in self._pes:
+            chunks = self._pes[pid]
+            if unit_start:
+                if chunks:
+                    self._emit(pid, b''.join(chunks))
+                self._pes[pid] = [payload]
+            elif chunks:
+                chunks.append(payload)
+        elif pid == 0:
+            if unit_start:
+                self._read_pat(payload[1 + payload[0]:])
+        elif pid == self.pmt_pid:
+            if unit_start:
+                self._read_pmt(payload[1 + payload[0]:])
+
+    def _read_pat(self, section):
+        length = (section[1] & 15) << 8 | section[2]
+        for pos in range(8, min(3 + length - 4, len(section) - 3), 4):
+            program = section[pos] << 8 | section[pos + 1]
+            if program:
+                self.pmt_pid = (section[pos + 2] & 31) << 8 | section[pos + 3]
+                return
+
+    def _read_pmt(self, section):
+        if self.streams is not None:
+            return
+        end = min(3 + ((section[1] & 15) << 8 | section[2]) - 4, len(section))
+        pos = 12 + ((section[10] & 15) << 8 | section[11])
+        streams = {}
+        while pos + 5 <= end:
+            stream_type = section[pos]
+            pid = (section[pos + 1] & 31) << 8 | section[pos + 2]
+            pos += 5 + ((section[pos + 3] & 15) << 8 | section[pos + 4])
+            if stream_type in STREAM_TYPES:
+                streams[pid] = STREAM_TYPES[stream_type]
+            elif stream_type in UNSUPPORTED_STREAM_TYPES:
+                raise UnsupportedCodecError('Unsupported codec %s' % UNSUPPORTED_STREAM_TYPES[stream_type])
+        self.streams = streams
+        for pid in streams:
+            self._pes[pid] = None
+        self.on_streams(streams)
+
+    def _unwrap(self, pid, ts):
+        last = self._last_ts.get(pid)
+        wrap = self._wrap.get(pid, 0)
+        if last is not None:
+            if ts + wrap < last - PTS_HALF:
+                wrap += PTS_WRAP
+            elif ts + wrap > last + PTS_HALF and wrap:
+                wrap -= PTS_WRAP
+            self._wrap[pid] = wrap
+        ts += wrap
+        self._last_ts[pid] = ts
+        return ts
+
+    def _emit(self, pid, data):
+        if len(data) < 9 or data[0] or data[1] or data[2] != 1:
+            return
+        flags = data[7]
+        (pts, dts) = (None, None)
+        if flags & 128:
+            pts = dts = self._unwrap(pid, read_timestamp(data, 9))
+        if flags & 64:
+            dts = self._unwrap(pid, read_timestamp(data, 14))
+        self.on_pes(pid, pts, dts, data[9 + data[8]:])
+
+    def flush(self):
+        'Emits the PES packets still being assembled, call it at the end of the stream.'
+        for (pid, chunks) in self._pes.items():
+            if chunks:
+                self._emit(pid, b''.join(chunks))
+            self._pes[pid] = None
+
+def read_timestamp(data, pos):
+    return (data[pos] >> 1 & 7) << 30 | data[pos + 1] << 22 | (data[pos + 2] >> 1) << 15 | data[pos + 3] << 7 | data[pos + 4] >> 1
+
+def split_nal_units(data):
+    'Splits an Annex B byte stream into NAL units, without start codes.'
+    units = []
+    start = data.find(b'\x00\x00\x01')
+    while start >= 0:
+        start += 3
+        end = data.find(b'\x00\x00\x01', start)
+        if end < 0:
+            unit = data[start:]
+        else:
+            unit = data[start:end].rstrip(b'\x00')
+        if unit:
+            units.append(unit)
+        start = end
+    return units
+
+class BitReader(object):
+    __doc__ = 'Reads bits and Exp-Golomb codes from the RBSP of a NAL unit.'
+
+    def __init__(self, data):
+        data = data.replace(b'\x00\x00\x03', b'\x00\x00')
+        self.value = int.from_bytes(data, 'big')
+        self.bits = len(data)*8
+        self.pos = 0
+
+    def read(self, n):
+        if self.pos + n > self.bits:
+            raise ValueError('Read past the end of NAL unit')
+        self.pos += n
+        return self.value >> self.bits - self.pos & (1 << n) - 1
+
+    def skip(self, n):
+        self.pos += n
+
+    def ue(self):
+        zeros = 0
+        while not self.read(1):
+            zeros += 1
+        return (1 << zeros) - 1 + self.read(zeros)
+
+    def se(self):
+        value = self.ue()
+        return (value + 1)//2 if value & 1 else -(value//2)
+
+def parse_avc_sps(nal):
+    'Returns the profile, compatibility, level, width and height of an H.264 SPS.'
+    r = BitReader(nal[1:])
+    (profile, compatibility, level) = (r.read(8), r.read(8), r.read(8))
+    r.ue()
+    chroma_format = 1
+    if profile in (100, 110, 122, 244, 44, 83, 86, 118, 128, 138, 139, 134, 135):
+        chroma_format = r.ue()
+        if chroma_format == 3:
+            r.skip(1)
+        r.ue()
+        r.ue()
+        r.skip(1)
+        if r.read(1):
+            for i in range(8 if chroma_format != 3 else 12):
+                if r.read(1):
+                    (last, delta_scale) = (8, 8)
+                    for j in range(16 if i < 6 else 64):
+                        if delta_scale:
+                            delta_scale = (last + r.se()) % 256
+                        last = delta_scale or last
+    r.ue()
+    poc_type = r.ue()
+    if poc_type == 0:
+        r.ue()
+    elif poc_type == 1:
+        r.skip(1)
+        r.se()
+        r.se()
+        for i in range(r.ue()):
+            r.se()
+    r.ue()
+    r.skip(1)
+    width = (r.ue() + 1)*16
+    height_units = r.ue() + 1
+    frame_mbs_only = r.read(1)
+    height = height_units*16*(2 - frame_mbs_only)
+    if not frame_mbs_only:
+        r.skip(1)
+    r.skip(1)
+    if r.read(1):
+        (crop_x, crop_y) = (1, 2 - frame_mbs_only)
+        if chroma_format:
+            crop_x = 2 if chroma_format in (1, 2) else 1
+            crop_y *= 2 if chroma_format == 1 else 1
+        width -= (r.ue() + r.ue())*crop_x
+        height -= (r.ue() + r.ue())*crop_y
+    return {'profile': profile, 'compatibility': compatibility, 'level': level, 'width': width, 'height': height}
+
+def parse_hevc_sps(nal):
+    'Returns the profile_tier_level bytes, chroma format, bit depths, width and height of an H.265 SPS.'
+    rbsp = nal[2:24].replace(b'\x00\x00\x03', b'\x00\x00')
+    r = BitReader(nal[2:])
+    r.skip(4)
+    sub_layers = r.read(3)
+    nesting = r.read(1)
+    r.skip(96)
+    (profile_present, level_present) = ([], [])
+    for i in range(sub_layers):
+        profile_present.append(r.read(1))
+        level_present.append(r.read(1))
+    if sub_layers:
+        r.skip(2*(8 - sub_layers))
+    for i in range(sub_layers):
+        if profile_present[i]:
+            r.skip(88)
+        if level_present[i]:
+            r.skip(8)
+    r.ue()
+    chroma_format = r.ue()
+    if chroma_format == 3:
+        r.skip(1)
+    (width, height) = (r.ue(), r.ue())
+    if r.read(1):
+        (sub_x, sub_y) = (2 if chroma_format in (1, 2) else 1, 2 if chroma_format == 1 else 1)
+        width -= (r.ue() + r.ue())*sub_x
+        height -= (r.ue() + r.ue())*sub_y
+    (depth_luma, depth_chroma) = (r.ue() + 8, r.ue() + 8)
+    return {'profile_tier_level': rbsp[1:13], 'sub_layers': sub_layers + 1, 'nesting': nesting, 'chroma_format': chroma_format, 'depth_luma': depth_luma, 'depth_chroma': depth_chroma, 'width': width, 'height': height}
+
+def parse_adts(data):
+    '''Returns the (header, payload) of the complete ADTS frames in *data*
+    and the position of the incomplete frame following them.
+    '''
+    (frames, pos, end) = ([], 0, len(data))
+    while pos + 7 <= end:
+        if data[pos] != 255 or data[pos + 1] & 246 != 240:
+            pos += 1
+            continue
+        length = (data[pos + 3] & 3) << 11 | data[pos + 4] << 3 | data[pos + 5] >> 5
+        header = 7 if data[pos + 1] & 1 else 9
+        if length < header:
+            pos += 1
+            continue
+        if pos + length > end:
+            break
+        frames.append((data[pos:pos + header], data[pos + header:pos + length]))
+        pos += length
+    return (frames, pos)
+
+def adts_config(header):
+    'Returns the AudioSpecificConfig, sample rate and channel count of an ADTS header.'
+    object_type = (header[2] >> 6) + 1
+    rate_index = header[2] >> 2 & 15
+    channels = (header[2] & 1) << 2 | header[3] >> 6
+    config = bytes((object_type << 3 | rate_index >> 1, (rate_index & 1) << 7 | channels << 3))
+    return (config, ADTS_SAMPLE_RATES[rate_index], channels)
+__all__ = ['TSDemuxer', 'UnsupportedCodecError', 'split_nal_units', 'parse_avc_sps', 'parse_hevc_sps', 'parse_adts', 'adts_config']
@@ -7,6 +7,7 @@ from time import sleep
 from streamlink.utils.encoding import get_filesystem_encoding, maybe_encode, maybe_decode
 from StreamDownloader.compat import is_win32, stdout
 from StreamDownloader.constants import DEFAULT_PLAYER_ARGUMENTS, SUPPORTED_PLAYERS
+from StreamDownloader.fmp4 import TSRemuxer, UnsupportedCodecError, MAX_INIT_BUFFER
 from contextlib import contextmanager
 
 @contextmanager
@@ -75,6 +76,68 @@ class FileOutput(Output):
         if self.record:
             self.record.write(data)
 
+class RemuxOutput(Output):
+    __doc__ = """Writes an MPEG-TS stream remuxed to MP4 without ffmpeg.
+
+    The first chunks, at most 16 MiB, are kept until the codecs of the
+    stream are known, when they are not supported *fallback* is called
+    to create the output used instead and the kept chunks are written
+    to it.
+    """
+    MAX_HEAD_SIZE = MAX_INIT_BUFFER
+
+    def __init__(self, filename, fallback=None):
+        super(RemuxOutput, self).__init__()
+        self.filename = filename
+        self.fallback = fallback
+        self.fd = None
+        self.remuxer = None
+        self.output = None
+        self._head = []
+        self._head_size = 0
+
+    def _open(self):
+        self.fd = open(self.filename, 'wb')
+        self.remuxer = TSRemuxer(self.fd)
+
+    def _close(self):
+        if self.output:
+            self.output.close()
+        elif self.fd:
+            try:
+                self.remuxer.close()
+            finally:
+                self.fd.close()
+
+    def _fall_back(self, reason):
+        if not self.fallback:
+            raise IOError(reason)
+        log.info('{0}, remuxing with ffmpeg', reason)
+        self.fd.close()
+        self.fd = self.remuxer = None
+        self.output = self.fallback()
+        self.output.open()
+        for data in self._head:
+            self.output.write(data)
+        self._head = None
+
+    def _write(self, data):
+        if self.output:
+            return self.output.write(data)
+        if self._head is not None:
+            self._head.append(data)
+            self._head_size += len(data)
+        try:
+            self.remuxer.feed(data)
+        except UnsupportedCodecError as err:
+            return self._fall_back(str(err))
+        if self._head is None:
+            return
+        if self.remuxer.demuxer.streams is not None:
+            self._head = None
+        elif self._head_size > self.MAX_HEAD_SIZE:
+            self._fall_back('No program map found in the stream')
+
 class PlayerOutput(Output):
     PLAYER_TERMINATE_TIMEOUT = 10.0
 
@@ -255,4 +318,4 @@ class PlayerOutput(Output):
         else:
             self.player.stdin.write(data)
 
-__all__ = ['PlayerOutput', 'FileOutput']
+__all__ = ['PlayerOutput', 'FileOutput', 'RemuxOutput']
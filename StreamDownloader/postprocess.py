@@ -0,0 +1,143 @@
+import os
+import logging
+import tempfile
+import subprocess
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
+from StreamDownloader.fmp4 import TSRemuxer, UnsupportedCodecError
+REMUX_CHUNK_SIZE = 1048576
+log = logging.getLogger(__name__)
+
+class PostProcessor(object):
+    __doc__ = """Bounded pool running the final remux of spooled downloads.
+
+    Remuxing is bound by CPU and disk, so at most *workers* jobs run at
+    a time however many downloads finish together, the others wait in
+    the queue. *workers* defaults to the number of CPU cores.
+    """
+
+    def __init__(self, workers=0):
+        self.workers = None
+        self.executor = None
+        self.pending = 0
+        self.done = 0
+        self._lock = Lock()
+        self.configure(workers)
+
+    def configure(self, workers=0):
+        'Sets the number of parallel jobs, 0 is the number of CPU cores.'
+        workers = workers or os.cpu_count() or 1
+        with self._lock:
+            if workers == self.workers:
+                return
+            if self.executor:
+                self.executor.shutdown(wait=False)
+            self.workers = workers
+            self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='PostProcess')
+
+    def submit(self, job):
+        'Queues *job*, returns a future of its result.'
+        with self._lock:
+            self.pending += 1
+            return self.executor.submit(self._run, job)
+
+    def _run(self, job):
+        try:
+            return job.run()
+        finally:
+            with self._lock:
+                self.pending -= 1
+                self.done += 1
+
+    def stats(self):
+        with self._lock:
+            return {'workers': self.workers, 'pending': self.pending, 'done': self.done}
+
+class RemuxJob(object):
+    __doc__ = """Joins the spooled segments of a download into its output file.
+
+    With *ffmpeg* the segments are fed in order to the stdin of one
+    ``ffmpeg -c copy`` process, without it they are concatenated as is.
+    With *native* they are remuxed by TSRemuxer, falling back to ffmpeg
+    when the codecs are not supported.
+    """
+
+    def __init__(self, files, output, ffmpeg=None, native=False, chunk_size=REMUX_CHUNK_SIZE):
+        self.files = files
+        self.output = output
+        self.ffmpeg = ffmpeg
+        self.native = native
+        self.chunk_size = chunk_size
+        self.process = None
+        self.cancelled = False
+
+    def iter_chunks(self):
+        for path in self.files:
+            with open(path, 'rb') as f:
+                while not self.cancelled:
+                    chunk = f.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+
+    def run(self):
+        'Returns False when the job was cancelled, raises IOError on failure.'
+        if self.cancelled:
+            return False
+        log.debug('Remux %d segments into %s', len(self.files), self.output)
+        if self.native:
+            try:
+                self._remux_native()
+                return not self.cancelled
+            except UnsupportedCodecError as err:
+                if not self.ffmpeg:
+                    raise IOError(str(err))
+                log.info('%s, remuxing with ffmpeg', err)
+        if self.ffmpeg:
+            self._remux()
+        else:
+            self._concat()
+        return not self.cancelled
+
+    def _concat(self):
+        with open(self.output, 'wb') as out:
+            for chunk in self.iter_chunks():
+                out.write(chunk)
+
+    def _remux_native(self):
+        with open(self.output, 'wb') as out:
+            remuxer = TSRemuxer(out)
+            for chunk in self.iter_chunks():
+                remuxer.feed(chunk)
+            remuxer.close()
+
+    def _remux(self):
+        args = [self.ffmpeg, '-hide_banner', '-loglevel', 'error', '-f', 'mpegts', '-i', 'pipe:0', '-y', '-c', 'copy', '-bsf:a', 'aac_adtstoasc', self.output]
+        with tempfile.TemporaryFile() as stderr:
+            self.process = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=stderr)
+            if self.cancelled:
+                self.process.kill()
+            try:
+                for chunk in self.iter_chunks():
+                    self.process.stdin.write(chunk)
+            except (IOError, OSError) as err:
+                log.debug('Writing to ffmpeg failed: %s', err)
+            finally:
+                try:
+                    self.process.stdin.close()
+                except (IOError, OSError):
+                    pass
+            code = self.process.wait()
+            if code != 0 and not self.cancelled:
+                stderr.seek(0)
+                message = stderr.read()[-2048:].decode('utf8', 'replace').strip()
+                raise IOError('ffmpeg exited with code %d: %s' % (code, message))
+
+    def cancel(self):
+        self.cancelled = True
+        process = self.process
+        if process and process.poll() is None:
+            process.kill()
+
+post_processor = PostProcessor()
+__all__ = ['PostProcessor', 'RemuxJob', 'post_processor']
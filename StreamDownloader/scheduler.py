@@ -0,0 +1,95 @@
+import logging
+from collections import deque
+from threading import Lock
+from StreamDownloader.journal import RangePiece
+MIN_PIECE_SIZE = 1048576
+MAX_PIECE_SIZE = 16777216
+MIN_STEAL_SIZE = 524288
+log = logging.getLogger(__name__)
+
+class PieceScheduler(object):
+    __doc__ = """Hands out the missing byte ranges of a download as pieces.
+
+    Pieces are queued in file order and taken by whichever connection is
+    idle. Once the queue is empty an idle connection steals the upper
+    half of the piece with the most bytes left, and when that is too
+    small to split it duplicates the remainder (end-game mode), the
+    first copy to finish cancels the other.
+    """
+
+    def __init__(self, journal, ranges, workers):
+        self.journal = journal
+        total = sum(end - start for (start, end) in ranges)
+        self.piece_size = max(MIN_PIECE_SIZE, min(MAX_PIECE_SIZE, total//(workers*4 or 1)))
+        self.queue = deque()
+        for (start, end) in ranges:
+            self._enqueue(start, end)
+        self.active = set()
+        self.steals = 0
+        self.duplicates = 0
+        self.retries = 0
+        self._lock = Lock()
+
+    def _enqueue(self, start, end):
+        while start < end:
+            stop = min(start + self.piece_size, end)
+            self.queue.append((start, stop))
+            start = stop
+
+    def _start(self, piece):
+        self.active.add(piece)
+        self.journal.track(piece)
+        return piece
+
+    def next(self):
+        'Returns the next piece to download or None when nothing is left.'
+        with self._lock:
+            if self.queue:
+                return self._start(RangePiece(*self.queue.popleft()))
+            candidates = [p for p in self.active if p.twin is None and not p.cancelled and p.remaining() > 0]
+            if not candidates:
+                return
+            victim = max(candidates, key=RangePiece.remaining)
+            remaining = victim.remaining()
+            if remaining >= 2*MIN_STEAL_SIZE:
+                mid = victim.cursor + remaining//2
+                piece = RangePiece(mid, victim.end)
+                victim.end = mid
+                self.steals += 1
+                log.debug('Steal %d-%d from piece at %d', mid, piece.end, victim.start)
+                return self._start(piece)
+            piece = RangePiece(victim.cursor, victim.end)
+            piece.twin = victim
+            victim.twin = piece
+            self.duplicates += 1
+            log.debug('End-game duplicate %d-%d', piece.start, piece.end)
+            return self._start(piece)
+
+    def done(self, piece):
+        '''Retires *piece*, queueing what is left of it unless a twin covers it.'''
+        with self._lock:
+            self.active.discard(piece)
+            twin = piece.twin
+            if piece.pos >= piece.end:
+                if twin is not None and not twin.cancelled:
+                    twin.cancelled = True
+                    self.cancel(twin)
+            elif not piece.cancelled:
+                if twin is not None and not twin.cancelled:
+                    twin.twin = None
+                else:
+                    self.retries += 1
+                    self._enqueue(piece.pos, piece.end)
+        self.journal.finish(piece)
+
+    def cancel(self, piece):
+        response = piece.response
+        if response is not None:
+            try:
+                response.close()
+            except Exception:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {'piece_size': self.piece_size, 'queued': len(self.queue), 'active': len(self.active), 'steals': self.steals, 'duplicates': self.duplicates, 'retries': self.retries}
@@ -1,5 +1,8 @@
-import os
 import sys
+from importProfiler import import_profiler, FLAG as PROFILE_STARTUP_FLAG
+if PROFILE_STARTUP_FLAG in sys.argv:
+    import_profiler.start()
+import os
 import logging
 import signal
 import logConfig
@@ -11,6 +14,7 @@ import web
 logging.getLogger('App')
 HOST = ('127.0.0.1', 12000)
 worker_mgr = None
+task_mgr = None
 
 def menu():
     print("""
@@ -26,11 +30,13 @@ def signalHander(sig, frame):
     print('Wait for cleanup...')
     if worker_mgr:
         worker_mgr.shutdown()
+    if task_mgr:
+        task_mgr.shutdown()
     print('Stop program!')
     sys.exit(0)
 
 def main():
-    global worker_mgr
+    global worker_mgr, task_mgr
     os.environ['loadingstop'] = '1'
     os.environ['WERKZEUG_RUN_MAIN'] = 'false'
     signal.signal(signal.SIGINT, signalHander)
@@ -43,6 +49,9 @@ def main():
     worker_mgr.start()
     os.system('cls')
     menu()
+    if import_profiler.active:
+        import_profiler.stop()
+        import_profiler.report()
     web.run(task_mgr, HOST[0], HOST[1])
 
 if __name__ == '__main__':
@@ -4,6 +4,8 @@ import json
 from argparse import ArgumentTypeError, RawTextHelpFormatter
 from jsonargparse import ArgumentParser, ActionConfigFile
 LogLevelName = ('notset', 'info', 'error', 'warning', 'debug')
+HlsOutputName = ('pipe', 'spool')
+RemuxerName = ('ffmpeg', 'native')
 DEFAULT_DOWNLOAD_DIR = os.path.join(os.getcwd(), 'DL')
 
 class AppSettings:
@@ -23,6 +25,7 @@ class AppSettings:
             self.file_config = self.default_path_config
         else:
             self.file_config = conf.config
+        conf.pop('profile_startup', None)
         parser.save(conf, self.file_config, 'json_indented', overwrite=True)
         conf = vars(conf)
         conf.pop('__default_config__', None)
@@ -56,6 +59,90 @@ class AppSettings:
             raise ArgumentTypeError('Number of connections must be >= %d' % MIN)
         return threads
 
+    def validateHostConnections(self, arg):
+        ' Type function for argparse - connections per host, 0 is unlimited '
+        try:
+            connections = int(arg)
+        except ValueError:
+            raise ArgumentTypeError('Number of connections per host must be a number')
+        if connections < 0:
+            raise ArgumentTypeError('Number of connections per host must be >= 0')
+        return connections
+
+    def validateBandwidthLimit(self, arg):
+        ' Type function for argparse - bandwidth limit in KiB/s, 0 is unlimited '
+        try:
+            limit = int(arg)
+        except ValueError:
+            raise ArgumentTypeError('Bandwidth limit must be a number')
+        if limit < 0:
+            raise ArgumentTypeError('Bandwidth limit must be >= 0')
+        return limit
+
+    def validateHlsOutput(self, arg):
+        ' Type function for argparse - output mode of HLS downloads '
+        if arg.lower() not in HlsOutputName:
+            raise ArgumentTypeError('HLS output must be one of: %s' % ', '.join(HlsOutputName))
+        return arg.lower()
+
+    def validateRemuxer(self, arg):
+        ' Type function for argparse - remuxer of HLS downloads to mp4 '
+        if arg.lower() not in RemuxerName:
+            raise ArgumentTypeError('Remuxer must be one of: %s' % ', '.join(RemuxerName))
+        return arg.lower()
+
+    def validateSegmentWindow(self, arg):
+        ' Type function for argparse - segments queued ahead of the writer, 0 is twice the connections '
+        try:
+            window = int(arg)
+        except ValueError:
+            raise ArgumentTypeError('Segment window must be a number')
+        if window < 0:
+            raise ArgumentTypeError('Segment window must be >= 0')
+        return window
+
+    def validateReorderBuffer(self, arg):
+        ' Type function for argparse - reorder buffer size in MiB '
+        MIN = 1
+        try:
+            size = int(arg)
+        except ValueError:
+            raise ArgumentTypeError('Reorder buffer size must be a number')
+        if size < MIN:
+            raise ArgumentTypeError('Reorder buffer size must be >= %d' % MIN)
+        return size
+
+    def validatePostprocessWorkers(self, arg):
+        ' Type function for argparse - parallel remux jobs, 0 is the number of CPU cores '
+        try:
+            workers = int(arg)
+        except ValueError:
+            raise ArgumentTypeError('Number of post-processing workers must be a number')
+        if workers < 0:
+            raise ArgumentTypeError('Number of post-processing workers must be >= 0')
+        return workers
+
+    def validateStreamCacheTtl(self, arg):
+        ' Type function for argparse - lifetime of cached streams in seconds, 0 disables the cache '
+        try:
+            ttl = int(arg)
+        except ValueError:
+            raise ArgumentTypeError('Stream cache lifetime must be a number')
+        if ttl < 0:
+            raise ArgumentTypeError('Stream cache lifetime must be >= 0')
+        return ttl
+
+    def validateFlushInterval(self, arg):
+        ' Type function for argparse - flush interval in milliseconds '
+        MIN = 50
+        try:
+            interval = int(arg)
+        except ValueError:
+            raise ArgumentTypeError('Progress flush interval must be a number')
+        if interval < MIN:
+            raise ArgumentTypeError('Progress flush interval must be >= %d' % MIN)
+        return interval
+
     def validateLogLevel(self, arg):
         if arg.lower() not in LogLevelName:
             raise ArgumentTypeError('Level must is: %s' % ', '.join(LogLevelName))
@@ -67,8 +154,21 @@ Web: https://nhtcntt.blogspot.com"""
         parser = ArgumentParser(default_config_files=[self.default_path_config], parser_mode='jsonnet', description=description, formatter_class=RawTextHelpFormatter)
         parser.add_argument('-ad', '--active-downloads', default=1, type=self.validateWorkers, help='Maximum number of active downloads run parallel. Default: 1')
         parser.add_argument('-cc', '--connections', default=5, type=self.validateConnections, help='Maximum number of connections per download. Default: 5')
+        parser.add_argument('-hc', '--host-connections', default=16, type=self.validateHostConnections, help='Maximum number of connections to a host shared by all downloads, 0 is unlimited. Default: 16')
+        parser.add_argument('--host-limits', default={}, type=dict, help='Limits per host pattern, e.g. {"*.example.com": {"connections": 4, "rate": 1, "per": 1}} allows 4 connections and 1 request per second')
+        parser.add_argument('-bl', '--bandwidth-limit', default=0, type=self.validateBandwidthLimit, help='Maximum download speed in KiB/s shared by all downloads by their bandwidth weight, 0 is unlimited. Default: 0')
+        parser.add_argument('-sw', '--segment-window', default=0, type=self.validateSegmentWindow, help='Maximum number of segments fetched ahead of the one being written, 0 is twice the number of connections. Default: 0')
+        parser.add_argument('-rb', '--reorder-buffer', default=32, type=self.validateReorderBuffer, help='Memory in MiB per download for segments fetched ahead of the one being written. Default: 32')
+        parser.add_argument('--reorder-spill', default=False, type=bool, help='Spill segments to the download directory once the reorder buffer is full instead of pausing fetching. Default: false')
+        parser.add_argument('-ho', '--hls-output', default='pipe', type=self.validateHlsOutput, help='Output mode of HLS downloads. pipe: segments are piped to ffmpeg while downloading, spool: segments are downloaded in parallel to disk then remuxed once. Default: pipe')
+        parser.add_argument('--hls-resume', default=False, type=bool, help='Keep the segments of HLS VOD downloads in pipe mode on disk, so a stopped or failed download resumes from the first missing segment. Spool mode always keeps them. Default: false')
+        parser.add_argument('-rm', '--remuxer', default='ffmpeg', type=self.validateRemuxer, help='Remuxer of HLS downloads to mp4. ffmpeg: ffmpeg -c copy, native: built-in MPEG-TS to fragmented MP4 remuxer for H.264/H.265 and AAC, ffmpeg is still used for other codecs. Tasks can override it. Default: ffmpeg')
+        parser.add_argument('-pw', '--postprocess-workers', default=0, type=self.validatePostprocessWorkers, help='Maximum number of remux jobs run parallel, 0 is the number of CPU cores. Default: 0')
+        parser.add_argument('-sc', '--stream-cache-ttl', default=3600, type=self.validateStreamCacheTtl, help='Seconds the streams found on a url are cached, so resumed and retried downloads skip the plugin. Plugins can set their own lifetime, 0 disables the cache. Default: 3600')
         parser.add_argument('-d', '--download-dir', default=DEFAULT_DOWNLOAD_DIR, help='Directory store files')
+        parser.add_argument('-pf', '--progress-flush-interval', default=500, type=self.validateFlushInterval, help='Interval in milliseconds progress of tasks is written to database. Default: 500')
         parser.add_argument('-l', '--log-level', default='error', type=self.validateLogLevel, help='Log level. Default: error, There are log level: %s' % ', '.join(LogLevelName))
+        parser.add_argument('--profile-startup', action='store_true', help='Print the time spent importing each module once the server has started, not saved to the config file')
         parser.add_argument('-c', '--config', action=ActionConfigFile)
         return parser
 
@@ -0,0 +1,102 @@
+'''Benchmark of the stream buffers, RingBuffer against CircularBuffer.
+
+Usage: python benchmarks/buffer_bench.py [--megabytes 256] [--chunk 32768] [--read 32768] [--size 32]
+
+A filler thread writes --megabytes MiB in --chunk byte chunks, each a
+new bytes object as the segment writers get them from the socket or
+the decrypter, while the main thread reads it --read bytes at a time
+from a buffer of --size MiB. CircularBuffer is read with read,
+with readinto a reused bytearray and with peek and consume. Reports the
+throughput and time per read of each, then checks every reader gets
+the written data back with random chunk and read sizes.
+'''
+import os
+import sys
+import zlib
+import random
+import argparse
+from time import time
+from threading import Thread
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from streamlink.buffers import RingBuffer, CircularBuffer
+
+def fill(buffer, chunks):
+    for chunk in chunks:
+        buffer.write(bytes(memoryview(chunk)))
+    buffer.close()
+
+def read_bytes(buffer, size, consume):
+    while True:
+        data = buffer.read(size)
+        if not data:
+            return
+        consume(data)
+
+def read_into(buffer, size, consume):
+    out = bytearray(size)
+    view = memoryview(out)
+    while True:
+        count = buffer.readinto(out)
+        if not count:
+            return
+        consume(view[:count])
+
+def read_peek(buffer, size, consume):
+    while True:
+        buffer.wait_used()
+        views = buffer.peek(size)
+        if not views:
+            if buffer.closed:
+                return
+            continue
+        for view in views:
+            consume(view)
+        buffer.consume(sum(len(view) for view in views))
+
+READERS = [('ring read', RingBuffer, read_bytes), ('circ read', CircularBuffer, read_bytes), ('circ readinto', CircularBuffer, read_into), ('circ peek', CircularBuffer, read_peek)]
+
+def run(buffer_class, reader, chunks, buffer_size, read_size, consume):
+    buffer = buffer_class(buffer_size)
+    filler = Thread(target=fill, args=(buffer, chunks), daemon=True)
+    start = time()
+    filler.start()
+    reader(buffer, read_size, consume)
+    filler.join()
+    return time() - start
+
+def make_chunks(total, chunk_size, rnd=None):
+    data = os.urandom(1048576)
+    (chunks, pos) = ([], 0)
+    while pos < total:
+        size = min(rnd.randrange(1, 2*chunk_size) if rnd else chunk_size, total - pos)
+        offset = pos % (len(data) - size) if size < len(data) else 0
+        chunks.append(data[offset:offset + size])
+        pos += size
+    return chunks
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--megabytes', type=int, default=256)
+    parser.add_argument('--chunk', type=int, default=32768)
+    parser.add_argument('--read', type=int, default=32768)
+    parser.add_argument('--size', type=int, default=32)
+    args = parser.parse_args()
+    total = args.megabytes*1048576
+    chunks = make_chunks(total, args.chunk)
+    for (name, buffer_class, reader) in READERS:
+        elapsed = run(buffer_class, reader, chunks, args.size*1048576, args.read, len)
+        print('%-14s %8.1f MiB/s %8.2f us per read' % (name, args.megabytes/elapsed, elapsed*1e+06*args.read/total))
+    rnd = random.Random(1)
+    chunks = make_chunks(16*1048576, args.chunk, rnd)
+    expected = zlib.crc32(b''.join(chunks))
+    for (name, buffer_class, reader) in READERS:
+        crc = [0]
+
+        def consume(data):
+            crc[0] = zlib.crc32(data, crc[0])
+        run(buffer_class, reader, chunks, 262144, rnd.randrange(1, 2*args.read), consume)
+        assert crc[0] == expected, name
+    print('%d readers got the same data back' % len(READERS))
+if __name__ == '__main__':
+    main()
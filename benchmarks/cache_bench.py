@@ -0,0 +1,58 @@
+'''Benchmark of streamlink.cache.Cache lookups and updates.
+
+Usage: python benchmarks/cache_bench.py [--entries 1000] [--ops 20000] [--threads 4]
+
+Fills a cache in a temporary directory with --entries entries, then
+runs --ops mixed lookups and updates (9 to 1) split over --threads
+threads. Reports the time per operation, then checks every update of
+the run was persisted by reading the cache back in a new process.
+'''
+import os
+import sys
+import random
+import argparse
+import tempfile
+import subprocess
+from time import time
+from threading import Thread
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+CHECK = 'import sys; sys.path.insert(0, sys.argv[1]); from streamlink.cache import Cache; print(len(Cache(filename="bench.json").get_all()))'
+
+def worker(cache, entries, ops, seed):
+    rnd = random.Random(seed)
+    for i in range(ops):
+        key = 'key%d' % rnd.randrange(entries)
+        if i % 10:
+            cache.get(key)
+        else:
+            cache.set('%s:%d' % (key, seed), {'hash': key, 'modified': i})
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--entries', type=int, default=1000)
+    parser.add_argument('--ops', type=int, default=20000)
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+    os.environ['XDG_CACHE_HOME'] = tempfile.mkdtemp()
+    from streamlink.cache import Cache
+    cache = Cache(filename='bench.json')
+    start = time()
+    for i in range(args.entries):
+        cache.set('key%d' % i, {'hash': 'key%d' % i, 'modified': i})
+    print('fill       %8.1f us per set' % ((time() - start)*1e+06/args.entries))
+    threads = [Thread(target=worker, args=(cache, args.entries, args.ops//args.threads, seed)) for seed in range(args.threads)]
+    start = time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time() - start
+    print('mixed      %8.1f us per operation, %d threads' % (elapsed*1e+06/args.ops, args.threads))
+    expected = len(cache.get_all())
+    if hasattr(cache, 'flush'):
+        cache.flush()
+    persisted = int(subprocess.check_output([sys.executable, '-c', CHECK, ROOT]))
+    print('persisted  %d of %d entries' % (persisted, expected))
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+'''Benchmark of TaskDB progress updates and task listing under concurrent writers.
+
+Usage: python benchmarks/db_bench.py [--writers 50] [--rows 2000] [--seconds 5] [--legacy]
+
+--legacy runs the same load against the old NullPool engine with the
+default rollback journal for comparison.
+'''
+import os
+import sys
+import tempfile
+import argparse
+from time import time, sleep
+from threading import Thread, Event
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values)*p))]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--writers', type=int, default=50)
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--legacy', action='store_true')
+    args = parser.parse_args()
+    os.chdir(tempfile.mkdtemp(prefix='mdm_bench_'))
+    import models
+    from models import TaskDB
+    url = 'sqlite:///%s' % os.path.join(os.getcwd(), 'bench.db')
+    if args.legacy:
+        from sqlalchemy import create_engine
+        from sqlalchemy.pool import NullPool
+        engine = create_engine(url, poolclass=NullPool)
+        models.session_factory.configure(bind=engine)
+        models.Base.metadata.create_all(bind=engine)
+    else:
+        models.setup_engine(url)
+    tids = []
+    for i in range(args.rows):
+        tid = TaskDB.makeTaskId(('http://example.com/%d' % i).encode('latin1'))
+        TaskDB.create(tid, 'http://example.com/%d' % i, '{}', '/tmp/%d.mp4' % i)
+        tids.append(tid)
+    stop = Event()
+    counts = [0]*args.writers
+    errors = [0]
+
+    def writer(n):
+        tid = tids[n % len(tids)]
+        while not stop.is_set():
+            try:
+                TaskDB.update(tid, speed='%d KB/s' % counts[n], eta='00:10', percent='10.00%')
+                counts[n] += 1
+            except Exception:
+                errors[0] += 1
+
+    latencies = []
+
+    def reader():
+        while not stop.is_set():
+            start = time()
+            [t.serialize() for t in TaskDB.getAllTask()]
+            latencies.append(time() - start)
+
+    threads = [Thread(target=writer, args=(n,), daemon=True) for n in range(args.writers)]
+    threads.append(Thread(target=reader, daemon=True))
+    for t in threads:
+        t.start()
+    sleep(args.seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    print('engine:          %s' % ('legacy NullPool/DELETE journal' if args.legacy else 'pooled WAL'))
+    print('writers:         %d, rows: %d' % (args.writers, args.rows))
+    print('updates/s:       %.0f (errors %d)' % (sum(counts)/args.seconds, errors[0]))
+    print('list latency:    p50 %.1f ms, p95 %.1f ms, max %.1f ms (%d lists)' % (percentile(latencies, 0.5)*1000, percentile(latencies, 0.95)*1000, max(latencies or [0])*1000, len(latencies)))
+
+if __name__ == '__main__':
+    main()
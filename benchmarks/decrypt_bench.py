@@ -0,0 +1,60 @@
+'''Benchmark of the AES-128 decryption of HLS segments.
+
+Usage: python benchmarks/decrypt_bench.py [--segment 4] [--count 16] [--chunk-size 32768] [--threads 8]
+
+Decrypts --count segments of --segment MiB, first whole as they were
+before, then streamed in --chunk-size chunks with iter_decrypt, then
+streamed by 1 to --threads threads in parallel as the fetch threads do.
+Reports the throughput and the throughput per busy core.
+'''
+import os
+import sys
+import argparse
+from time import time, process_time
+from concurrent.futures import ThreadPoolExecutor
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from Crypto.Cipher import AES
+from streamlink.stream.hls import iter_decrypt, pkcs7_decode, num_to_iv
+KEY = b'0123456789abcdef'
+
+def make_segment(num, size):
+    data = os.urandom(size)
+    pad = 16 - len(data) % 16
+    return AES.new(KEY, AES.MODE_CBC, num_to_iv(num)).encrypt(data + bytes((pad,))*pad)
+
+def iter_chunks(data, chunk_size):
+    for pos in range(0, len(data), chunk_size):
+        yield data[pos:pos + chunk_size]
+
+def decrypt_whole(num, data, chunk_size):
+    content = b''.join(iter_chunks(data, chunk_size))
+    return len(pkcs7_decode(AES.new(KEY, AES.MODE_CBC, num_to_iv(num)).decrypt(content)))
+
+def decrypt_stream(num, data, chunk_size):
+    return sum(len(chunk) for chunk in iter_decrypt(AES.new(KEY, AES.MODE_CBC, num_to_iv(num)), iter_chunks(data, chunk_size)))
+
+def measure(name, func, segments, chunk_size, threads=1):
+    size = sum(len(data) for data in segments)/1048576.0
+    (start, cpu_start) = (time(), process_time())
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(lambda item: func(item[0], item[1], chunk_size), enumerate(segments)))
+    (elapsed, cpu) = (time() - start, process_time() - cpu_start)
+    print('%-8s %2d threads: %7.1f MiB/s, %7.1f MiB/s per core' % (name, threads, size/elapsed, size/max(cpu, 1e-09)))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--segment', type=int, default=4, help='MiB')
+    parser.add_argument('--count', type=int, default=16)
+    parser.add_argument('--chunk-size', type=int, default=32768)
+    parser.add_argument('--threads', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+    segments = [make_segment(num, args.segment*1048576) for num in range(args.count)]
+    measure('whole', decrypt_whole, segments, args.chunk_size)
+    measure('stream', decrypt_stream, segments, args.chunk_size)
+    threads = 2
+    while threads <= args.threads:
+        measure('stream', decrypt_stream, segments, args.chunk_size, threads)
+        threads *= 2
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+'''Benchmark of the HLS output modes, pipe against spool, with a local server.
+
+Usage: python benchmarks/hls_bench.py [--segments 120] [--threads 8] [--latency 50] [--rate 0]
+
+The server runs in a separate process and serves a VOD playlist, every
+segment request waits --latency ms and is sent at --rate KiB/s per
+connection (0 is unlimited). With ffmpeg the segments are encoded by
+ffmpeg from a test source and both modes remux to mp4, without it the
+segments are synthetic MPEG-TS packets and both modes write plain TS.
+Reports the wall time, throughput and CPU time of each mode, then
+checks a spool download whose remux fails keeps its segments.
+'''
+import os
+import sys
+import shutil
+import socket
+import tempfile
+import argparse
+import subprocess
+from time import time, sleep, process_time
+from multiprocessing import Process, Queue
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+TS_PACKETS = 4000
+
+def make_segments(path, segments, ffmpeg):
+    if ffmpeg:
+        args = [ffmpeg, '-hide_banner', '-loglevel', 'error', '-f', 'lavfi', '-i', 'testsrc2=size=1280x720:rate=30', '-f', 'lavfi', '-i', 'sine=frequency=440', '-t', str(segments*2), '-c:v', 'libx264', '-preset', 'ultrafast', '-g', '60', '-c:a', 'aac', '-f', 'hls', '-hls_time', '2', '-hls_playlist_type', 'vod', '-hls_segment_filename', os.path.join(path, 'seg%d.ts'), os.path.join(path, 'vod.m3u8')]
+        subprocess.check_call(args)
+        return
+    lines = ['#EXTM3U', '#EXT-X-TARGETDURATION:2', '#EXT-X-MEDIA-SEQUENCE:0']
+    for i in range(segments):
+        packet = b'G' + bytes((i + j) % 256 for j in range(187))
+        with open(os.path.join(path, 'seg%d.ts' % i), 'wb') as f:
+            f.write(packet*TS_PACKETS)
+        lines += ['#EXTINF:2.0,', 'seg%d.ts' % i]
+    lines.append('#EXT-X-ENDLIST')
+    with open(os.path.join(path, 'vod.m3u8'), 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+def serve(path, latency, rate, port_queue):
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    block = 65536
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def handle(self):
+            try:
+                BaseHTTPRequestHandler.handle(self)
+            except socket.error:
+                pass
+
+        def do_GET(self):
+            name = os.path.basename(self.path.split('?')[0])
+            try:
+                with open(os.path.join(path, name), 'rb') as f:
+                    data = f.read()
+            except IOError:
+                self.send_error(404)
+                return
+            if name.endswith('.ts'):
+                sleep(latency)
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            try:
+                for pos in range(0, len(data), block):
+                    self.wfile.write(data[pos:pos + block])
+                    if rate and name.endswith('.ts'):
+                        sleep(float(block)/rate)
+            except (socket.error, ValueError):
+                pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    port_queue.put(server.server_port)
+    server.serve_forever()
+
+def run(url, filename, threads, mode, mp4):
+    from StreamDownloader import StreamDownloader
+    downloader = StreamDownloader('hls://' + url, filename, {}, threads=threads, hls_output=mode)
+    downloader.handleUrl()
+    for stream in downloader.streams.values():
+        stream.toMp4 = mp4
+    (start, cpu_start) = (time(), process_time())
+    downloader.download()
+    return (time() - start, process_time() - cpu_start)
+
+def check_remux_failure(url, path, threads):
+    import StreamDownloader
+    filename = os.path.join(path, 'out_failed.mp4')
+    find_ffmpeg = StreamDownloader.find_ffmpeg
+    StreamDownloader.find_ffmpeg = lambda: os.path.join(path, 'missing-ffmpeg')
+    try:
+        run(url, filename, threads, 'spool', True)
+    except StreamDownloader.RemuxError:
+        pass
+    else:
+        raise AssertionError('remux did not fail')
+    finally:
+        StreamDownloader.find_ffmpeg = find_ffmpeg
+    spooled = [name for (_, _, names) in os.walk(filename + StreamDownloader.SPOOL_SUFFIX) for name in names if name.endswith('.ts')]
+    assert spooled, 'spool removed after a failed remux'
+    print('failed remux kept %d spooled segments' % len(spooled))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--segments', type=int, default=120)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--latency', type=int, default=50, help='ms')
+    parser.add_argument('--rate', type=int, default=0, help='KiB/s per connection')
+    args = parser.parse_args()
+    from StreamDownloader import find_ffmpeg
+    ffmpeg = find_ffmpeg()
+    if not ffmpeg:
+        print('ffmpeg not found, benchmarking plain TS output')
+    path = tempfile.mkdtemp(prefix='mdm_bench_')
+    make_segments(path, args.segments, ffmpeg)
+    size = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path) if name.endswith('.ts'))
+    port_queue = Queue()
+    server = Process(target=serve, args=(path, args.latency/1000.0, args.rate*1024, port_queue), daemon=True)
+    server.start()
+    url = 'http://127.0.0.1:%d/vod.m3u8' % port_queue.get()
+    try:
+        for mode in ('pipe', 'spool'):
+            filename = os.path.join(path, 'out_%s.%s' % (mode, 'mp4' if ffmpeg else 'ts'))
+            (elapsed, cpu) = run(url, filename, args.threads, mode, bool(ffmpeg))
+            print('%-5s %d segments, %.1f MiB with %d threads in %.2fs: %.1f MiB/s, %.2fs CPU, output %.1f MiB' % (mode, args.segments, size/1048576.0, args.threads, elapsed, size/1048576.0/elapsed, cpu, os.path.getsize(filename)/1048576.0))
+        check_remux_failure(url, path, args.threads)
+    finally:
+        server.terminate()
+        shutil.rmtree(path, ignore_errors=True)
+if __name__ == '__main__':
+    main()
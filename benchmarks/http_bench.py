@@ -0,0 +1,102 @@
+'''Benchmark of the multi-connection HTTP downloader against a local server.
+
+Usage: python benchmarks/http_bench.py [--size 512] [--connections 8] [--slow 0]
+
+The server runs in a separate process and serves --size MiB from memory
+with Range support, --slow N makes the first N connections stall for a
+while to show the work-stealing scheduler. Reports throughput and the
+CPU time used by the downloading process.
+'''
+import os
+import sys
+import socket
+import hashlib
+import tempfile
+import argparse
+from time import time, sleep, process_time
+from multiprocessing import Process, Queue
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+BLOCK = 1048576
+
+def make_data(size):
+    block = hashlib.sha512(b'mdm').digest()*(BLOCK//64)
+    return block*(size//BLOCK)
+
+def serve(size, slow, port_queue):
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    data = memoryview(make_data(size))
+    stalls = [slow]
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def handle(self):
+            try:
+                BaseHTTPRequestHandler.handle(self)
+            except socket.error:
+                pass
+
+        def do_GET(self):
+            (start, end) = (0, len(data) - 1)
+            if self.headers.get('Range'):
+                (start, end) = self.headers['Range'].split('=')[1].split('-')
+                (start, end) = (int(start), int(end) if end else len(data) - 1)
+                self.send_response(206)
+                self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end, len(data)))
+            else:
+                self.send_response(200)
+            self.send_header('Content-Length', str(end - start + 1))
+            self.send_header('ETag', '"bench"')
+            self.end_headers()
+            stall = stalls[0] > 0 and start > 0
+            if stall:
+                stalls[0] -= 1
+            try:
+                for pos in range(start, end + 1, BLOCK):
+                    self.wfile.write(data[pos:min(pos + BLOCK, end + 1)])
+                    if stall:
+                        sleep(0.5)
+            except (socket.error, ValueError):
+                pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    port_queue.put(server.server_port)
+    server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=512, help='MiB')
+    parser.add_argument('--connections', type=int, default=8)
+    parser.add_argument('--slow', type=int, default=0)
+    args = parser.parse_args()
+    size = args.size*BLOCK
+    port_queue = Queue()
+    server = Process(target=serve, args=(size, args.slow, port_queue), daemon=True)
+    server.start()
+    port = port_queue.get()
+    import requests
+    from StreamDownloader.HttpMultiDownloader import Downloader
+    path = os.path.join(tempfile.mkdtemp(prefix='mdm_bench_'), 'bench.bin')
+    try:
+        downloader = Downloader('http://127.0.0.1:%d/bench.bin' % port, requests.Session(), path, args.connections)
+        (start, cpu_start) = (time(), process_time())
+        downloader.run()
+        downloader.wait()
+        downloader.shutdown()
+        (elapsed, cpu) = (time() - start, process_time() - cpu_start)
+        with open(path, 'rb') as f:
+            valid = hashlib.md5(f.read()).digest() == hashlib.md5(make_data(size)).digest()
+        print('%d MiB with %d connections in %.2fs: %.1f MiB/s, %.2fs CPU (%.0f%% of a core), valid: %s' % (args.size, args.connections, elapsed, args.size/elapsed, cpu, cpu/elapsed*100, valid))
+        if downloader.scheduler:
+            print('scheduler: %s' % downloader.scheduler.stats())
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+        server.terminate()
+if __name__ == '__main__':
+    main()
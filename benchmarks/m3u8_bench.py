@@ -0,0 +1,50 @@
+'''Benchmark of live playlist reloads, full against incremental parsing.
+
+Usage: python benchmarks/m3u8_bench.py [--segments 5000] [--new 2] [--reloads 100] [--key-every 0]
+
+Builds a live playlist with a DVR window of --segments segments which
+moves by --new segments on every reload, then parses --reloads reloads
+with hls_playlist.load and with one IncrementalM3U8Parser. Reports the
+time per reload and checks both give the same segments.
+'''
+import os
+import sys
+import argparse
+from time import process_time
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from streamlink.stream import hls_playlist
+BASE_URI = 'https://cdn.example.com/live/channel/index.m3u8?token=abcdef'
+
+def make_playlist(media_sequence, segments, key_every):
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:4', '#EXT-X-MEDIA-SEQUENCE:%d' % media_sequence]
+    for num in range(media_sequence, media_sequence + segments):
+        if key_every and (num % key_every == 0 or num == media_sequence):
+            lines.append('#EXT-X-KEY:METHOD=AES-128,URI="keys/%d.key",IV=0x%032x' % (num//key_every, num//key_every))
+        lines.append('#EXT-X-PROGRAM-DATE-TIME:2020-01-01T00:00:00.000Z')
+        lines.append('#EXTINF:4.000,')
+        lines.append('segment_%d.ts?token=abcdef' % num)
+    return '\n'.join(lines) + '\n'
+
+def measure(name, parse, playlists):
+    start = process_time()
+    results = [parse(data) for data in playlists]
+    elapsed = process_time() - start
+    print('%-12s %8.2f ms per reload' % (name, elapsed*1000/len(playlists)))
+    return (results, elapsed)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--segments', type=int, default=5000)
+    parser.add_argument('--new', type=int, default=2)
+    parser.add_argument('--reloads', type=int, default=100)
+    parser.add_argument('--key-every', type=int, default=0)
+    args = parser.parse_args()
+    playlists = [make_playlist(1000 + i*args.new, args.segments, args.key_every) for i in range(args.reloads)]
+    (full, full_time) = measure('full', lambda data: hls_playlist.load(data, BASE_URI), playlists)
+    incremental_parser = hls_playlist.IncrementalM3U8Parser()
+    (incremental, incremental_time) = measure('incremental', lambda data: incremental_parser.update(data, BASE_URI), playlists)
+    assert all(a.segments == b.segments for (a, b) in zip(full, incremental))
+    print('%d of %d reloads resumed, %.1fx faster' % (incremental_parser.resumed, args.reloads, full_time/max(incremental_time, 1e-09)))
+if __name__ == '__main__':
+    main()
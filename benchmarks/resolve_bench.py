@@ -0,0 +1,93 @@
+'''Benchmark of Streamlink.resolve_url over a corpus of task URLs.
+
+Usage: python benchmarks/resolve_bench.py [--urls 20000] [--redirects 200]
+
+Finds the plugin of --urls URLs of the supported hosts, of playlists
+on CDN hosts and of unsupported sites, first by asking every plugin as
+resolve_url did before, then through the plugin index, and checks both
+pick the same plugin. Then resolves --redirects short links redirecting to a
+local server twice, the second time from the redirect cache.
+'''
+import os
+import sys
+import random
+import argparse
+import tempfile
+import threading
+from time import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ['XDG_CACHE_HOME'] = tempfile.mkdtemp()
+from streamlink import Streamlink
+from streamlink.utils import update_scheme
+TEMPLATES = ['https://playhydrax.com/?v={id}', 'https://abysscdn.com/?v={id}', 'https://streamtape.com/e/{id}', 'https://mixdrop.co/e/{id}', 'https://sbplay2.com/e/{id}', 'https://vudeo.net/embed-{id}.html', 'https://www.youtube.com/watch?v={id:.11}', 'https://youtu.be/{id:.11}', 'https://www.dailymotion.com/video/{id}', 'https://ok.ru/video/{num}', 'https://player.vimeo.com/video/{num}', 'https://archive.org/embed/{id}', 'https://short.ink/{id}', 'https://phimmoichilla.net/xem/{id}', 'https://cdn{num}.example.net/hls/{id}/index.m3u8', 'https://vod.example.org/{id}/manifest.mpd', 'hls://https://live.example.com/{id}.m3u8', 'httpstream://https://files.example.com/{id}.mp4', 'rtmp://live.example.com/app/{id}', 'https://www.example.com/watch/{id}', 'https://blog.example.org/{num}/post']
+
+def make_corpus(count):
+    rnd = random.Random(1)
+    corpus = []
+    for _ in range(count):
+        ident = ''.join(rnd.choice('abcdefghijklmnopqrstuvwxyz0123456789') for _ in range(12))
+        corpus.append(update_scheme('http://', rnd.choice(TEMPLATES).format(id=ident, num=rnd.randrange(1, 100000))))
+    return corpus
+
+def linear_match(session, url):
+    available_plugins = [plugin for plugin in session.plugins.values() if plugin.can_handle_url(url)]
+    available_plugins.sort(key=lambda x: x.priority(url), reverse=True)
+    return available_plugins[0] if available_plugins else None
+
+def index_match(session, url):
+    available_plugins = session.plugin_index.match(url)
+    if len(available_plugins) > 1:
+        available_plugins.sort(key=lambda x: x.priority(url), reverse=True)
+    return available_plugins[0] if available_plugins else None
+
+def measure(name, match, session, corpus):
+    start = time()
+    results = [match(session, url) for url in corpus]
+    elapsed = time() - start
+    print('%-10s %8.2f us per url' % (name, elapsed*1e+06/len(corpus)))
+    return results
+
+class RedirectHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        if self.path.startswith('/s/'):
+            self.send_response(302)
+            self.send_header('Location', '/video/%s.m3u8' % self.path[3:])
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+def measure_redirects(count):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), RedirectHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    session = Streamlink()
+    urls = ['http://127.0.0.1:%d/s/%d' % (server.server_port, i) for i in range(count)]
+    for name in ('cold', 'cached'):
+        start = time()
+        plugins = [type(session.resolve_url(url)).__name__ for url in urls]
+        print('redirects %-8s %8.2f ms per url (%s)' % (name, (time() - start)*1000/count, plugins[0]))
+    server.shutdown()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--urls', type=int, default=20000)
+    parser.add_argument('--redirects', type=int, default=200)
+    args = parser.parse_args()
+    session = Streamlink()
+    corpus = make_corpus(args.urls)
+    linear = measure('linear', linear_match, session, corpus)
+    indexed = measure('indexed', index_match, session, corpus)
+    mismatches = [url for (url, a, b) in zip(corpus, linear, indexed) if a is not b]
+    assert not mismatches, mismatches[:5]
+    print('%d urls, same plugins, %d without plugin' % (len(corpus), linear.count(None)))
+    if args.redirects:
+        measure_redirects(args.redirects)
+if __name__ == '__main__':
+    main()
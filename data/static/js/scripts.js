@@ -70,13 +70,41 @@ var app = new Vue({
     },
     mounted: function() {
         let self = this;
+        let cursor = null;
         let request_tasks = async function(){
-            let resp = await fetch(SERVER + "/task/list");
-            self.setTasksData(await resp.json());
-
+            let since = cursor === null ? 0 : cursor;
+            let resp = await fetch(`${SERVER}/task/list?since=${since}`);
+            if (resp.status === 304){
+                return;
+            }
+            let result = await resp.json();
+            if (cursor === null){
+                self.setTasksData(result.tasks);
+            }else{
+                for(let task_id of result.deleted){
+                    self.removeTask(task_id);
+                }
+                for(let task of result.tasks){
+                    self.updateTask(task);
+                }
+            }
+            cursor = result.cursor;
+        }
+        if (!window.EventSource){
+            request_tasks();
+            setInterval(request_tasks, 3000);
+            return;
         }
-        request_tasks();
-        setInterval(request_tasks, 3000);
+        let events = new EventSource(SERVER + "/task/events");
+        events.addEventListener("snapshot", function(e){
+            self.setTasksData(JSON.parse(e.data));
+        });
+        events.addEventListener("update", function(e){
+            self.updateTask(JSON.parse(e.data));
+        });
+        events.addEventListener("delete", function(e){
+            self.removeTask(JSON.parse(e.data).id);
+        });
     },
     computed: {
         task_downloading: function() {
@@ -109,6 +137,39 @@ var app = new Vue({
             this.tasks_data = tasks_data;
             this.filter();
         },
+        updateTask: function(fields){
+            let task = this.tasks_data.find(function(t) {
+                return t.id === fields.id;
+            });
+            if ("create_at" in fields){
+                fields.create_at = new date_format(fields.create_at);
+            }
+            if (task){
+                let status_changed = "status" in fields && fields.status !== task.status;
+                Object.assign(task, fields);
+                if (!status_changed){
+                    return;
+                }
+            }else if ("url" in fields){
+                this.tasks_data.push(fields);
+            }else{
+                return;
+            }
+            this.filter();
+        },
+        removeTask: function(task_id){
+            for(let i = 0; i < this.tasks_data.length; ++i){
+                if (this.tasks_data[i].id === task_id){
+                    this.tasks_data.splice(i, 1);
+                    break;
+                }
+            }
+            if (this.selected_task_id === task_id){
+                this.selected_task_id = "";
+                this.$refs.task_table.resetCurrentSelected();
+            }
+            this.filter();
+        },
         columnDateSort: function(first_date, second_date, type){
             if(type === "asc"){
                 return first_date.raw - second_date.raw;
@@ -0,0 +1,88 @@
+import json
+import logging
+from queue import Queue, Full, Empty
+from threading import Lock
+log = logging.getLogger(__name__)
+KEEPALIVE_INTERVAL = 15
+CLIENT_QUEUE_SIZE = 1024
+
+class EventClient(object):
+    __doc__ = 'A single event stream connection, holding the events not sent yet.'
+
+    def __init__(self, broker):
+        self.broker = broker
+        self.queue = Queue(CLIENT_QUEUE_SIZE)
+        self.closed = False
+
+    def put(self, event, data):
+        try:
+            self.queue.put_nowait((event, data))
+        except Full:
+            log.warning('Event client is too slow, disconnect it')
+            self.closed = True
+
+    def stream(self, snapshot):
+        'Yields server-sent events, starting with a snapshot of every task.'
+        try:
+            yield format_event('snapshot', snapshot)
+            while not self.closed:
+                try:
+                    (event, data) = self.queue.get(timeout=KEEPALIVE_INTERVAL)
+                except Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                yield format_event(event, data)
+        finally:
+            self.broker.unsubscribe(self)
+
+class EventBroker(object):
+    __doc__ = """Fans task changes out to event stream clients.
+
+    The last published state of every task is kept so only the fields
+    which changed since then are sent.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._clients = set()
+        self._states = {}
+        self.events_published = 0
+
+    def subscribe(self):
+        client = EventClient(self)
+        with self._lock:
+            self._clients.add(client)
+        return client
+
+    def unsubscribe(self, client):
+        with self._lock:
+            self._clients.discard(client)
+
+    def publish(self, tid, fields):
+        with self._lock:
+            state = self._states.setdefault(tid, {})
+            changed = {k: v for (k, v) in fields.items() if k not in state or state[k] != v}
+            if not changed:
+                return
+            state.update(changed)
+            changed['id'] = tid
+            self._broadcast('update', changed)
+
+    def delete(self, tid):
+        with self._lock:
+            self._states.pop(tid, None)
+            self._broadcast('delete', {'id': tid})
+
+    def _broadcast(self, event, data):
+        self.events_published += 1
+        for client in list(self._clients):
+            client.put(event, data)
+            if client.closed:
+                self._clients.discard(client)
+
+    def stats(self):
+        with self._lock:
+            return {'clients': len(self._clients), 'events_published': self.events_published}
+
+def format_event(event, data):
+    return 'event: %s\ndata: %s\n\n' % (event, json.dumps(data))
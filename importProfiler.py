@@ -0,0 +1,110 @@
+import sys
+from time import perf_counter
+from threading import get_ident, Lock
+FLAG = '--profile-startup'
+
+class TimedLoader(object):
+    'Loader proxy timing the execution of the module it loads.'
+
+    def __init__(self, profiler, loader):
+        self._profiler = profiler
+        self._loader = loader
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        module.__loader__ = module.__spec__.loader = self._loader
+        self._profiler.enter(module.__name__)
+        try:
+            self._loader.exec_module(module)
+        finally:
+            self._profiler.exit()
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+class ImportProfiler(object):
+    __doc__ = """Measures the time spent importing each module.
+
+    Once started, it sits first in sys.meta_path and wraps the loaders
+    found by the other finders, so it works the same in frozen builds
+    where -X importtime is not available. The time of a module is split
+    into its own (self) and the one including the modules it imports
+    (cumulative), like -X importtime reports it.
+    """
+
+    def __init__(self):
+        self.times = {}
+        self.started = None
+        self.stopped = None
+        self._stacks = {}
+        self._finding = set()
+        self._lock = Lock()
+
+    @property
+    def active(self):
+        return self in sys.meta_path
+
+    def start(self):
+        if not self.active:
+            self.started = perf_counter()
+            sys.meta_path.insert(0, self)
+
+    def stop(self):
+        if self.active:
+            sys.meta_path.remove(self)
+            self.stopped = perf_counter()
+
+    def find_spec(self, fullname, path=None, target=None):
+        key = (get_ident(), fullname)
+        if key in self._finding:
+            return
+        self._finding.add(key)
+        try:
+            for finder in sys.meta_path:
+                if finder is self or not hasattr(finder, 'find_spec'):
+                    continue
+                spec = finder.find_spec(fullname, path, target)
+                if spec is not None:
+                    if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+                        spec.loader = TimedLoader(self, spec.loader)
+                    return spec
+        finally:
+            self._finding.discard(key)
+
+    def enter(self, name):
+        self._stacks.setdefault(get_ident(), []).append([name, perf_counter(), 0.0])
+
+    def exit(self):
+        stack = self._stacks[get_ident()]
+        (name, start, children) = stack.pop()
+        elapsed = perf_counter() - start
+        if stack:
+            stack[-1][2] += elapsed
+        with self._lock:
+            self.times[name] = (elapsed - children, elapsed)
+
+    def report(self, limit=30, file=None):
+        '''Prints the modules that took the longest to import, and the own
+        import time of the top level packages.
+        '''
+        file = file or sys.stdout
+        with self._lock:
+            times = dict(self.times)
+        packages = {}
+        for (name, (own, _)) in times.items():
+            package = name.split('.', 1)[0]
+            packages[package] = packages.get(package, 0.0) + own
+        total = sum(own for (own, _) in times.values())
+        elapsed = (self.stopped or perf_counter()) - self.started
+        print(' Startup: %.0f ms, %d modules imported in %.0f ms' % (elapsed*1000, len(times), total*1000), file=file)
+        print(' %10s %10s  %s' % ('self (ms)', 'cumul (ms)', 'module'), file=file)
+        for (name, (own, cumulative)) in sorted(times.items(), key=lambda item: item[1][1], reverse=True)[:limit]:
+            print(' %10.1f %10.1f  %s' % (own*1000, cumulative*1000, name), file=file)
+        print(' %10s %10s  %s' % ('self (ms)', '', 'package'), file=file)
+        for (package, own) in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:limit]:
+            print(' %10.1f %10s  %s' % (own*1000, '', package), file=file)
+
+import_profiler = ImportProfiler()
+__all__ = ['ImportProfiler', 'import_profiler', 'FLAG']
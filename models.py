@@ -1,20 +1,122 @@
 import os
 import json
 import time
+import sqlite3
 from hashlib import md5
+from threading import RLock
 from datetime import datetime
-from sqlalchemy import String, Column, DateTime, asc
+from sqlalchemy import String, Integer, Column, DateTime, Index, asc, desc, event, func, inspect, or_, and_, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import create_engine
-from sqlalchemy.pool import NullPool
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.orm import sessionmaker, scoped_session
 from contextlib import contextmanager
-from constants import QUEUING, COMPLETED, ERROR, STOPPED
+from constants import QUEUING, RUNNING, COMPLETED, ERROR, STOPPED
 from exceptions import TaskNotExist
-sql_engine = create_engine('sqlite:///data.db', poolclass=NullPool)
+DB_URL = 'sqlite:///data.db'
+DB_OPTIONS = {'pool_size': 8, 'max_overflow': 64, 'pool_timeout': 30, 'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'busy_timeout': 10000, 'cache_size': -65536, 'mmap_size': 268435456}
+
+def create_sql_engine(url=DB_URL, **options):
+    '''Creates a pooled SQLite engine.
+
+    Connections are kept open in a thread-safe QueuePool and every new
+    connection is set up with the journal/synchronous/cache/mmap pragmas
+    and a busy timeout so writers wait for locks instead of failing.
+    '''
+    conf = dict(DB_OPTIONS)
+    conf.update(options)
+    engine = create_engine(url, poolclass=QueuePool, pool_size=conf['pool_size'], max_overflow=conf['max_overflow'], pool_timeout=conf['pool_timeout'], pool_pre_ping=False, connect_args={'check_same_thread': False, 'timeout': conf['busy_timeout']/1000.0})
+
+    @event.listens_for(engine, 'connect')
+    def setPragmas(dbapi_conn, conn_record):
+        cursor = dbapi_conn.cursor()
+        try:
+            cursor.execute('PRAGMA journal_mode=%s' % conf['journal_mode'])
+            cursor.execute('PRAGMA synchronous=%s' % conf['synchronous'])
+            cursor.execute('PRAGMA busy_timeout=%d' % conf['busy_timeout'])
+            cursor.execute('PRAGMA cache_size=%d' % conf['cache_size'])
+            cursor.execute('PRAGMA mmap_size=%d' % conf['mmap_size'])
+            cursor.execute('PRAGMA temp_store=MEMORY')
+        finally:
+            cursor.close()
+
+    return engine
+
 Base = declarative_base()
-session_factory = sessionmaker(bind=sql_engine, autoflush=True, autocommit=False)
+session_factory = sessionmaker(autoflush=True, autocommit=False)
 Session = scoped_session(session_factory)
+sql_engine = None
+DEFAULT_PAGE_SIZE = 200
+MAX_PAGE_SIZE = 1000
+HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+def migrate_schema(engine):
+    '''Adds columns and indexes declared on the models but missing from an existing database.
+
+    Tasks written before the version column existed get versions past the
+    current ones, so a since-cursor of 0 still lists them.
+    '''
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = set(c['name'] for c in inspector.get_columns(table.name))
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = 'ALTER TABLE %s ADD COLUMN %s %s' % (table.name, column.name, column.type.compile(engine.dialect))
+                if column.default is not None and column.default.is_scalar:
+                    ddl += ' DEFAULT %r' % (column.default.arg,)
+                conn.execute(text(ddl))
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+        if inspector.has_table(TaskDB.__tablename__):
+            top = conn.execute(text('SELECT MAX(version) FROM %s' % TaskDB.__tablename__)).scalar() or 0
+            conn.execute(text('UPDATE %s SET version = :top + rowid WHERE version = 0 OR version IS NULL' % TaskDB.__tablename__), {'top': top})
+
+def setup_engine(url=DB_URL, **options):
+    'Binds sessions to a new engine, disposing the previous one, and creates missing tables.'
+    global sql_engine
+    Session.remove()
+    if sql_engine is not None:
+        sql_engine.dispose()
+    sql_engine = create_sql_engine(url, **options)
+    session_factory.configure(bind=sql_engine)
+    Base.metadata.create_all(bind=sql_engine)
+    migrate_schema(sql_engine)
+    with session_query() as s:
+        task_version.reset(max(s.query(func.max(TaskDB.version)).scalar() or 0, s.query(func.max(TaskTombstone.version)).scalar() or 0))
+    return sql_engine
+
+class VersionCounter(object):
+    __doc__ = """Monotonic change counter stamped on every write to the tasks table.
+
+    Writers hold the counter while their transaction commits so versions
+    become visible in increasing order and a since-cursor never skips rows.
+    """
+
+    def __init__(self):
+        self.value = 0
+        self._lock = RLock()
+
+    def __enter__(self):
+        self._lock.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self._lock.release()
+
+    def reset(self, value):
+        with self._lock:
+            self.value = value
+
+    def next(self):
+        with self._lock:
+            self.value += 1
+            return self.value
+
+task_version = VersionCounter()
 
 @contextmanager
 def session_commit():
@@ -28,6 +130,12 @@ def session_commit():
     finally:
         Session.remove()
 
+@contextmanager
+def session_versioned():
+    with task_version:
+        with session_commit() as session:
+            yield session
+
 @contextmanager
 def session_query():
     session = Session()
@@ -46,16 +154,22 @@ class TaskDB(Base):
     path = Column(String)
     headers = Column(String, default='')
     quality = Column(String, default='best')
-    create_at = Column(DateTime, default=datetime.now())
+    create_at = Column(DateTime, default=datetime.now)
     status = Column(String, default=QUEUING)
+    priority = Column(Integer, default=0, nullable=False)
+    bandwidth_weight = Column(Integer, default=1, nullable=False)
+    bandwidth_limit = Column(Integer, default=0, nullable=False)
+    remuxer = Column(String, default='', nullable=False)
     error = Column(String, default='')
     qualities = Column(String, default='[]')
     speed = Column(String, default='')
     eta = Column(String, default='')
     percent = Column(String, default='')
+    version = Column(Integer, default=0, nullable=False)
+    __table_args__ = (Index('ix_tasks_status_priority_create_at', 'status', desc('priority'), 'create_at'), Index('ix_tasks_version', 'version'), Index('ix_tasks_create_at_id', 'create_at', 'id'))
 
     def serialize(self):
-        return {'id': self.id, 'url': self.url, 'path': self.path, 'file_name': os.path.basename(self.path), 'headers': json.loads(self.headers), 'quality': self.quality, 'status': self.status, 'error': self.error, 'qualities': json.loads(self.qualities), 'speed': self.speed, 'eta': self.eta, 'percent': self.percent, 'create_at': self.create_at.timestamp()}
+        return {'id': self.id, 'url': self.url, 'path': self.path, 'file_name': os.path.basename(self.path), 'headers': json.loads(self.headers), 'quality': self.quality, 'status': self.status, 'error': self.error, 'qualities': json.loads(self.qualities), 'speed': self.speed, 'eta': self.eta, 'percent': self.percent, 'priority': self.priority, 'bandwidth_weight': self.bandwidth_weight, 'bandwidth_limit': self.bandwidth_limit, 'remuxer': self.remuxer, 'create_at': self.create_at.timestamp()}
 
     @classmethod
     def makeTaskId(cls, url):
@@ -63,22 +177,36 @@ class TaskDB(Base):
         return h.hexdigest()
 
     @classmethod
-    def create(cls, tid, url, headers, path):
-        with session_commit() as s:
-            s.add(cls(id=tid, url=url, path=path, headers=headers))
+    def create(cls, tid, url, headers, path, priority=0, bandwidth_weight=1, bandwidth_limit=0, remuxer=''):
+        with session_versioned() as s:
+            s.query(TaskTombstone).filter_by(id=tid).delete()
+            s.add(cls(id=tid, url=url, path=path, headers=headers, priority=priority, bandwidth_weight=bandwidth_weight, bandwidth_limit=bandwidth_limit, remuxer=remuxer, version=task_version.next()))
 
     @classmethod
     def update(cls, tid, **kwargs):
         kwargs = dict(kwargs)
-        with session_commit() as s:
+        with session_versioned() as s:
+            kwargs['version'] = task_version.next()
             row_count = s.query(cls).filter_by(id=tid).update(kwargs, synchronize_session='fetch')
             if row_count == 0:
                 raise TaskNotExist(tid)
 
+    @classmethod
+    def update_many(cls, updates):
+        'Applies a mapping of task id -> fields in one transaction, rows deleted meanwhile are skipped.'
+        with session_versioned() as s:
+            query = s.query(cls)
+            for (tid, kwargs) in updates.items():
+                query.filter_by(id=tid).update(dict(kwargs, version=task_version.next()), synchronize_session=False)
+
     @classmethod
     def stop_tasks(cls):
-        with session_commit() as s:
-            s.query(cls).filter(cls.status.notin_([COMPLETED, ERROR, STOPPED])).update({'status': STOPPED, 'speed': '', 'eta': '', 'percent': ''}, synchronize_session='fetch')
+        with session_versioned() as s:
+            query = s.query(cls).filter(cls.status.notin_([COMPLETED, ERROR, STOPPED]))
+            tids = [t.id for t in query.with_entities(cls.id)]
+            for tid in tids:
+                s.query(cls).filter_by(id=tid).update({'status': STOPPED, 'speed': '', 'eta': '', 'percent': '', 'version': task_version.next()}, synchronize_session=False)
+            return tids
 
     @classmethod
     def getTask(cls, tid):
@@ -100,20 +228,115 @@ class TaskDB(Base):
             if task:
                 return task
 
+    @classmethod
+    def claimNextTask(cls):
+        '''Atomically moves the next queued task to running and returns it.
+
+        Tasks are taken by highest priority first, then oldest create_at,
+        using the (status, priority, create_at) index so the cost does not
+        grow with the number of finished tasks. Returns None when the
+        queue is empty. The version is only taken when a task is claimed,
+        so polling an empty queue does not change the task listings.
+        '''
+        if HAS_RETURNING:
+            with session_versioned() as s:
+                version = task_version.value + 1
+                task = s.execute(text('UPDATE tasks SET status = :running, version = :version WHERE id = (SELECT id FROM tasks WHERE status = :queuing ORDER BY priority DESC, create_at ASC LIMIT 1) RETURNING id, url, path, headers, quality, priority, bandwidth_weight, bandwidth_limit, remuxer'), {'running': RUNNING, 'queuing': QUEUING, 'version': version}).first()
+                if task is not None:
+                    task_version.reset(version)
+                return task
+        while True:
+            with session_versioned() as s:
+                task = s.query(cls.id).filter_by(status=QUEUING).order_by(desc(cls.priority), asc(cls.create_at)).first()
+                if not task:
+                    return
+                version = task_version.value + 1
+                if s.query(cls).filter_by(id=task.id, status=QUEUING).update({'status': RUNNING, 'version': version}, synchronize_session=False):
+                    task_version.reset(version)
+                    tid = task.id
+                    break
+        return cls.getTask(tid)
+
     @classmethod
     def getAllTasksByStatus(cls, status):
         with session_query() as s:
             return s.query(cls).filter_by(status=status).order_by(asc(cls.create_at)).all()
 
+    @classmethod
+    def listChanges(cls, since, status=None, limit=None):
+        '''Returns tasks changed after the version cursor *since*.
+
+        The result holds the changed rows ordered by version, the ids
+        deleted since then, the cursor to send next time and whether
+        more rows are left past *limit*. With *status*, rows changed to
+        another status are listed as deleted, so a filtered client drops
+        them.
+        '''
+        with task_version:
+            committed = task_version.value
+        with session_query() as s:
+            query = s.query(cls).filter(cls.version > since)
+            if status:
+                query = query.filter_by(status=status)
+            tasks = query.order_by(asc(cls.version)).limit(limit + 1 if limit else None).all()
+            more = bool(limit) and len(tasks) > limit
+            if more:
+                tasks = tasks[:limit]
+            cursor = tasks[-1].version if tasks else since
+            deleted = s.query(TaskTombstone).filter(TaskTombstone.version > since)
+            if more:
+                deleted = deleted.filter(TaskTombstone.version <= cursor)
+            deleted = [(t.id, t.version) for t in deleted.all()]
+            if status:
+                left = s.query(cls.id, cls.version).filter(cls.version > since, cls.status != status)
+                if more:
+                    left = left.filter(cls.version <= cursor)
+                deleted += [(t.id, t.version) for t in left.all()]
+            if deleted:
+                cursor = max(cursor, max(version for (_, version) in deleted))
+            if not more:
+                cursor = max(cursor, committed)
+            return {'tasks': [t.serialize() for t in tasks], 'deleted': [tid for (tid, _) in deleted], 'cursor': cursor, 'more': more}
+
+    @classmethod
+    def listPage(cls, page=None, status=None, limit=DEFAULT_PAGE_SIZE):
+        '''Returns one page of tasks, newest first.
+
+        Pages are keyed by (create_at, id) of the last row instead of an
+        offset, *page* is the ``next`` token of the previous page.
+        '''
+        with task_version:
+            cursor = task_version.value
+        with session_query() as s:
+            query = s.query(cls)
+            if status:
+                query = query.filter_by(status=status)
+            if page:
+                (create_at, tid) = page.split(',', 1)
+                create_at = datetime.fromisoformat(create_at)
+                query = query.filter(or_(cls.create_at < create_at, and_(cls.create_at == create_at, cls.id < tid)))
+            tasks = query.order_by(desc(cls.create_at), desc(cls.id)).limit(limit + 1).all()
+            next_page = None
+            if len(tasks) > limit:
+                tasks = tasks[:limit]
+                next_page = '%s,%s' % (tasks[-1].create_at.isoformat(), tasks[-1].id)
+            return {'tasks': [t.serialize() for t in tasks], 'next': next_page, 'cursor': cursor}
+
     @classmethod
     def delete(cls, tid):
-        with session_commit() as s:
-            s.query(cls).filter_by(id=tid).delete()
+        with session_versioned() as s:
+            if s.query(cls).filter_by(id=tid).delete():
+                s.merge(TaskTombstone(id=tid, version=task_version.next()))
 
     def __repr__(self):
         return 'id: %s, url: %s, status: %s' % (self.id, self.url, self.status)
 
-Base.metadata.create_all(bind=sql_engine)
+class TaskTombstone(Base):
+    __tablename__ = 'task_tombstones'
+    id = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, index=True)
+
+setup_engine()
 if __name__ == '__main__':
     task = TaskDB.getTask('9b981ade347bd136058e11749a5cf17b')
     print(task)
@@ -0,0 +1,75 @@
+import logging
+from threading import Thread, Event, Lock
+from models import TaskDB
+log = logging.getLogger(__name__)
+
+class ProgressJournal(Thread):
+    __doc__ = """Write-behind store for task progress.
+
+    Progress fields are kept in memory and flushed to TaskDB in a single
+    transaction every ``interval`` milliseconds, status transitions are
+    written through immediately.
+    """
+
+    def __init__(self, interval=500):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self._pending = {}
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._ev_close = Event()
+        self.flush_count = 0
+        self.rows_flushed = 0
+        self.updates_coalesced = 0
+        self.closed = False
+
+    def put(self, tid, **kwargs):
+        'Records progress fields of a task, never touches the database.'
+        with self._lock:
+            if tid in self._pending:
+                self.updates_coalesced += 1
+                self._pending[tid].update(kwargs)
+            else:
+                self._pending[tid] = kwargs
+
+    def discard(self, tid):
+        with self._lock:
+            self._pending.pop(tid, None)
+
+    def write_through(self, tid, **kwargs):
+        with self._flush_lock:
+            self.discard(tid)
+            TaskDB.update(tid, **kwargs)
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                (batch, self._pending) = (self._pending, {})
+            if not batch:
+                return
+            try:
+                TaskDB.update_many(batch)
+            except Exception as err:
+                log.error('Flush progress of %d tasks error %s, retrying on the next flush', len(batch), err)
+                with self._lock:
+                    for (tid, fields) in batch.items():
+                        fields.update(self._pending.get(tid, ()))
+                        self._pending[tid] = fields
+                return
+            self.flush_count += 1
+            self.rows_flushed += len(batch)
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {'interval': self.interval, 'pending': pending, 'flush_count': self.flush_count, 'rows_flushed': self.rows_flushed, 'updates_coalesced': self.updates_coalesced}
+
+    def run(self):
+        while not self.closed:
+            self._ev_close.wait(self.interval/1000.0)
+            self.flush()
+
+    def shutdown(self):
+        self.closed = True
+        self._ev_close.set()
+        self.flush()
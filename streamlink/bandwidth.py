@@ -0,0 +1,150 @@
+import logging
+from threading import Lock
+from time import time, sleep
+ACTIVE_WINDOW = 2.0
+RESHARE_INTERVAL = 1.0
+BURST_SECONDS = 0.25
+MIN_BURST = 65536
+SLEEP_SLICE = 0.5
+log = logging.getLogger(__name__)
+
+class BandwidthOwner(object):
+    __doc__ = """Bandwidth account of one task, every read path of the task draws from it.
+
+    *weight* is the share of the global limit relative to the other
+    active owners, *limit* a cap in bytes per second (None: no cap),
+    *rate* the refill rate currently given by the scheduler.
+    """
+
+    def __init__(self, scheduler, key, weight=1, limit=None):
+        self.scheduler = scheduler
+        self.key = key
+        self.weight = weight
+        self.limit = limit
+        self.rate = limit
+        self.tokens = 0.0
+        self.tokens_time = time()
+        self.last_active = 0
+        self.bytes = 0
+        self.waits = 0
+
+    def consume(self, n, abort=None):
+        '''Takes *n* received bytes, sleeps while the owner is over its rate.
+
+        *abort* is polled while sleeping, the wait ends once it returns True.
+        '''
+        self.scheduler.consume(self, n, abort)
+
+    def stats(self):
+        return {'weight': self.weight, 'limit': self.limit, 'rate': self.rate, 'bytes': self.bytes, 'waits': self.waits}
+
+class BandwidthScheduler(object):
+    __doc__ = """Process-wide token-bucket bandwidth scheduler.
+
+    Each owner has a token bucket refilled at its rate. Without a global
+    limit the rate is the owner's own limit. With a global limit it is
+    shared between the owners active in the last ACTIVE_WINDOW seconds
+    by weighted max-min fairness: owners capped below their weighted
+    share keep their cap and the rest is split by weight among the
+    others. Shares are recomputed when an owner becomes active, on
+    configuration changes and every RESHARE_INTERVAL seconds.
+    """
+
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.owners = {}
+        self._lock = Lock()
+        self._reshare_at = 0
+
+    def configure(self, limit=None):
+        'Sets the global limit in bytes per second, None or 0 is unlimited.'
+        with self._lock:
+            self.limit = limit or None
+            self._reshare(time())
+
+    def owner(self, key=None):
+        'Returns the owner of *key*, created with weight 1 and no cap.'
+        with self._lock:
+            owner = self.owners.get(key)
+            if owner is None:
+                owner = self.owners[key] = BandwidthOwner(self, key)
+                self._reshare(time())
+            return owner
+
+    def set_owner(self, key, weight=1, limit=None, create=True):
+        '''Changes the weight and cap of *key*, applied to running reads at once.
+
+        Returns False when the owner does not exist and *create* is False.
+        '''
+        with self._lock:
+            owner = self.owners.get(key)
+            if owner is None:
+                if not create:
+                    return False
+                owner = self.owners[key] = BandwidthOwner(self, key)
+            owner.weight = max(1, weight or 1)
+            owner.limit = limit or None
+            self._reshare(time())
+            return True
+
+    def remove(self, key):
+        with self._lock:
+            if self.owners.pop(key, None) is not None:
+                self._reshare(time())
+
+    def _reshare(self, now):
+        owners = list(self.owners.values())
+        if not self.limit:
+            for owner in owners:
+                owner.rate = owner.limit
+            self._reshare_at = now
+            return
+        active = [owner for owner in owners if now - owner.last_active < ACTIVE_WINDOW]
+        capacity = float(self.limit)
+        weights = sum(owner.weight for owner in active)
+        for owner in sorted(active, key=lambda owner: (owner.limit or float('inf'))/owner.weight):
+            share = capacity*owner.weight/weights
+            if owner.limit and owner.limit < share:
+                share = owner.limit
+            owner.rate = share
+            capacity -= share
+            weights -= owner.weight
+        total_weight = sum(owner.weight for owner in active)
+        for owner in owners:
+            if now - owner.last_active >= ACTIVE_WINDOW:
+                share = float(self.limit)*owner.weight/(total_weight + owner.weight)
+                owner.rate = min(share, owner.limit) if owner.limit else share
+        self._reshare_at = now
+
+    def consume(self, owner, n, abort=None):
+        with self._lock:
+            now = time()
+            owner.bytes += n
+            idle = now - owner.last_active >= ACTIVE_WINDOW
+            owner.last_active = now
+            if idle and self.limit or now - self._reshare_at >= RESHARE_INTERVAL:
+                self._reshare(now)
+            rate = owner.rate
+            if not rate:
+                return
+            burst = max(MIN_BURST, rate*BURST_SECONDS)
+            owner.tokens = min(burst, owner.tokens + (now - owner.tokens_time)*rate)
+            owner.tokens_time = now
+            owner.tokens -= n
+            if owner.tokens >= 0:
+                return
+            delay = -owner.tokens/rate
+            owner.waits += 1
+        deadline = now + delay
+        while True:
+            remain = deadline - time()
+            if remain <= 0 or abort and abort():
+                return
+            sleep(min(remain, SLEEP_SLICE))
+
+    def stats(self):
+        with self._lock:
+            return {'limit': self.limit, 'owners': {str(key): owner.stats() for (key, owner) in self.owners.items()}}
+
+bandwidth_scheduler = BandwidthScheduler()
+__all__ = ['BandwidthOwner', 'BandwidthScheduler', 'bandwidth_scheduler']
@@ -1,6 +1,7 @@
+import mmap
 from collections import deque
 from io import BytesIO
-from threading import Event, Lock
+from threading import Condition, Event, Lock
 
 class Chunk(BytesIO):
     __doc__ = 'A single chunk, part of the buffer.'
@@ -133,4 +134,174 @@ class RingBuffer(Buffer):
     def is_full(self):
         return self.free == 0
 
-__all__ = ['Buffer', 'RingBuffer']
+class CircularBuffer(object):
+    __doc__ = """Circular buffer over a preallocated byte array for use in
+    multi-threaded consumer/filler.
+
+    Unlike RingBuffer, data is not kept as a chunk per write: write_from
+    copies it into the array and readinto copies it out to the caller's
+    buffer, so each byte is copied once on the way in and once on the
+    way out. peek gives the buffered data as memoryviews without copying
+    it, consume then drops it. The filler and the consumer wait on two
+    conditions of a single lock, which are only notified when the buffer
+    stops being empty or full.
+
+    The array of *size* bytes is an anonymous memory map, its pages only
+    take memory once data reaches them and the buffer starts over at the
+    beginning whenever it is emptied, so a stream read as fast as it is
+    filled only uses the first pages.
+    """
+
+    def __init__(self, size=32768):
+        self.buffer_size = size
+        self.data = mmap.mmap(-1, max(size, 1))
+        self.start = 0
+        self.length = 0
+        self.closed = False
+        self.buffer_lock = Lock()
+        self.not_full = Condition(self.buffer_lock)
+        self.not_empty = Condition(self.buffer_lock)
+
+    def _views(self, size):
+        'Returns the memoryviews of the first *size* buffered bytes, the lock must be held.'
+        view = memoryview(self.data)
+        end = self.start + size
+        if end <= len(self.data):
+            return (view[self.start:end],)
+        return (view[self.start:], view[:end - len(self.data)])
+
+    def _grow(self, size):
+        'Moves the data to an array of *size* bytes, the lock must be held.'
+        data = mmap.mmap(-1, size)
+        pos = 0
+        for view in self._views(self.length):
+            data[pos:pos + len(view)] = view
+            pos += len(view)
+        (self.data, self.start) = (data, 0)
+
+    def _put(self, view):
+        end = (self.start + self.length) % len(self.data)
+        first = min(len(view), len(self.data) - end)
+        self.data[end:end + first] = view[:first]
+        if first < len(view):
+            self.data[:len(view) - first] = view[first:]
+        if not self.length:
+            self.not_empty.notify_all()
+        self.length += len(view)
+
+    def _drop(self, size):
+        if size and self.is_full:
+            self.not_full.notify_all()
+        self.length -= size
+        self.start = (self.start + size) % len(self.data) if self.length else 0
+
+    def _used(self):
+        return self.length > 0 or self.closed
+
+    def _not_full(self):
+        return not self.is_full or self.closed
+
+    def _wait_used(self, block, timeout):
+        if block and not self._used() and not self.not_empty.wait_for(self._used, timeout):
+            raise IOError('Read timeout')
+
+    def write_from(self, data):
+        '''Copies *data*, any object supporting the buffer protocol, into
+        the buffer, blocking while it is full. Returns the number of
+        bytes written, less than the size of *data* if the buffer was
+        closed meanwhile.
+        '''
+        view = memoryview(data)
+        if view.ndim != 1 or view.itemsize != 1:
+            view = view.cast('B')
+        written = 0
+        with self.buffer_lock:
+            while written < len(view):
+                self.not_full.wait_for(self._not_full)
+                if self.closed:
+                    break
+                size = min(self.free, len(view) - written)
+                self._put(view[written:written + size])
+                written += size
+        return written
+
+    def write(self, data):
+        if not self.closed:
+            self.write_from(data)
+
+    def readinto(self, buffer, block=True, timeout=None):
+        '''Moves up to len(*buffer*) bytes into the writable *buffer*,
+        returns their number, 0 once the buffer is closed and empty.
+        '''
+        out = memoryview(buffer)
+        if out.ndim != 1 or out.itemsize != 1:
+            out = out.cast('B')
+        with self.buffer_lock:
+            self._wait_used(block, timeout)
+            pos = 0
+            for view in self._views(min(len(out), self.length)):
+                out[pos:pos + len(view)] = view
+                pos += len(view)
+            self._drop(pos)
+        return pos
+
+    def read(self, size=-1, block=True, timeout=None):
+        with self.buffer_lock:
+            self._wait_used(block, timeout)
+            if size < 0 or size > self.length:
+                size = self.length
+            views = self._views(size)
+            data = views[0].tobytes() if len(views) == 1 else b''.join(views)
+            self._drop(size)
+        return data
+
+    def peek(self, size=-1):
+        '''Returns read-only memoryviews of up to *size* buffered bytes,
+        two when they wrap around the end of the bytearray, without
+        removing them. They stay valid after the data is consumed but
+        may then be overwritten, consume the data once done with them.
+        '''
+        with self.buffer_lock:
+            if size < 0 or size > self.length:
+                size = self.length
+            if not size:
+                return ()
+            return tuple(view.toreadonly() for view in self._views(size))
+
+    def consume(self, size):
+        'Drops up to *size* bytes from the front of the buffer, returns their number.'
+        with self.buffer_lock:
+            size = min(size, self.length)
+            self._drop(size)
+        return size
+
+    def resize(self, size):
+        with self.buffer_lock:
+            if size > len(self.data):
+                self._grow(size)
+            self.buffer_size = size
+            self.not_full.notify_all()
+
+    def wait_free(self, timeout=None):
+        with self.buffer_lock:
+            self.not_full.wait_for(self._not_full, timeout)
+
+    def wait_used(self, timeout=None):
+        with self.buffer_lock:
+            self.not_empty.wait_for(self._used, timeout)
+
+    def close(self):
+        with self.buffer_lock:
+            self.closed = True
+            self.not_full.notify_all()
+            self.not_empty.notify_all()
+
+    @property
+    def free(self):
+        return max(self.buffer_size - self.length, 0)
+
+    @property
+    def is_full(self):
+        return self.free == 0
+
+__all__ = ['Buffer', 'RingBuffer', 'CircularBuffer']
@@ -1,91 +1,246 @@
-import json
 import os
-import shutil
-import tempfile
-from time import time, mktime
+import json
+import atexit
+import logging
+import sqlite3
+from heapq import heappush, heappop, heapify
+from threading import Event, Lock, Thread
+from time import time, mktime, sleep
 from .compat import is_win32
 if is_win32:
     xdg_cache = os.environ.get('APPDATA', os.path.expanduser('~'))
 else:
     xdg_cache = os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache'))
 cache_dir = os.path.join(xdg_cache, 'streamlink')
+FLUSH_INTERVAL = 1.0
+log = logging.getLogger(__name__)
+
+class CacheStore(object):
+    __doc__ = """In-process store of the entries of a cache file.
+
+    Entries live in a dict, expired ones are dropped lazily on lookup
+    and in bulk through a heap of expiry times. Changes are written
+    behind to an SQLite table by a background thread at most every
+    *interval* seconds and when the process exits, so lookups and
+    updates never touch the disk. Entries of an old JSON cache file are
+    imported on first use.
+    """
+
+    def __init__(self, filename, interval=FLUSH_INTERVAL):
+        self.filename = filename
+        self.path = os.path.splitext(filename)[0] + '.sqlite'
+        self.interval = interval
+        self.flushes = 0
+        self._entries = None
+        self._heap = []
+        self._dirty = {}
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._wakeup = Event()
+        self._thread = None
+
+    def _load(self):
+        entries = {}
+        imported = os.path.exists(self.path)
+        try:
+            with self._flush_lock:
+                conn = self._connect()
+                try:
+                    rows = conn.execute('SELECT key, value, expires FROM cache WHERE expires > ?', (time(),)).fetchall()
+                finally:
+                    conn.close()
+            for (key, value, expires) in rows:
+                entries[key] = (json.loads(value), expires)
+        except (sqlite3.Error, OSError, ValueError) as err:
+            log.warning('Unable to load cache {0}: {1}', self.path, err)
+        if not imported and os.path.exists(self.filename):
+            entries = self._import_json()
+        return entries
+
+    def _import_json(self):
+        entries = {}
+        try:
+            with open(self.filename, 'r') as fd:
+                data = json.load(fd)
+            now = time()
+            for (key, entry) in data.items():
+                if entry.get('expires', now) > now and 'value' in entry:
+                    entries[key] = (entry['value'], entry['expires'])
+                    self._dirty[key] = (json.dumps(entry['value']), entry['expires'])
+        except (IOError, OSError, ValueError, AttributeError) as err:
+            log.debug('Unable to import cache {0}: {1}', self.filename, err)
+        return entries
+
+    def _connect(self):
+        directory = os.path.dirname(self.path)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, expires REAL)')
+        return conn
+
+    def _ensure_loaded(self):
+        if self._entries is None:
+            entries = self._load()
+            with self._lock:
+                if self._entries is None:
+                    self._entries = entries
+                    self._heap = [(expires, key) for (key, (_, expires)) in entries.items()]
+                    heapify(self._heap)
+
+    def _expire(self, now):
+        'Drops the entries expired at *now*, the lock must be held.'
+        while self._heap and self._heap[0][0] <= now:
+            (expires, key) = heappop(self._heap)
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] == expires:
+                del self._entries[key]
+                self._dirty[key] = None
+        if len(self._heap) > 2*len(self._entries) + 64:
+            self._heap = [(expires, key) for (key, (_, expires)) in self._entries.items()]
+            heapify(self._heap)
+
+    def get(self, key):
+        'Returns the (value, expires) entry of *key*, or None.'
+        self._ensure_loaded()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= time():
+                return
+            return entry
+
+    def items(self):
+        self._ensure_loaded()
+        with self._lock:
+            self._expire(time())
+            return list(self._entries.items())
+
+    def set(self, key, value, expires):
+        data = json.dumps(value)
+        self._ensure_loaded()
+        with self._lock:
+            self._expire(time())
+            self._entries[key] = (value, expires)
+            heappush(self._heap, (expires, key))
+            self._dirty[key] = (data, expires)
+        self._schedule()
+
+    def delete(self, key):
+        self._ensure_loaded()
+        with self._lock:
+            if self._entries.pop(key, None) is None:
+                return False
+            self._dirty[key] = None
+        self._schedule()
+        return True
+
+    def _schedule(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = Thread(target=self._run, name='Thread-CacheWriter', daemon=True)
+                    self._thread.start()
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            self.flush()
+            sleep(self.interval)
+
+    def flush(self):
+        'Writes the pending changes to the SQLite table.'
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                (dirty, self._dirty) = (self._dirty, {})
+            try:
+                conn = self._connect()
+                try:
+                    with conn:
+                        conn.executemany('INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)', [(key, entry[0], entry[1]) for (key, entry) in dirty.items() if entry is not None])
+                        conn.executemany('DELETE FROM cache WHERE key = ?', [(key,) for (key, entry) in dirty.items() if entry is None])
+                        conn.execute('DELETE FROM cache WHERE expires <= ?', (time(),))
+                finally:
+                    conn.close()
+                self.flushes += 1
+            except (sqlite3.Error, OSError) as err:
+                log.warning('Unable to write cache {0}: {1}', self.path, err)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries or ()), 'pending': len(self._dirty), 'flushes': self.flushes}
+
+_stores = {}
+_stores_lock = Lock()
+
+def get_store(filename):
+    'Returns the store of *filename* shared by every Cache of the process.'
+    with _stores_lock:
+        store = _stores.get(filename)
+        if store is None:
+            store = _stores[filename] = CacheStore(filename)
+        return store
+
+@atexit.register
+def flush_all():
+    for store in list(_stores.values()):
+        store.flush()
 
 class Cache(object):
-    __doc__ = 'Caches Python values as JSON and prunes expired entries.'
+    __doc__ = """Caches Python values that can be serialized to JSON.
+
+    Every Cache of the same *filename* shares one in-process store, so
+    lookups and updates are dict operations safe to use from any thread
+    and changes are persisted in the background. Values are kept as
+    given, they should not be modified after being set or returned.
+    """
 
     def __init__(self, filename, key_prefix=''):
         self.key_prefix = key_prefix
         self.filename = os.path.join(cache_dir, filename)
-        self._cache = {}
+        self._store = get_store(self.filename)
 
-    def _load(self):
-        if os.path.exists(self.filename):
-            try:
-                with open(self.filename, 'r') as fd:
-                    self._cache = json.load(fd)
-            except Exception:
-                self._cache = {}
-        else:
-            self._cache = {}
-
-    def _prune(self):
-        now = time()
-        pruned = []
-        for (key, value) in self._cache.items():
-            expires = value.get('expires', time())
-            if expires <= now:
-                pruned.append(key)
-        for key in pruned:
-            self._cache.pop(key, None)
-        return len(pruned) > 0
-
-    def _save(self):
-        (fd, tempname) = tempfile.mkstemp()
-        fd = os.fdopen(fd, 'w')
-        json.dump(self._cache, fd, indent=2, separators=(',', ': '))
-        fd.close()
-        try:
-            if not os.path.exists(os.path.dirname(self.filename)):
-                os.makedirs(os.path.dirname(self.filename))
-            shutil.move(tempname, self.filename)
-        except (IOError, OSError):
-            os.remove(tempname)
+    def _key(self, key):
+        if self.key_prefix:
+            return '{0}:{1}'.format(self.key_prefix, key)
+        return key
 
     def set(self, key, value, expires=604800, expires_at=None):
-        self._load()
-        self._prune()
-        if self.key_prefix:
-            key = '{0}:{1}'.format(self.key_prefix, key)
         expires += time()
         if expires_at:
             expires = mktime(expires_at.timetuple())
-        self._cache[key] = dict(value=value, expires=expires)
-        self._save()
+        self._store.set(self._key(key), value, expires)
 
     def get(self, key, default=None):
-        self._load()
-        if self._prune():
-            self._save()
-        if self.key_prefix:
-            key = '{0}:{1}'.format(self.key_prefix, key)
-        if key in self._cache and 'value' in self._cache[key]:
-            return self._cache[key]['value']
-        else:
+        entry = self._store.get(self._key(key))
+        if entry is None:
             return default
+        return entry[0]
+
+    def delete(self, key):
+        'Removes *key*, returns False when it was not cached.'
+        return self._store.delete(self._key(key))
 
     def get_all(self):
         ret = {}
-        self._load()
-        if self._prune():
-            self._save()
-        for (key, value) in self._cache.items():
-            if self.key_prefix:
-                prefix = self.key_prefix + ':'
-            else:
-                prefix = ''
+        if self.key_prefix:
+            prefix = self.key_prefix + ':'
+        else:
+            prefix = ''
+        for (key, (value, _)) in self._store.items():
             if key.startswith(prefix):
                 okey = key[len(prefix):]
-                ret[okey] = value['value']
+                ret[okey] = value
         return ret
 
+    def flush(self):
+        'Writes pending changes to disk now.'
+        self._store.flush()
+
+    def stats(self):
+        return self._store.stats()
+
 __all__ = ['Cache']
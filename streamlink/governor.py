@@ -0,0 +1,209 @@
+import logging
+import weakref
+from collections import deque
+from fnmatch import fnmatch
+from threading import Condition, Lock
+from time import time, sleep
+from .compat import urlparse
+log = logging.getLogger(__name__)
+
+class HostSlot(object):
+    __doc__ = 'A connection slot held on a host, released at most once.'
+
+    def __init__(self, state, owner):
+        self.state = state
+        self.owner = owner
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.state.release(self.owner)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+class HostState(object):
+    __doc__ = """Connection and request-rate budget of a single host.
+
+    When every connection is busy, waiting owners (one per task) are
+    served round-robin so a task with many threads cannot starve the
+    others. The request rate is a token bucket of *rate* requests per
+    *per* seconds.
+    """
+
+    def __init__(self, host, connections=None, rate=None, per=1.0, explicit_rate=False):
+        self.host = host
+        self.connections = connections
+        self.rate = rate
+        self.per = per
+        self.explicit_rate = explicit_rate
+        self.cond = Condition()
+        self.active = 0
+        self.waiting = {}
+        self.turns = deque()
+        self.tokens = float(rate or 0)
+        self.tokens_time = time()
+        self.rate_lock = Lock()
+        self.requests = 0
+        self.waits = 0
+
+    def _can_acquire(self, owner):
+        if self.connections and self.active >= self.connections:
+            return False
+        return self.turns[0] == owner
+
+    def _leave_queue(self, owner):
+        self.waiting[owner] -= 1
+        self.turns.remove(owner)
+        if self.waiting[owner]:
+            self.turns.append(owner)
+        else:
+            del self.waiting[owner]
+
+    def acquire(self, owner, abort=None, bypass=None):
+        with self.cond:
+            if owner not in self.waiting:
+                self.waiting[owner] = 0
+                self.turns.append(owner)
+            self.waiting[owner] += 1
+            if not self._can_acquire(owner):
+                self.waits += 1
+            while not self._can_acquire(owner):
+                if bypass and bypass():
+                    break
+                if abort and abort():
+                    self._leave_queue(owner)
+                    self.cond.notify_all()
+                    return None
+                self.cond.wait(0.5)
+            self._leave_queue(owner)
+            self.active += 1
+            self.requests += 1
+            self.cond.notify_all()
+        self.take_token()
+        return HostSlot(self, owner)
+
+    def release(self, owner):
+        with self.cond:
+            self.active -= 1
+            self.cond.notify_all()
+
+    def take_token(self):
+        'Reserves one request from the token bucket and sleeps until it is due.'
+        if not self.rate:
+            return
+        with self.rate_lock:
+            now = time()
+            fill_rate = float(self.rate)/self.per
+            self.tokens = min(float(self.rate), self.tokens + (now - self.tokens_time)*fill_rate)
+            self.tokens_time = now
+            self.tokens -= 1
+            delay = -self.tokens/fill_rate if self.tokens < 0 else 0
+        if delay > 0:
+            sleep(delay)
+
+    def set_limits(self, connections=None, rate=None, per=1.0, explicit_rate=False):
+        with self.cond:
+            self.connections = connections
+            if self.rate != rate or self.per != per:
+                self.tokens = float(rate or 0)
+                self.tokens_time = time()
+            self.rate = rate
+            self.per = per
+            self.explicit_rate = explicit_rate
+            self.cond.notify_all()
+
+    def stats(self):
+        with self.cond:
+            return {'connections': self.connections, 'rate': self.rate, 'per': self.per, 'active': self.active, 'waiting': sum(self.waiting.values()), 'owners_waiting': len(self.waiting), 'requests': self.requests, 'waits': self.waits}
+
+class HostGovernor(object):
+    __doc__ = """Process-wide per-host concurrency and request-rate governor.
+
+    Limits are looked up by matching the host name against fnmatch
+    patterns, the first matching pattern wins, hosts without a match use
+    *default_connections* and no rate limit. Every segment and range
+    request holds a slot until its response is closed.
+    """
+
+    def __init__(self, default_connections=None):
+        self.default_connections = default_connections
+        self.limits = []
+        self.hosts = {}
+        self._lock = Lock()
+
+    def configure(self, default_connections=None, limits=None):
+        '''Replaces the limits, applied to hosts already in use as well.
+
+        :param default_connections: connections per host without a pattern
+        :param limits: a dict of host pattern -> dict of ``connections``,
+                       ``rate`` and ``per`` (seconds, default: 1)
+        '''
+        with self._lock:
+            self.default_connections = default_connections or None
+            self.limits = [(pattern, conf or {}) for (pattern, conf) in (limits or {}).items()]
+            for state in self.hosts.values():
+                state.set_limits(**self._resolve(state.host))
+
+    def _resolve(self, host):
+        for (pattern, conf) in self.limits:
+            if fnmatch(host, pattern):
+                rate = conf.get('rate') or None
+                return dict(connections=conf.get('connections', self.default_connections) or None, rate=rate, per=float(conf.get('per') or 1.0), explicit_rate=rate is not None)
+        return dict(connections=self.default_connections, rate=None, per=1.0, explicit_rate=False)
+
+    def state(self, url):
+        host = (urlparse(url).hostname or '').lower()
+        with self._lock:
+            state = self.hosts.get(host)
+            if state is None:
+                state = self.hosts[host] = HostState(host, **self._resolve(host))
+            return state
+
+    def acquire(self, url, owner, abort=None, bypass=None):
+        '''Waits for a connection slot on the host of *url*.
+
+        *owner* identifies the task for fair sharing, *abort* is polled
+        while waiting and None is returned once it returns True. When
+        *bypass* returns True the slot is taken over the limit, used by
+        the segment a writer is blocked on so it cannot be starved by
+        later segments of the same stream holding every slot.
+        '''
+        return self.state(url).acquire(owner, abort, bypass)
+
+    def ensure_rate(self, url, rate, per=1.0):
+        '''Sets a request rate on the host of *url* unless one is configured.
+
+        Used by streams which need a rate limit on their hosts, the limit
+        is shared by every stream using the same host.
+        '''
+        state = self.state(url)
+        if not state.explicit_rate and (state.rate != rate or state.per != per):
+            log.debug('Limit {0} to {1} requests per {2}s', state.host, rate, per)
+            state.set_limits(state.connections, rate, float(per), False)
+
+    def track(self, response, slot):
+        'Keeps *slot* held until *response* is closed or garbage collected.'
+        close = response.close
+
+        def closeAndRelease():
+            try:
+                close()
+            finally:
+                slot.release()
+
+        response.close = closeAndRelease
+        weakref.finalize(response, slot.release)
+        return response
+
+    def stats(self):
+        with self._lock:
+            hosts = list(self.hosts.values())
+        return {state.host: state.stats() for state in hosts}
+
+host_governor = HostGovernor()
+__all__ = ['HostGovernor', 'HostSlot', 'host_governor']
@@ -0,0 +1,111 @@
+import logging
+from collections import OrderedDict
+from concurrent.futures import Future
+from threading import Lock, Thread
+from .compat import queue
+PREFETCH_WORKERS = 2
+log = logging.getLogger(__name__)
+
+class KeyCache(object):
+    __doc__ = """Process-wide LRU cache of stream decryption keys.
+
+    Keys are cached by URI and request headers, so substreams of a muxed
+    stream and retried or restarted tasks share them. A key is fetched
+    once however many threads ask for it at the same time, the others
+    wait for that fetch. Failed fetches are not cached. Prefetched keys
+    are fetched in the background by at most *prefetch_workers* threads,
+    in the order they were asked for.
+    """
+
+    def __init__(self, max_keys=256, prefetch_workers=PREFETCH_WORKERS):
+        self.max_keys = max_keys
+        self.prefetch_workers = prefetch_workers
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.prefetches = 0
+        self._keys = OrderedDict()
+        self._inflight = {}
+        self._queued = set()
+        self._queue = queue.Queue()
+        self._workers = []
+        self._lock = Lock()
+
+    @staticmethod
+    def cache_key(uri, headers):
+        return (uri, tuple(sorted((str(name).lower(), str(value)) for (name, value) in (headers or {}).items())))
+
+    def _evict(self):
+        while len(self._keys) > self.max_keys:
+            self._keys.popitem(last=False)
+
+    def get(self, uri, headers, fetch):
+        '''Returns the key at *uri*, calling *fetch* only when it is
+        neither cached nor being fetched by another thread.
+
+        Errors raised by *fetch* are raised to every waiting thread.
+        '''
+        key = self.cache_key(uri, headers)
+        with self._lock:
+            if key in self._keys:
+                self._keys.move_to_end(key)
+                self.hits += 1
+                return self._keys[key]
+            future = self._inflight.get(key)
+            if future is not None:
+                self.waits += 1
+            else:
+                self.misses += 1
+                future = self._inflight[key] = Future()
+                future.set_running_or_notify_cancel()
+                future = None
+        if future is not None:
+            return future.result()
+        try:
+            data = fetch()
+        except BaseException as err:
+            with self._lock:
+                future = self._inflight.pop(key)
+            future.set_exception(err)
+            raise
+        with self._lock:
+            future = self._inflight.pop(key)
+            self._keys[key] = data
+            self._evict()
+        future.set_result(data)
+        return data
+
+    def prefetch(self, uri, headers, fetch):
+        'Queues the key at *uri* to be fetched in the background unless it is cached, queued or being fetched.'
+        key = self.cache_key(uri, headers)
+        with self._lock:
+            if key in self._keys or key in self._inflight or key in self._queued:
+                return
+            self.prefetches += 1
+            self._queued.add(key)
+            if len(self._workers) < self.prefetch_workers:
+                worker = Thread(target=self._prefetch, name='Thread-KeyPrefetch', daemon=True)
+                self._workers.append(worker)
+                worker.start()
+        self._queue.put((key, uri, headers, fetch))
+
+    def _prefetch(self):
+        while True:
+            (key, uri, headers, fetch) = self._queue.get()
+            with self._lock:
+                self._queued.discard(key)
+            try:
+                self.get(uri, headers, fetch)
+            except Exception as err:
+                log.debug('Failed to prefetch key {0}: {1}', uri, err)
+
+    def clear(self):
+        with self._lock:
+            self._keys.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'keys': len(self._keys), 'max_keys': self.max_keys, 'inflight': len(self._inflight), 'queued': len(self._queued), 'hits': self.hits, 'misses': self.misses, 'waits': self.waits, 'prefetches': self.prefetches}
+
+key_cache = KeyCache()
+__all__ = ['KeyCache', 'key_cache']
@@ -201,7 +201,7 @@ class BoxPayloadMVHD(BoxPayload):
         packet += U3264(self.modification_time, self.version)
         packet += U32BE(self.time_scale)
         packet += U3264(self.duration, self.version)
-        packet += S16BE_16(self.rate)
+        packet += S16_16BE(self.rate)
         packet += S8_8BE(self.volume)
         packet += U16BE(0)
         packet += U32BE(0)
@@ -220,7 +220,7 @@ class BoxPayloadMVHD(BoxPayload):
         modification_time = U3264.read(io, version)
         time_scale = U32BE.read(io)
         duration = U3264.read(io, version)
-        rate = S16_16.read(io)
+        rate = S16_16BE.read(io)
         volume = S8_8BE.read(io)
         U16BE.read(io)
         U32BE.read(io)
@@ -338,8 +338,8 @@ class BoxPayloadTKHD(BoxPayload):
         packet += U16BE(0)
         for i in range(9):
             packet += U32BE(self.transform_matrix[i])
-        packet += S16BE_16(self.width)
-        packet += S16BE_16(self.height)
+        packet += S16_16BE(self.width)
+        packet += S16_16BE(self.height)
 
     @classmethod
     def _deserialize(cls, io):
@@ -359,8 +359,8 @@ class BoxPayloadTKHD(BoxPayload):
         transform_matrix = []
         for i in range(9):
             transform_matrix.append(S32BE.read(io))
-        width = S16_16.read(io)
-        height = S16_16.read(io)
+        width = S16_16BE.read(io)
+        height = S16_16BE.read(io)
         return cls(version, flags, creation_time, modification_time, track_id, duration, layer, alternate_group, volume, transform_matrix, width, height)
 
 class BoxPayloadMDHD(BoxPayload):
@@ -412,9 +412,7 @@ class BoxPayloadHDLR(BoxPayload):
 
     @property
     def size(self):
-        size = 24
-        size += len(self.name)
-        return size
+        return 24 + CString.size(self.name)
 
     def _serialize(self, packet):
         packet += U8(self.version)
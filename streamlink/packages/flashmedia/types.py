@@ -245,8 +245,8 @@ U64BE = PrimitiveType('>Q')
 U64LE = PrimitiveType('<Q')
 U8_8BE = FixedPoint('>H', 8)
 S8_8BE = FixedPoint('>h', 8)
-U16_16BE = FixedPoint('<I', 16)
-S16_16BE = FixedPoint('<i', 16)
+U16_16BE = FixedPoint('>I', 16)
+S16_16BE = FixedPoint('>i', 16)
 U8_8LE = FixedPoint('<H', 8)
 S8_8LE = FixedPoint('<h', 8)
 U16_16LE = FixedPoint('<I', 16)
@@ -0,0 +1,57 @@
+class PluginIndex(object):
+    __doc__ = """Index of plugins by the URL hosts and schemes they declare.
+
+    The plugins of a URL are found by looking up its scheme, its host
+    and the parent domains of the host, the catch-all plugins declaring
+    neither are only tried when none of these can handle the URL.
+
+    *plugins* maps names to plugins. When it has the metadata of a
+    PluginRegistry, the index is built from it and a plugin is only
+    looked up, and so imported, once a URL could be its own.
+    """
+
+    def __init__(self, plugins):
+        self.plugins = plugins
+        self.order = {}
+        self.hosts = {}
+        self.schemes = {}
+        self.catchall = []
+        metadata = getattr(plugins, 'metadata', None)
+        if metadata is None:
+            metadata = dict((name, {'hosts': plugin.url_hosts, 'schemes': plugin.url_schemes}) for (name, plugin) in plugins.items())
+        for name in plugins:
+            meta = metadata[name]
+            (hosts, schemes) = (meta.get('hosts', ()), meta.get('schemes', ()))
+            self.order[name] = len(self.order)
+            if not hosts and not schemes:
+                self.catchall.append(name)
+            for host in hosts:
+                self.hosts.setdefault(host.lower(), []).append(name)
+            for scheme in schemes:
+                self.schemes.setdefault(scheme.lower(), []).append(name)
+
+    def candidates(self, url):
+        'Returns the names of the plugins declaring the scheme or a domain of the host of *url*.'
+        (scheme, sep, rest) = url.partition('://')
+        if not sep:
+            return []
+        found = list(self.schemes.get(scheme.lower(), ()))
+        host = rest.split('/', 1)[0].split('?', 1)[0].split('#', 1)[0].rpartition('@')[2]
+        host = '' if host.startswith('[') else host.partition(':')[0].lower()
+        while host:
+            found.extend(self.hosts.get(host, ()))
+            host = host.partition('.')[2]
+        return found
+
+    def match(self, url):
+        '''Returns the plugins that can handle *url* in the order they
+        were loaded, catch-all plugins only when no other plugin can.
+        '''
+        may_handle_url = getattr(self.plugins, 'may_handle_url', None)
+        for names in (self.candidates(url), self.catchall):
+            matched = set(name for name in names if (may_handle_url is None or may_handle_url(name, url)) and self.plugins[name].can_handle_url(url))
+            if matched:
+                return [self.plugins[name] for name in sorted(matched, key=self.order.get)]
+        return []
+
+__all__ = ['PluginIndex']
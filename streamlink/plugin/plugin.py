@@ -102,8 +102,22 @@ class Plugin(object):
     __doc__ = """A plugin can retrieve stream information from the URL specified.
 
     :param url: URL that the plugin will operate on
+
+    *url_hosts* and *url_schemes* list the hosts, with their
+    subdomains, and the URL schemes the plugin handles, so resolve_url
+    only asks the plugins of a URL. Plugins declaring neither are tried
+    for every URL no declared plugin can handle. The bundled plugins
+    are declared in streamlink.plugins, which sets them when the plugin
+    is loaded.
+
+    *stream_cache_ttl* is the lifetime in seconds of the streams found
+    by the plugin in the stream cache, None is the default of the cache
+    and 0 disables caching them.
     """
     options = Options()
+    url_hosts = ()
+    url_schemes = ()
+    stream_cache_ttl = None
 
     def __init__(self, session, url):
         self.session = session
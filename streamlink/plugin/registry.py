@@ -0,0 +1,70 @@
+import re
+import logging
+import importlib
+from time import perf_counter
+from collections.abc import Mapping
+from threading import Lock
+log = logging.getLogger(__name__)
+
+class PluginRegistry(Mapping):
+    __doc__ = """Plugins of a package by module name, each module is only
+    imported the first time its plugin is looked up.
+
+    *metadata* maps the module names, in load order, to the URLs their
+    plugin handles: the ``hosts`` and ``schemes`` it declares, and for
+    catch-all plugins an optional ``pattern`` the URL must match before
+    the module is imported to ask it. The PluginIndex built on the
+    registry reads them from here, so resolving a URL only imports the
+    plugins of its host.
+    """
+
+    def __init__(self, package, metadata):
+        self.package = package
+        self.metadata = metadata
+        self.patterns = dict((name, re.compile(meta['pattern'])) for (name, meta) in metadata.items() if meta.get('pattern'))
+        self._plugins = {}
+        self._lock = Lock()
+
+    def __getitem__(self, name):
+        plugin = self._plugins.get(name)
+        if plugin is None:
+            if name not in self.metadata:
+                raise KeyError(name)
+            plugin = self.load(name)
+        return plugin
+
+    def __iter__(self):
+        return iter(self.metadata)
+
+    def __len__(self):
+        return len(self.metadata)
+
+    def __contains__(self, name):
+        return name in self.metadata
+
+    def load(self, name):
+        'Imports the module of plugin *name* and returns its plugin.'
+        with self._lock:
+            plugin = self._plugins.get(name)
+            if plugin is not None:
+                return plugin
+            start = perf_counter()
+            module = importlib.import_module('{0}.{1}'.format(self.package, name))
+            plugin = module.__plugin__
+            meta = self.metadata[name]
+            plugin.url_hosts = tuple(meta.get('hosts', ()))
+            plugin.url_schemes = tuple(meta.get('schemes', ()))
+            self._plugins[name] = plugin
+        log.debug('Loaded plugin {0} in {1:.1f} ms', name, (perf_counter() - start)*1000)
+        return plugin
+
+    def may_handle_url(self, name, url):
+        'Returns False when the pattern of plugin *name* rules *url* out.'
+        pattern = self.patterns.get(name)
+        return pattern is None or pattern.match(url) is not None
+
+    def loaded(self):
+        'Returns the names of the plugins imported so far.'
+        return [name for name in self.metadata if name in self._plugins]
+
+__all__ = ['PluginRegistry']
@@ -2,7 +2,34 @@
     New plugins should use streamlink.plugin.Plugin instead
     of this module, but this is kept here for backwards
     compatibility.
+
+    The plugins are declared in PLUGINS with the URLs they handle and
+    their modules are imported by ALL_PLUGINS on first use, a plugin
+    added here must be listed there.
 '''
-from types import ModuleType
-from streamlink.plugins import archive, dailymotion, dash, fembed, hds, hls, http, hydraxDirect, longvan, mixdrop, okru, onedrive, phimmoichilla, proxyimg, rtmp, shortlink, streame_cloud, StreamSB, streamtape, vimeo, vudeo, youtube
-ALL_PLUGINS = {name: module.__plugin__ for (name, module) in globals().items() if isinstance(module, ModuleType) and 'streamlink.plugins.' in module.__name__}
+from streamlink.plugin.registry import PluginRegistry
+PLUGINS = {
+    'archive': {'hosts': ('archive.org',)},
+    'dailymotion': {'hosts': ('dailymotion.com',)},
+    'dash': {'pattern': '(?:dash://|.*\\.mpd)'},
+    'fembed': {'pattern': 'https://(?:femax\\d+.com/v|fembed.anhdaubo.net/embedplay/|dutrag.com/v)'},
+    'hds': {'pattern': '(?:hds://|.*\\.f4m)'},
+    'hls': {'pattern': '(?:hls(?:variant)?://|.*\\.m3u8)'},
+    'http': {'schemes': ('httpstream',)},
+    'hydraxDirect': {'hosts': ('geoip.redirect-ads.com', 'freeplayervideo.com', 'playhydrax.com', 'player-cdn.com', 'abysscdn.com')},
+    'longvan': {'hosts': ('loadbalance.manga123.net', 'jimmiepradeep.xyz', 'vod.bongngo.cloud', 'loading.bongngo.bar', 'vod.streamcherry.biz')},
+    'mixdrop': {'hosts': ('mixdrop.co',)},
+    'okru': {'hosts': ('ok.ru',)},
+    'onedrive': {'hosts': ('svc.ms',)},
+    'phimmoichilla': {'hosts': ('phimmoichilla.net',)},
+    'proxyimg': {'hosts': ('oneonlinegamesnow.biz',)},
+    'rtmp': {'schemes': ('rtmp', 'rtmpe', 'rtmps', 'rtmpt', 'rtmpte')},
+    'shortlink': {'hosts': ('short.ink', 'short.icu')},
+    'streame_cloud': {'hosts': ('streame.cloud',)},
+    'StreamSB': {'hosts': ('sbembed.com', 'sbembed1.com', 'sbplay.org', 'sbvideo.net', 'streamsb.net', 'sbplay.one', 'cloudemb.com', 'playersb.com', 'tubesb.com', 'sbplay1.com', 'embedsb.com', 'watchsb.com', 'sbplay2.com', 'japopav.tv', 'viewsb.com', 'sbplay2.xyz', 'sbfast.com', 'sbfull.com', 'javplaya.com')},
+    'streamtape': {'hosts': ('streamtape.com',)},
+    'vimeo': {'hosts': ('vimeo.com',)},
+    'vudeo': {'hosts': ('vudeo.net',)},
+    'youtube': {'hosts': ('youtube.com', 'youtu.be')},
+}
+ALL_PLUGINS = PluginRegistry(__name__, PLUGINS)
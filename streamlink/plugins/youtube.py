@@ -37,6 +37,7 @@ class YouTube(Plugin):
     _re_mime_type = re.compile('^(?P<type>\\w+)/(?P<container>\\w+); codecs="(?P<codecs>.+)"$')
     _url_canonical = 'https://www.youtube.com/watch?v={video_id}'
     _url_channelid_live = 'https://www.youtube.com/channel/{channel_id}/live'
+    stream_cache_ttl = 18000
     adp_video = {137: '1080p', 299: '1080p60', 264: '1440p', 308: '1440p60', 266: '2160p', 315: '2160p60', 138: '2160p', 302: '720p60', 135: '480p', 133: '240p', 160: '144p'}
     adp_audio = {140: 128, 141: 256, 171: 128, 249: 48, 250: 64, 251: 160, 256: 256, 258: 258}
     match = None
@@ -6,13 +6,16 @@ from streamlink.logger import StreamlinkLogger
 from streamlink.utils import update_scheme
 from streamlink.utils.l10n import Localization
 from . import __version__
+from .cache import Cache
 from .compat import is_win32
 from .exceptions import NoPluginError, PluginError
 from .options import Options
 from .plugin import api
+from .plugin.index import PluginIndex
 from .plugins import ALL_PLUGINS
 logging.setLoggerClass(StreamlinkLogger)
 log = logging.getLogger(__name__)
+redirect_cache = Cache(filename='redirects.json')
 
 def print_small_exception(start_after):
     (_type, value, traceback_) = sys.exc_info()
@@ -34,10 +37,11 @@ class Streamlink(object):
 
     def __init__(self, options=None):
         self.http = api.HTTPSession()
-        self.options = Options({'hds-live-edge': 10.0, 'hds-segment-attempts': 3, 'hds-segment-threads': 1, 'hds-segment-timeout': 10.0, 'hds-timeout': 60.0, 'hls-live-edge': 3, 'hls-segment-attempts': 3, 'hls-segment-threads': 1, 'hls-segment-timeout': 10.0, 'hls-timeout': 60.0, 'hls-playlist-reload-attempts': 3, 'hls-start-offset': 0, 'hls-duration': None, 'http-stream-timeout': 60.0, 'ringbuffer-size': 16777216, 'rtmp-timeout': 60.0, 'rtmp-rtmpdump': is_win32 and 'rtmpdump.exe' or 'rtmpdump', 'rtmp-proxy': None, 'stream-segment-attempts': 3, 'stream-segment-threads': 1, 'stream-segment-timeout': 10.0, 'stream-timeout': 60.0, 'subprocess-errorlog': False, 'subprocess-errorlog-path': None, 'ffmpeg-ffmpeg': None, 'ffmpeg-video-transcode': 'copy', 'ffmpeg-audio-transcode': 'copy', 'locale': None, 'user-input-requester': None})
+        self.options = Options({'hds-live-edge': 10.0, 'hds-segment-attempts': 3, 'hds-segment-threads': 1, 'hds-segment-timeout': 10.0, 'hds-timeout': 60.0, 'hls-live-edge': 3, 'hls-segment-attempts': 3, 'hls-segment-threads': 1, 'hls-segment-timeout': 10.0, 'hls-timeout': 60.0, 'hls-playlist-reload-attempts': 3, 'hls-start-offset': 0, 'hls-duration': None, 'http-stream-timeout': 60.0, 'ringbuffer-size': 16777216, 'rtmp-timeout': 60.0, 'rtmp-rtmpdump': is_win32 and 'rtmpdump.exe' or 'rtmpdump', 'rtmp-proxy': None, 'stream-segment-attempts': 3, 'stream-segment-threads': 1, 'stream-segment-timeout': 10.0, 'stream-segment-window': 0, 'stream-segment-reorder-size': 33554432, 'stream-segment-reorder-dir': None, 'stream-timeout': 60.0, 'subprocess-errorlog': False, 'subprocess-errorlog-path': None, 'ffmpeg-ffmpeg': None, 'ffmpeg-video-transcode': 'copy', 'ffmpeg-audio-transcode': 'copy', 'locale': None, 'user-input-requester': None, 'bandwidth-owner': None, 'hls-spool-dir': None, 'hls-spool-only': False, 'redirect-cache-ttl': 3600})
         if options:
             self.options.update(options)
         self.plugins = ALL_PLUGINS
+        self._plugin_index = None
 
     def close(self):
         self.http.close()
@@ -175,6 +179,24 @@ class Streamlink(object):
                                  General option used by streams not
                                  covered by other options.
 
+        stream-segment-window    (int) How many segments are queued
+                                 ahead of the one being written,
+                                 default: ``0``, twice the number of
+                                 segment threads.
+
+        stream-segment-reorder-size (int) Bytes of fetched segments
+                                 kept in memory until they are written
+                                 in order, default: ``33554432`` (32 MiB).
+
+        stream-segment-reorder-dir (str) Directory segments are spilled
+                                 to once the reorder buffer is full,
+                                 default: ``None``, fetching waits instead.
+
+        redirect-cache-ttl       (int) Seconds the redirects followed
+                                 for URLs no plugin can handle are
+                                 cached, default: ``3600``, 0 disables
+                                 the cache.
+
         stream-timeout           (float) Timeout for reading data from
                                  stream, default: ``60.0``.
                                  General option used by streams not
@@ -305,24 +327,45 @@ class Streamlink(object):
 
         '''
         url = update_scheme('http://', url)
-        available_plugins = []
-        for plugin in self.plugins.values():
-            if plugin.can_handle_url(url):
-                available_plugins.append(plugin)
-        available_plugins.sort(key=lambda x: x.priority(url), reverse=True)
+        available_plugins = self.plugin_index.match(url)
+        if len(available_plugins) > 1:
+            available_plugins.sort(key=lambda x: x.priority(url), reverse=True)
         if available_plugins:
             return available_plugins[0](self, url)
         if follow_redirect:
-            try:
-                res = self.http.head(url, allow_redirects=True, acceptable_status=[501])
-                if res.status_code == 501:
-                    res = self.http.get(url, stream=True)
-                if res.url != url:
-                    return self.resolve_url(res.url, follow_redirect=follow_redirect)
-            except PluginError:
-                pass
+            redirect_url = self.resolve_redirect(url)
+            if redirect_url != url:
+                return self.resolve_url(redirect_url, follow_redirect=follow_redirect)
         raise NoPluginError(url)
 
+    @property
+    def plugin_index(self):
+        'The PluginIndex of the loaded plugins.'
+        if self._plugin_index is None or self._plugin_index.plugins is not self.plugins:
+            self._plugin_index = PluginIndex(self.plugins)
+        return self._plugin_index
+
+    def resolve_redirect(self, url):
+        '''Returns the URL *url* redirects to, or *url* when it does not
+        redirect or can not be opened.
+
+        Results are cached for redirect-cache-ttl seconds.
+        '''
+        ttl = self.get_option('redirect-cache-ttl')
+        redirect_url = ttl and redirect_cache.get(url)
+        if redirect_url:
+            return redirect_url
+        try:
+            res = self.http.head(url, allow_redirects=True, acceptable_status=[501])
+            if res.status_code == 501:
+                res = self.http.get(url, stream=True)
+                res.close()
+        except PluginError:
+            return url
+        if ttl:
+            redirect_cache.set(url, res.url, expires=ttl)
+        return res.url
+
     def resolve_url_no_redirect(self, url):
         '''Attempts to find a plugin that can use this URL.
 
@@ -1,7 +1,5 @@
-import time
 import logging
 from streamlink.stream.hls import HLSStream, HLSStreamReader, HLSStreamWriter
-from pyrate_limiter import Duration, Limiter, RequestRate
 log = logging.getLogger(__name__)
 
 class ProxyImg_HLSStreamWriter(HLSStreamWriter):
@@ -11,17 +9,18 @@ class ProxyImg_HLSStreamWriter(HLSStreamWriter):
         print('ProxyImg_HLSStreamWriter')
         super().__init__(reader, *args, **kwargs)
 
-    def _write(self, sequence, res, chunk_size=32768):
+    def iter_segment(self, sequence, res, chunk_size=32768):
         chunks = res.iter_content(chunk_size)
         check_data = b''
         for chunk in chunks:
+            self.bandwidth.consume(len(chunk), self.isClosed)
             check_data += chunk
             if len(check_data) >= chunk_size:
                 break
-        chunk = self.validateAndTrim(sequence, check_data)
-        self._write_buffer(chunk)
+        yield self.validateAndTrim(sequence, check_data)
         for chunk in chunks:
-            self._write_buffer(chunk)
+            self.bandwidth.consume(len(chunk), self.isClosed)
+            yield chunk
 
 class ProxyImg_HLSStreamReader(HLSStreamReader):
     __writer__ = ProxyImg_HLSStreamWriter
@@ -1,13 +1,18 @@
+import importlib
 from ..exceptions import StreamError
 from streamlink.stream.stream import Stream
-from streamlink.stream.akamaihd import AkamaiHDStream
-from streamlink.stream.hds import HDSStream
-from streamlink.stream.hls import HLSStream
-from streamlink.stream.http import HTTPStream
-from streamlink.stream.rtmpdump import RTMPStream
-from streamlink.stream.dash import DASHStream
-from streamlink.stream.streamprocess import StreamProcess
-from streamlink.stream.wrappers import StreamIOWrapper, StreamIOIterWrapper, StreamIOThreadWrapper
-from streamlink.stream.ProxyImgHls import ProxyImg_HLSStream
-from streamlink.stream.flvconcat import extract_flv_header_tags
-from streamlink.stream.playlist import Playlist, FLVPlaylist
+LAZY_NAMES = {'AkamaiHDStream': 'akamaihd', 'HDSStream': 'hds', 'HLSStream': 'hls', 'HTTPStream': 'http', 'RTMPStream': 'rtmpdump', 'DASHStream': 'dash', 'StreamProcess': 'streamprocess', 'StreamIOWrapper': 'wrappers', 'StreamIOIterWrapper': 'wrappers', 'StreamIOThreadWrapper': 'wrappers', 'ProxyImg_HLSStream': 'ProxyImgHls', 'extract_flv_header_tags': 'flvconcat', 'Playlist': 'playlist', 'FLVPlaylist': 'playlist'}
+
+def __getattr__(name):
+    '''Imports the stream types on first use, so plugins only load the
+    modules, and their dependencies, of the streams they return.
+    '''
+    module = LAZY_NAMES.get(name)
+    if module is None:
+        raise AttributeError('module {0!r} has no attribute {1!r}'.format(__name__, name))
+    value = getattr(importlib.import_module('{0}.{1}'.format(__name__, module)), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(LAZY_NAMES))
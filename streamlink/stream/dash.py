@@ -5,8 +5,6 @@ import os.path
 from threading import Lock
 from collections import namedtuple
 import requests
-from uuid import uuid4
-from pyrate_limiter import Limiter, RequestRate
 from streamlink import StreamError
 from streamlink.compat import urlparse, urlunparse
 from streamlink.stream.http import valid_args, normalize_key
@@ -34,16 +32,11 @@ class DASHStreamWriter(SegmentedStreamWriter):
         self.num_error = 0
         self.max_num_error = 5
         self._lock_error = Lock()
-        rate_request = options.get('dash-segment-rate-request')
-        if rate_request:
-            rate_delay = options.get('dash-segment-rate-delay') or 1
-            log.debug('dash-segment-rate-delay {}', rate_delay)
-            log.debug('dash-segment-rate-request {}', rate_request)
-            self.limiter = Limiter(RequestRate(rate_request, rate_delay))
-            self._default_bucket = uuid4().hex
-        else:
-            self.limiter = None
-            self._default_bucket = None
+        self.rate_request = options.get('dash-segment-rate-request')
+        if self.rate_request:
+            self.rate_delay = options.get('dash-segment-rate-delay') or 1
+            log.debug('dash-segment-rate-delay {}', self.rate_delay)
+            log.debug('dash-segment-rate-request {}', self.rate_request)
 
     def create_request_params(self, segment):
         request_params = dict(self.reader.request_params)
@@ -59,34 +52,55 @@ class DASHStreamWriter(SegmentedStreamWriter):
         request_params['stream'] = True
         return request_params
 
+    def wait_available(self, segment):
+        now = datetime.datetime.now(tz=utc)
+        if segment.available_at > now:
+            time_to_wait = (segment.available_at - now).total_seconds()
+            fname = os.path.basename(urlparse(segment.url).path)
+            log.debug('Waiting for segment: {fname} ({wait:.01f}s)'.format(fname=fname, wait=time_to_wait))
+            sleep_until(segment.available_at)
+
     def _fetch(self, sequence, retries=None):
         if self.closed or not retries:
             return
         segment = sequence.segment
         try:
-            now = datetime.datetime.now(tz=utc)
-            if segment.available_at > now:
-                time_to_wait = (segment.available_at - now).total_seconds()
-                fname = os.path.basename(urlparse(segment.url).path)
-                log.debug('Waiting for segment: {fname} ({wait:.01f}s)'.format(fname=fname, wait=time_to_wait))
-                sleep_until(segment.available_at)
             request_params = self.create_request_params(sequence.segment)
             return self.session.http.get(segment.url, timeout=self.timeout, exception=StreamError, retries=self.retries, **request_params)
         except StreamError as err:
             log.error('Failed to open segment {0}: {1}', segment.url, err)
-            with self._lock_error:
-                self.num_error += 1
-                if self.num_error >= self.max_num_error:
-                    self.error = TooManySegmentsError()
-                    self.reader.worker.close()
-                    self.close()
+            self.count_error(TooManySegmentsError())
+
+    def count_error(self, error):
+        with self._lock_error:
+            self.num_error += 1
+            if self.num_error >= self.max_num_error:
+                self.error = error
+                self.reader.worker.close()
+                self.close()
 
     def fetch(self, sequence, retries=None):
-        if self.limiter:
-            with self.limiter.ratelimit(self._default_bucket, delay=True):
-                return self._fetch(sequence, retries)
-        else:
-            return self._fetch(sequence, retries)
+        if self.closed or not retries:
+            return
+        self.wait_available(sequence.segment)
+        res = self.governed(sequence.segment.url, sequence, self._fetch, retries)
+        if res is None:
+            return
+        try:
+            return self.buffer(sequence, self.iter_segment(sequence.segment, res))
+        except Exception as err:
+            log.error('Failed to read segment {0}: {1}', sequence.segment.url, err)
+            self.count_error(TooManySegmentUnableHandle())
+        finally:
+            res.close()
+
+    def iter_segment(self, segment, res, chunk_size=8192):
+        for chunk in res.iter_content(chunk_size):
+            if self.closed:
+                log.warning('Download of segment: {} aborted', segment.url)
+                return
+            self.bandwidth.consume(len(chunk), self.isClosed)
+            yield chunk
 
     def update_total_bytes(self, length, sequence_num):
         if length > self.bytes_max:
@@ -114,12 +128,7 @@ class DASHStreamWriter(SegmentedStreamWriter):
                 self.update_total_bytes(self._buffer_write_size, sequence.num)
         except Exception as err:
             log.error('write data from url {0} error {1}', sequence.segment.url, err)
-            with self._lock_error:
-                self.num_error += 1
-                if self.num_error >= self.max_num_error:
-                    self.error = TooManySegmentUnableHandle()
-                    self.reader.worker.close()
-                    self.close()
+            self.count_error(TooManySegmentUnableHandle())
         finally:
             res.close()
 
@@ -1,16 +1,21 @@
+import os
 import logging
 import re
 import struct
-from uuid import uuid4
+from hashlib import md5
 from collections import defaultdict, namedtuple
 from Crypto.Cipher import AES
 from threading import Lock
-from pyrate_limiter import Limiter, RequestRate
+from streamlink.compat import urlparse
 from streamlink.exceptions import StreamError, TooManySegmentsError, TooManySegmentUnableHandle
+from streamlink.keycache import key_cache
+from streamlink.governor import host_governor
 from streamlink.stream import hls_playlist
 from streamlink.stream.ffmpegmux import FFMPEGMuxer, MuxedStream
 from streamlink.stream.http import HTTPStream
 from streamlink.stream.segmented import SegmentedStreamReader, SegmentedStreamWriter, SegmentedStreamWorker
+from streamlink.stream.spool import SegmentSpool, SpooledSegment, playlist_signature
+from streamlink.stream.reorder import BufferedSegment
 log = logging.getLogger(__name__)
 Sequence = namedtuple('Sequence', 'num segment')
 
@@ -26,6 +31,29 @@ def pkcs7_decode(paddedData, keySize=16):
         raise StreamError('Input is not padded or padding is corrupt, got padding size of {0}'.format(val))
     return paddedData[:-val]
 
+def iter_decrypt(decryptor, chunks, block_size=16):
+    '''Decrypts the AES-CBC *chunks* of a segment as they arrive.
+
+    Only whole blocks are decrypted and the last one is held back, at
+    the end its PKCS#7 padding is removed and trailing bytes short of a
+    block are cut off.
+    '''
+    pending = b''
+    for chunk in chunks:
+        data = pending + chunk if pending else chunk
+        end = (len(data)//block_size - 1)*block_size
+        if end > 0:
+            yield decryptor.decrypt(data[:end])
+            pending = data[end:]
+        else:
+            pending = data
+    garbage_len = len(pending) % block_size
+    if garbage_len:
+        log.debug('Cutting off {0} bytes of garbage before decrypting', garbage_len)
+        pending = pending[:-garbage_len]
+    if pending:
+        yield pkcs7_decode(decryptor.decrypt(pending))
+
 class HLSStreamWriter(SegmentedStreamWriter):
     validate_magic_ts = re.compile(b'G.{187}G.{187}G', re.DOTALL)
 
@@ -36,47 +64,98 @@ class HLSStreamWriter(SegmentedStreamWriter):
         kwargs['timeout'] = options.get('hls-segment-timeout')
         kwargs['ignore_names'] = options.get('hls-segment-ignore-names')
         SegmentedStreamWriter.__init__(self, reader, *args, **kwargs)
-        rate_request = options.get('hls-segment-rate-request')
-        if rate_request:
-            rate_delay = options.get('hls-segment-rate-delay') or 1
-            log.debug('hls-segment-rate-delay {}', rate_delay)
-            log.debug('hls-segment-rate-request {}', rate_request)
-            self.limiter = Limiter(RequestRate(rate_request, rate_delay))
-            self._default_bucket = uuid4().hex
-        else:
-            self.limiter = None
-            self._default_bucket = None
+        self.rate_request = options.get('hls-segment-rate-request')
+        if self.rate_request:
+            self.rate_delay = options.get('hls-segment-rate-delay') or 1
+            log.debug('hls-segment-rate-delay {}', self.rate_delay)
+            log.debug('hls-segment-rate-request {}', self.rate_request)
         self.bytes_recv = 0
         self.bytes_max = 0
         self.bytes_remain = 0
         self.byterange_offsets = defaultdict(int)
-        self.key_data = None
-        self.key_uri = None
         self.key_uri_override = options.get('hls-segment-key-uri')
         self.num_error = 0
         self.max_num_error = 5
         self.error = None
         self._lock_error = Lock()
         self._buffer_write_size = 0
+        self.spool_dir = options.get('hls-spool-dir')
+        self.spool = None
+        self.spool_only = options.get('hls-spool-only')
+        self.spool_nums = []
+        self._spool_file = None
         if self.ignore_names:
             self.ignore_names = list(set(self.ignore_names))
             self.ignore_names = '|'.join(list(map(re.escape, self.ignore_names)))
             self.ignore_names_re = re.compile('(?:{blacklist})\\.ts'.format(blacklist=self.ignore_names), re.IGNORECASE)
 
+    def open_spool(self, worker):
+        '''Opens the spool of a VOD playlist so completed segments survive a restart.
+
+        Segments already in the spool are read from disk instead of being
+        downloaded again, live playlists are not spooled.
+        '''
+        if not self.spool_dir or worker.playlist_end is None or not worker.playlist_sequences:
+            return
+        name = md5(urlparse(self.stream.url).path.encode('utf8')).hexdigest()[:16]
+        try:
+            self.spool = SegmentSpool(os.path.join(self.spool_dir, name), playlist_signature(worker.playlist_sequences))
+        except (IOError, OSError) as err:
+            log.warning('Unable to open segment spool {0}: {1}', self.spool_dir, err)
+
+    def close(self):
+        SegmentedStreamWriter.close(self)
+        if self.spool:
+            self.spool.close()
+
+    def put(self, sequence):
+        if sequence is not None and self.spool and not self.closed:
+            self.spool_nums.append(sequence.num)
+        SegmentedStreamWriter.put(self, sequence)
+
     def create_decryptor(self, key, sequence):
         if key.method != 'AES-128':
             raise StreamError('Unable to decrypt cipher %s' % key.method)
         if not self.key_uri_override and not key.uri:
             raise StreamError('Missing URI to decryption key')
         key_uri = self.key_uri_override if self.key_uri_override else key.uri
-        if self.key_uri != key_uri:
-            res = self.session.http.get(key_uri, exception=StreamError, retries=self.retries, **self.reader.request_params)
-            res.encoding = 'binary/octet-stream'
-            self.key_data = res.content
-            self.key_uri = key_uri
+        key_data = key_cache.get(key_uri, self.key_headers(), lambda: self.fetch_key(key_uri))
         iv = key.iv or num_to_iv(sequence)
         iv = b'\x00'*(16 - len(iv)) + iv
-        return AES.new(self.key_data, AES.MODE_CBC, iv)
+        return AES.new(key_data, AES.MODE_CBC, iv)
+
+    def key_headers(self):
+        headers = dict(self.session.http.headers)
+        headers.update(self.reader.request_params.get('headers') or {})
+        return headers
+
+    def fetch_key(self, key_uri):
+        res = self.session.http.get(key_uri, exception=StreamError, retries=self.retries, **self.reader.request_params)
+        res.encoding = 'binary/octet-stream'
+        if len(res.content) != 16:
+            raise StreamError('Invalid key of {0} bytes from {1}'.format(len(res.content), key_uri))
+        return res.content
+
+    def prefetch_keys(self, sequences):
+        '''Fetches the keys of the upcoming *sequences* in the background,
+        each holding a connection slot on the key host.
+        '''
+        uris = set()
+        for sequence in sequences:
+            key = sequence.segment.key
+            if key and key.method == 'AES-128' and (key.uri or self.key_uri_override):
+                uris.add(self.key_uri_override or key.uri)
+        if uris:
+            headers = self.key_headers()
+            for key_uri in uris:
+                key_cache.prefetch(key_uri, headers, lambda key_uri=key_uri: self.prefetch_key(key_uri))
+
+    def prefetch_key(self, key_uri):
+        slot = host_governor.acquire(key_uri, self.session.http, lambda: self.closed)
+        if not slot:
+            raise StreamError('Stream closed before fetching key {0}'.format(key_uri))
+        with slot:
+            return self.fetch_key(key_uri)
 
     def create_request_params(self, sequence):
         request_params = dict(self.reader.request_params)
@@ -90,10 +169,21 @@ class HLSStreamWriter(SegmentedStreamWriter):
             headers['Range'] = 'bytes={0}-{1}'.format(bytes_start, bytes_end)
             self.byterange_offsets[sequence.segment.uri] = bytes_end + 1
         request_params['headers'] = headers
-        if not sequence.segment.key:
-            request_params['stream'] = True
+        request_params['stream'] = True
         return request_params
 
+    def count_error(self, error, cause=None):
+        '''Counts a failed segment, the writer is closed with *error*
+        once too many failed. *cause* is kept as the cause of *error*.
+        '''
+        with self._lock_error:
+            self.num_error += 1
+            if self.num_error >= self.max_num_error:
+                error.__cause__ = cause
+                self.error = error
+                self.reader.worker.close()
+                self.close()
+
     def _fetch(self, sequence, retries=None):
         if self.closed or not retries:
             return
@@ -105,19 +195,57 @@ class HLSStreamWriter(SegmentedStreamWriter):
             return self.session.http.get(sequence.segment.uri, timeout=self.timeout, exception=StreamError, retries=self.retries, **request_params)
         except StreamError as err:
             log.error('Failed to open segment {0}: {1}', sequence.num, err)
-            with self._lock_error:
-                self.num_error += 1
-                if self.num_error >= self.max_num_error:
-                    self.error = TooManySegmentsError()
-                    self.reader.worker.close()
-                    self.close()
+            self.count_error(TooManySegmentsError(), err)
 
     def fetch(self, sequence, retries=None):
-        if self.limiter:
-            with self.limiter.ratelimit(self._default_bucket, delay=True):
-                return self._fetch(sequence, retries)
-        else:
-            return self._fetch(sequence, retries)
+        if self.spool and self.spool.has(sequence.num):
+            self.create_request_params(sequence)
+            return self.spool.segment(sequence.num)
+        res = self.governed(sequence.segment.uri, sequence, self._fetch, retries)
+        if res is None:
+            return
+        if self.spool_only and self.spool:
+            return self.spool_segment(sequence, res)
+        return self.buffer_segment(sequence, res)
+
+    def buffer_segment(self, sequence, res, chunk_size=32768):
+        '''Reads a fetched segment into the reorder buffer from the fetch thread.
+
+        The connection is released as soon as the segment is read, even
+        when the writer is still waiting for an earlier one.
+        '''
+        try:
+            return self.buffer(sequence, self.iter_segment(sequence, res, chunk_size))
+        except Exception as err:
+            log.error('Failed to read segment {0}: {1}', sequence.num, err)
+            self.count_error(TooManySegmentUnableHandle(), err)
+        finally:
+            res.close()
+
+    def spool_segment(self, sequence, res, chunk_size=32768):
+        '''Writes a fetched segment to the spool from the fetch thread.
+
+        Used when the segments are only spooled, they are downloaded in
+        parallel and the writer thread just accounts for them in order.
+        '''
+        f = None
+        try:
+            f = self.spool.open(sequence.num)
+            for chunk in self.iter_segment(sequence, res, chunk_size):
+                f.write(chunk)
+            if self.closed or not f.tell():
+                return
+            self.spool.commit(sequence.num, f)
+            f = None
+            log.debug('Segment {0} spooled', sequence.num)
+            return self.spool.segment(sequence.num)
+        except Exception as err:
+            log.error('write data from url %s error %s' % (sequence.segment.uri, err))
+            self.count_error(TooManySegmentUnableHandle(), err)
+        finally:
+            if f:
+                self.spool.discard(f)
+            res.close()
 
     def validateAndTrim(self, sequence, chunk):
         m = self.validate_magic_ts.search(chunk)
@@ -125,8 +253,27 @@ class HLSStreamWriter(SegmentedStreamWriter):
             return chunk[m.start():]
         raise StreamError('Segments is not ts file %s' % sequence.segment.uri)
 
+    def iter_validated(self, sequence, chunks):
+        'Yields *chunks* from the first TS packets on, the data before them is only held until they are found.'
+        (head, pos) = (b'', 0)
+        for chunk in chunks:
+            if head is None:
+                yield chunk
+                continue
+            head += chunk
+            m = self.validate_magic_ts.search(head, pos)
+            if m:
+                yield head[m.start():]
+                head = None
+            else:
+                pos = max(len(head) - 376, 0)
+        if head is not None:
+            yield self.validateAndTrim(sequence, head)
+
     def _write_buffer(self, data):
         self._buffer_write_size += len(data)
+        if self._spool_file:
+            self._spool_file.write(data)
         self.reader.buffer.write(data)
 
     def get_content_length(self, http_response):
@@ -151,7 +298,8 @@ class HLSStreamWriter(SegmentedStreamWriter):
         self.bytes_recv += length
         self.reader.stream.total_bytes = self.bytes_recv + self.bytes_max*(self.reader.worker.last_sequence_num - sequence_num)
 
-    def _write(self, sequence, res, chunk_size=32768):
+    def iter_segment(self, sequence, res, chunk_size=32768):
+        'Yields the data of a segment, decrypted when the segment is encrypted.'
         if sequence.segment.key and sequence.segment.key.method != 'NONE':
             try:
                 decryptor = self.create_decryptor(sequence.segment.key, sequence.num)
@@ -159,36 +307,51 @@ class HLSStreamWriter(SegmentedStreamWriter):
                 log.error('Failed to create decryptor: {0}', err)
                 self.close()
                 return
-            data = res.content
-            garbage_len = len(data) % 16
-            if garbage_len:
-                log.debug('Cutting off {0} bytes of garbage before decrypting', garbage_len)
-                decrypted_chunk = decryptor.decrypt(data[:-garbage_len])
-            else:
-                decrypted_chunk = decryptor.decrypt(data)
-            chunk = pkcs7_decode(decrypted_chunk)
-            chunk = self.validateAndTrim(sequence, chunk)
-            self._write_buffer(chunk)
+            for chunk in self.iter_validated(sequence, iter_decrypt(decryptor, self.iter_content(res, chunk_size))):
+                yield chunk
         else:
-            for chunk in res.iter_content(chunk_size):
-                self._write_buffer(chunk)
+            for chunk in self.iter_content(res, chunk_size):
+                yield chunk
+
+    def iter_content(self, res, chunk_size=32768):
+        for chunk in res.iter_content(chunk_size):
+            self.bandwidth.consume(len(chunk), self.isClosed)
+            yield chunk
+
+    def _write(self, sequence, res, chunk_size=32768):
+        for chunk in self.iter_segment(sequence, res, chunk_size):
+            self._write_buffer(chunk)
         log.debug('Download of segment {0} complete', sequence.num)
 
     def write(self, sequence, res, chunk_size=32768):
         try:
             self._buffer_write_size = 0
-            self._write(sequence, res, chunk_size)
+            if isinstance(res, SpooledSegment) and self.spool_only:
+                self._buffer_write_size = self.spool.done[sequence.num]
+            elif isinstance(res, SpooledSegment):
+                for chunk in res.iter_content(chunk_size):
+                    self._write_buffer(chunk)
+                log.debug('Segment {0} read from spool', sequence.num)
+            else:
+                self._spool_file = self.spool and self.spool.open(sequence.num)
+                if isinstance(res, BufferedSegment):
+                    for chunk in res.iter_content(chunk_size):
+                        self._write_buffer(chunk)
+                    log.debug('Download of segment {0} complete', sequence.num)
+                else:
+                    self._write(sequence, res, chunk_size)
+                if self._spool_file and self._buffer_write_size and not self.closed:
+                    self.spool.commit(sequence.num, self._spool_file)
+                    self._spool_file = None
             if self._buffer_write_size:
                 self.update_total_bytes(self._buffer_write_size, sequence.num)
         except Exception as err:
             log.error('write data from url %s error %s' % (sequence.segment.uri, err))
-            with self._lock_error:
-                self.num_error += 1
-                if self.num_error >= self.max_num_error:
-                    self.error = TooManySegmentUnableHandle()
-                    self.reader.worker.close()
-                    self.close()
+            self.count_error(TooManySegmentUnableHandle(), err)
         finally:
+            if self._spool_file:
+                self.spool.discard(self._spool_file)
+                self._spool_file = None
             res.close()
 
 class HLSStreamWorker(SegmentedStreamWorker):
@@ -200,6 +363,7 @@ class HLSStreamWorker(SegmentedStreamWorker):
         self.playlist_end = None
         self.playlist_sequence = -1
         self.playlist_sequences = []
+        self.playlist_parser = hls_playlist.IncrementalM3U8Parser()
         self.playlist_reload_time = 15
         self.total_sequences = 0
         self.last_sequence_num = 0
@@ -218,6 +382,7 @@ class HLSStreamWorker(SegmentedStreamWorker):
         if self.playlist_sequences:
             log.debug('First Sequence: {0}; Last Sequence: {1}', self.playlist_sequences[0].num, self.playlist_sequences[-1].num)
             log.debug('Start offset: {0}; Duration: {1}; Start Sequence: {2}; End Sequence: {3}', self.duration_offset_start, self.duration_limit, self.playlist_sequence, self.playlist_end)
+        self.reader.writer.open_spool(self)
 
     def reload_playlist(self):
         if self.closed:
@@ -226,24 +391,42 @@ class HLSStreamWorker(SegmentedStreamWorker):
         log.debug('Reloading playlist')
         res = self.session.http.get(self.stream.url, exception=StreamError, retries=self.playlist_reload_retries, **self.reader.request_params)
         try:
-            playlist = hls_playlist.load(res.text, res.url)
+            playlist = self.playlist_parser.update(res.text, res.url)
         except ValueError as err:
+            self.playlist_parser = hls_playlist.IncrementalM3U8Parser()
             raise StreamError(err)
         if playlist.is_master:
             raise StreamError("Attempted to play a variant playlist, use 'hls://{0}' instead".format(self.stream.url))
         if playlist.iframes_only:
             raise StreamError('Streams containing I-frames only is not playable')
-        media_sequence = playlist.media_sequence or 0
-        sequences = [Sequence(media_sequence + i, s) for (i, s) in enumerate(playlist.segments)]
+        sequences = self.build_sequences(playlist)
         if sequences:
             self.process_sequences(playlist, sequences)
 
+    def build_sequences(self, playlist):
+        '''Numbers the segments of *playlist*.
+
+        After an incremental parse only the new segments are numbered,
+        the others are taken from the previous playlist.
+        '''
+        media_sequence = playlist.media_sequence or 0
+        previous = self.playlist_sequences
+        if playlist.new_segments is None or not previous or media_sequence < previous[0].num:
+            return [Sequence(media_sequence + i, s) for (i, s) in enumerate(playlist.segments)]
+        sequences = previous[media_sequence - previous[0].num:]
+        first = len(playlist.segments) - playlist.new_segments
+        if len(sequences) != first:
+            return [Sequence(media_sequence + i, s) for (i, s) in enumerate(playlist.segments)]
+        sequences.extend(Sequence(media_sequence + i, s) for (i, s) in enumerate(playlist.segments[first:], first))
+        return sequences
+
     def process_sequences(self, playlist, sequences):
         (first_sequence, last_sequence) = (sequences[0], sequences[-1])
         self.last_sequence_num = last_sequence.num
         if first_sequence.segment.key and first_sequence.segment.key.method != 'NONE':
             log.debug('Segments in this playlist are encrypted')
-        self.playlist_changed = [s.num for s in self.playlist_sequences] != [s.num for s in sequences]
+        previous = self.playlist_sequences
+        self.playlist_changed = not previous or previous[0].num != first_sequence.num or len(previous) != len(sequences)
         self.playlist_reload_time = playlist.target_duration or last_sequence.segment.duration
         self.playlist_sequences = sequences
         if not self.playlist_changed:
@@ -275,7 +458,9 @@ class HLSStreamWorker(SegmentedStreamWorker):
     def iter_segments(self):
         total_duration = 0
         while not self.closed:
-            for sequence in filter(self.valid_sequence, self.playlist_sequences):
+            sequences = [sequence for sequence in self.playlist_sequences if self.valid_sequence(sequence)]
+            for (index, sequence) in enumerate(sequences):
+                self.reader.writer.prefetch_keys(sequences[index:index + self.reader.writer.window])
                 log.debug('Adding segment {0} to queue', sequence.num)
                 yield sequence
                 total_duration += sequence.segment.duration
@@ -308,7 +493,7 @@ class HLSStreamReader(SegmentedStreamReader):
     def read(self, size):
         data = SegmentedStreamReader.read(self, size)
         if not data and self.writer.error:
-            raise IOError('Input data is error: %s' % self.writer.error)
+            raise IOError('Input data is error: %s' % self.writer.error) from self.writer.error
         return data
 
 class MuxedHLSStream(MuxedStream):
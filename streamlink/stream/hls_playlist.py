@@ -3,7 +3,7 @@ from binascii import unhexlify
 from collections import namedtuple
 from itertools import starmap
 from streamlink.compat import urljoin, urlparse
-__all__ = ['load', 'M3U8Parser']
+__all__ = ['load', 'M3U8Parser', 'IncrementalM3U8Parser']
 ByteRange = namedtuple('ByteRange', 'range offset')
 Key = namedtuple('Key', 'method uri iv key_format key_format_versions')
 Map = namedtuple('Map', 'uri byterange')
@@ -31,6 +31,7 @@ class M3U8(object):
         self.media = []
         self.playlists = []
         self.segments = []
+        self.new_segments = None
 
 class M3U8Parser(object):
     _extinf_re = re.compile('(?P<duration>\\d+(\\.\\d+)?)(,(?P<title>.+))?')
@@ -38,9 +39,11 @@ class M3U8Parser(object):
     _range_re = re.compile('(?P<range>\\d+)(@(?P<offset>.+))?')
     _tag_re = re.compile('#(?P<tag>[\\w-]+)(:(?P<value>.+))?')
     _res_re = re.compile('(\\d+)x(\\d+)')
+    tag_handlers = {'EXTINF': 'tag_extinf', 'EXT-X-BYTERANGE': 'tag_byterange', 'EXT-X-TARGETDURATION': 'tag_target_duration', 'EXT-X-MEDIA-SEQUENCE': 'tag_media_sequence', 'EXT-X-KEY': 'tag_key', 'EXT-X-PROGRAM-DATE-TIME': 'tag_program_date_time', 'EXT-X-ALLOW-CACHE': 'tag_allow_cache', 'EXT-X-STREAM-INF': 'tag_stream_inf', 'EXT-X-PLAYLIST-TYPE': 'tag_playlist_type', 'EXT-X-ENDLIST': 'tag_endlist', 'EXT-X-MEDIA': 'tag_media', 'EXT-X-DISCONTINUITY': 'tag_discontinuity', 'EXT-X-DISCONTINUITY-SEQUENCE': 'tag_discontinuity_sequence', 'EXT-X-I-FRAMES-ONLY': 'tag_iframes_only', 'EXT-X-MAP': 'tag_map', 'EXT-X-I-FRAME-STREAM-INF': 'tag_iframe_stream_inf', 'EXT-X-VERSION': 'tag_version', 'EXT-X-START': 'tag_start'}
 
     def __init__(self, base_uri=None):
-        self.base_uri = base_uri
+        self.set_base_uri(base_uri)
+        self.handlers = {tag: getattr(self, name) for (tag, name) in self.tag_handlers.items()}
 
     def create_stream_info(self, streaminf, cls=None):
         program_id = streaminf.get('PROGRAM-ID')
@@ -119,69 +122,96 @@ class M3U8Parser(object):
                 key = self.state.get('key')
                 segment = Segment(self.uri(line), extinf[0], extinf[1], key, self.state.pop('discontinuity', False), byterange, date, map_)
                 self.m3u8.segments.append(segment)
+                self.last_segment_line = line
             elif self.state.pop('expect_playlist', None):
                 streaminf = self.state.pop('streaminf', {})
                 stream_info = self.create_stream_info(streaminf)
                 playlist = Playlist(self.uri(line), stream_info, [], False)
                 self.m3u8.playlists.append(playlist)
-        elif line.startswith('#EXTINF'):
-            self.state['expect_segment'] = True
-            self.state['extinf'] = self.parse_tag(line, self.parse_extinf)
-        elif line.startswith('#EXT-X-BYTERANGE'):
-            self.state['expect_segment'] = True
-            self.state['byterange'] = self.parse_tag(line, self.parse_byterange)
-        elif line.startswith('#EXT-X-TARGETDURATION'):
-            self.m3u8.target_duration = self.parse_tag(line, int)
-        elif line.startswith('#EXT-X-MEDIA-SEQUENCE'):
-            self.m3u8.media_sequence = self.parse_tag(line, int)
-        elif line.startswith('#EXT-X-KEY'):
-            attr = self.parse_tag(line, self.parse_attributes)
-            iv = attr.get('IV')
-            if iv:
-                iv = self.parse_hex(iv)
-            self.state['key'] = Key(attr.get('METHOD'), self.uri(attr.get('URI')), iv, attr.get('KEYFORMAT'), attr.get('KEYFORMATVERSIONS'))
-        elif line.startswith('#EXT-X-PROGRAM-DATE-TIME'):
-            self.state['date'] = self.parse_tag(line)
-        elif line.startswith('#EXT-X-ALLOW-CACHE'):
-            self.m3u8.allow_cache = self.parse_tag(line, self.parse_bool)
-        elif line.startswith('#EXT-X-STREAM-INF'):
-            self.state['streaminf'] = self.parse_tag(line, self.parse_attributes)
-            self.state['expect_playlist'] = True
-        elif line.startswith('#EXT-X-PLAYLIST-TYPE'):
-            self.m3u8.playlist_type = self.parse_tag(line)
-        elif line.startswith('#EXT-X-ENDLIST'):
-            self.m3u8.is_endlist = True
-        elif line.startswith('#EXT-X-MEDIA'):
-            attr = self.parse_tag(line, self.parse_attributes)
-            media = Media(self.uri(attr.get('URI')), attr.get('TYPE'), attr.get('GROUP-ID'), attr.get('LANGUAGE'), attr.get('NAME'), self.parse_bool(attr.get('DEFAULT')), self.parse_bool(attr.get('AUTOSELECT')), self.parse_bool(attr.get('FORCED')), attr.get('CHARACTERISTICS'))
-            self.m3u8.media.append(media)
-        elif line.startswith('#EXT-X-DISCONTINUITY'):
-            self.state['discontinuity'] = True
-            self.state['map'] = None
-        elif line.startswith('#EXT-X-DISCONTINUITY-SEQUENCE'):
-            self.m3u8.discontinuity_sequence = self.parse_tag(line, int)
-        elif line.startswith('#EXT-X-I-FRAMES-ONLY'):
-            self.m3u8.iframes_only = True
-        elif line.startswith('#EXT-X-MAP'):
-            attr = self.parse_tag(line, self.parse_attributes)
-            byterange = self.parse_byterange(attr.get('BYTERANGE', ''))
-            self.state['map'] = Map(attr.get('URI'), byterange)
-        elif line.startswith('#EXT-X-I-FRAME-STREAM-INF'):
-            attr = self.parse_tag(line, self.parse_attributes)
-            streaminf = self.state.pop('streaminf', attr)
-            stream_info = self.create_stream_info(streaminf, IFrameStreamInfo)
-            playlist = Playlist(self.uri(attr.get('URI')), stream_info, [], True)
-            self.m3u8.playlists.append(playlist)
-        elif line.startswith('#EXT-X-VERSION'):
-            self.m3u8.version = self.parse_tag(line, int)
-        elif line.startswith('#EXT-X-START'):
-            attr = self.parse_tag(line, self.parse_attributes)
-            start = Start(attr.get('TIME-OFFSET'), self.parse_bool(attr.get('PRECISE', 'NO')))
-            self.m3u8.start = start
+            return
+        (tag, sep, value) = line[1:].partition(':')
+        handler = self.handlers.get(tag)
+        if handler:
+            handler(value.strip())
+
+    def tag_extinf(self, value):
+        self.state['expect_segment'] = True
+        self.state['extinf'] = self.parse_extinf(value)
+
+    def tag_byterange(self, value):
+        self.state['expect_segment'] = True
+        self.state['byterange'] = self.parse_byterange(value)
+        self.has_byterange = True
+
+    def tag_target_duration(self, value):
+        self.m3u8.target_duration = int(value)
+
+    def tag_media_sequence(self, value):
+        self.m3u8.media_sequence = int(value)
+
+    def tag_key(self, value):
+        attr = self.parse_attributes(value)
+        iv = attr.get('IV')
+        if iv:
+            iv = self.parse_hex(iv)
+        self.state['key'] = Key(attr.get('METHOD'), self.uri(attr.get('URI')), iv, attr.get('KEYFORMAT'), attr.get('KEYFORMATVERSIONS'))
+
+    def tag_program_date_time(self, value):
+        self.state['date'] = value
+
+    def tag_allow_cache(self, value):
+        self.m3u8.allow_cache = self.parse_bool(value)
+
+    def tag_stream_inf(self, value):
+        self.state['streaminf'] = self.parse_attributes(value)
+        self.state['expect_playlist'] = True
+
+    def tag_playlist_type(self, value):
+        self.m3u8.playlist_type = value
+
+    def tag_endlist(self, value):
+        self.m3u8.is_endlist = True
+
+    def tag_media(self, value):
+        attr = self.parse_attributes(value)
+        media = Media(self.uri(attr.get('URI')), attr.get('TYPE'), attr.get('GROUP-ID'), attr.get('LANGUAGE'), attr.get('NAME'), self.parse_bool(attr.get('DEFAULT')), self.parse_bool(attr.get('AUTOSELECT')), self.parse_bool(attr.get('FORCED')), attr.get('CHARACTERISTICS'))
+        self.m3u8.media.append(media)
+
+    def tag_discontinuity(self, value):
+        self.state['discontinuity'] = True
+        self.state['map'] = None
+
+    def tag_discontinuity_sequence(self, value):
+        self.m3u8.discontinuity_sequence = int(value)
+
+    def tag_iframes_only(self, value):
+        self.m3u8.iframes_only = True
+
+    def tag_map(self, value):
+        attr = self.parse_attributes(value)
+        byterange = self.parse_byterange(attr.get('BYTERANGE', ''))
+        self.state['map'] = Map(attr.get('URI'), byterange)
+
+    def tag_iframe_stream_inf(self, value):
+        attr = self.parse_attributes(value)
+        streaminf = self.state.pop('streaminf', attr)
+        stream_info = self.create_stream_info(streaminf, IFrameStreamInfo)
+        playlist = Playlist(self.uri(attr.get('URI')), stream_info, [], True)
+        self.m3u8.playlists.append(playlist)
+
+    def tag_version(self, value):
+        self.m3u8.version = int(value)
+
+    def tag_start(self, value):
+        attr = self.parse_attributes(value)
+        start = Start(attr.get('TIME-OFFSET'), self.parse_bool(attr.get('PRECISE', 'NO')))
+        self.m3u8.start = start
 
     def parse(self, data):
         self.state = {}
         self.m3u8 = M3U8()
+        self.last_segment_line = None
+        self.has_byterange = False
         lines = iter(filter(bool, data.splitlines()))
         try:
             line = next(lines)
@@ -192,6 +222,9 @@ class M3U8Parser(object):
         parse_line = self.parse_line
         for line in lines:
             parse_line(line)
+        return self.finish()
+
+    def finish(self):
         for playlist in self.m3u8.playlists:
             for media_type in ('audio', 'video', 'subtitles'):
                 group_id = getattr(playlist.stream_info, media_type, None)
@@ -201,13 +234,98 @@ class M3U8Parser(object):
         self.m3u8.is_master = not not self.m3u8.playlists
         return self.m3u8
 
+    def set_base_uri(self, base_uri):
+        '''Sets the URI relative URIs are joined with.
+
+        Plain relative file names are joined by prepending the directory
+        of *base_uri*, other URIs go through urljoin once and are cached.
+        '''
+        self.base_uri = base_uri
+        self._uri_cache = {}
+        self._base_dir = None
+        if base_uri:
+            parsed = urlparse(base_uri)
+            if parsed.scheme and parsed.netloc:
+                base = base_uri.split('#', 1)[0].split('?', 1)[0]
+                self._base_dir = base + '/' if not parsed.path else base[:base.rindex('/') + 1]
+
     def uri(self, uri):
-        if uri and urlparse(uri).scheme:
-            return uri
-        elif self.base_uri and uri:
-            return urljoin(self.base_uri, uri)
-        else:
+        if not uri or not self.base_uri:
             return uri
+        if self._base_dir and ':' not in uri and '/.' not in uri and uri[0] not in '/.?#':
+            return self._base_dir + uri
+        joined = self._uri_cache.get(uri)
+        if joined is None:
+            joined = uri if urlparse(uri).scheme else urljoin(self.base_uri, uri)
+            if len(self._uri_cache) >= 1024:
+                self._uri_cache.clear()
+            self._uri_cache[uri] = joined
+        return joined
+
+class IncrementalM3U8Parser(M3U8Parser):
+    __doc__ = """Parser of a media playlist reloaded again and again.
+
+    When the new playlist still holds the last segment of the previous
+    one, the segments up to it are taken from the previous result and
+    only the lines after it are parsed. ``new_segments`` of the result
+    is the number of segments added since the previous parse, or None
+    after a full parse. Playlists with byte ranges are always parsed in
+    full as their URIs repeat.
+    """
+    _media_sequence_re = re.compile('#EXT-X-MEDIA-SEQUENCE:\\s*(\\d+)')
+
+    def __init__(self, base_uri=None):
+        M3U8Parser.__init__(self, base_uri)
+        self.m3u8 = None
+        self.resumed = 0
+        self.full = 0
+
+    def update(self, data, base_uri=None):
+        if base_uri != self.base_uri:
+            self.set_base_uri(base_uri)
+            self.m3u8 = None
+        return self.parse(data)
+
+    def parse(self, data):
+        previous = self.m3u8
+        state = {name: value for (name, value) in self.state.items() if name in ('key', 'map')} if previous else None
+        position = previous and self._resume_position(data, previous)
+        if not position:
+            self.full += 1
+            return M3U8Parser.parse(self, data)
+        self.resumed += 1
+        (header_end, tail_start, media_sequence) = position
+        self.state = {}
+        self.m3u8 = M3U8()
+        for line in data[:header_end].splitlines()[1:]:
+            if line:
+                self.parse_line(line)
+        self.state = state
+        self.m3u8.segments = previous.segments[media_sequence - (previous.media_sequence or 0):]
+        count = len(self.m3u8.segments)
+        for line in data[tail_start:].splitlines():
+            if line:
+                self.parse_line(line)
+        self.m3u8.new_segments = len(self.m3u8.segments) - count
+        return self.finish()
+
+    def _resume_position(self, data, previous):
+        if previous.is_master or not previous.segments or self.has_byterange or not data.startswith('#EXTM3U'):
+            return
+        match = self._media_sequence_re.search(data)
+        media_sequence = int(match.group(1)) if match else 0
+        last_num = (previous.media_sequence or 0) + len(previous.segments) - 1
+        if not (previous.media_sequence or 0) <= media_sequence <= last_num:
+            return
+        line = self.last_segment_line
+        position = data.rfind(line)
+        end = position + len(line)
+        if position <= 0 or data[position - 1] not in '\r\n' or (end < len(data) and data[end] not in '\r\n'):
+            return
+        header_end = data.find('#EXTINF')
+        if header_end < 0 or header_end > position or data.count('#EXTINF', header_end, position) != last_num - media_sequence + 1:
+            return
+        return (header_end, end, media_sequence)
 
 def load(data, base_uri=None, parser=M3U8Parser):
     '''Attempts to parse a M3U8 playlist from a string of data.
@@ -19,7 +19,8 @@ from hashlib import md5
 from Crypto.Cipher import AES
 from streamlink import StreamError
 from streamlink.stream import Stream
-from streamlink.buffers import RingBuffer
+from streamlink.buffers import CircularBuffer
+from streamlink.bandwidth import bandwidth_scheduler
 BLOCK_SIZE = 16
 log = logging.getLogger(__name__)
 
@@ -85,7 +86,8 @@ class WebSocketStreamReader(io.IOBase):
         self.stream = stream
         self.quality = self.stream.quality
         buffer_size = self.stream.session.get_option('ringbuffer-size')
-        self.buffer = RingBuffer(buffer_size)
+        self.buffer = CircularBuffer(buffer_size)
+        self.bandwidth = bandwidth_scheduler.owner(self.stream.session.options.get('bandwidth-owner'))
         self.timeout = self.stream.session.options.get('stream-timeout')
         self.http_timeout = self.stream.session.http.timeout
         self.ws = None
@@ -118,6 +120,7 @@ class WebSocketStreamReader(io.IOBase):
                 data_len = len(data)
                 if not data_len:
                     break
+                self.bandwidth.consume(data_len, lambda: self.__closed)
                 if data_len == 1 and data[0] == 48:
                     self.ws_send(str((current_chunk + 1)*self.chunk_length))
                 else:
@@ -253,6 +256,11 @@ class WebSocketStreamReader(io.IOBase):
             raise IOError('Process data chunk error (%s)' % self._error)
         return self.buffer.read(size, True, self.timeout)
 
+    def readinto(self, b):
+        if self._error:
+            raise IOError('Process data chunk error (%s)' % self._error)
+        return self.buffer.readinto(b, True, self.timeout)
+
     def close(self):
         self.__closed = True
         self.buffer.close()
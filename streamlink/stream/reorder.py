@@ -0,0 +1,146 @@
+import logging
+import tempfile
+from threading import Condition
+log = logging.getLogger(__name__)
+
+class BufferedSegment(object):
+    __doc__ = 'A fetched segment held by the reorder buffer, passed to write in place of a response.'
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.chunks = []
+        self.size = 0
+        self.memory = 0
+        self.file = None
+        self.complete = False
+
+    def append(self, chunk, is_head, closed):
+        if self.file is None:
+            admitted = self.buffer.reserve(self, len(chunk), is_head, closed)
+            if admitted is None:
+                self.buffer.spill(self)
+            elif not admitted:
+                return False
+        if self.file is not None:
+            self.file.write(chunk)
+        else:
+            self.chunks.append(chunk)
+            self.memory += len(chunk)
+        self.size += len(chunk)
+        return True
+
+    def iter_content(self, chunk_size):
+        for chunk in self.chunks:
+            yield chunk
+        if self.file is not None:
+            self.file.seek(0)
+            while True:
+                chunk = self.file.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+    def close(self):
+        if self.buffer:
+            self.buffer.release(self)
+            self.buffer = None
+        self.chunks = []
+        if self.file is not None:
+            self.file.close()
+
+class ReorderBuffer(object):
+    __doc__ = """Memory-accounted store of segments fetched ahead of the writer.
+
+    Fetch threads read segments into it as soon as they arrive, the
+    writer thread takes them in order. Once *max_size* bytes are held a
+    fetch thread spills its segment to a temporary file in *spool_dir*,
+    or without one waits until the writer frees memory. The segment the
+    writer waits for is always admitted, so the buffer can not deadlock.
+    """
+
+    def __init__(self, max_size, spool_dir=None):
+        self.max_size = max_size
+        self.spool_dir = spool_dir
+        self.size = 0
+        self.peak = 0
+        self.segments = 0
+        self.spilled = 0
+        self.spilled_bytes = 0
+        self.waits = 0
+        self.closed = False
+        self._cond = Condition()
+
+    def store(self, chunks, is_head, closed):
+        '''Reads the *chunks* of a segment into a new BufferedSegment.
+
+        *is_head* returns True when the writer waits for this segment,
+        *closed* when the writer was closed. Returns None when closed.
+        '''
+        segment = BufferedSegment(self)
+        try:
+            for chunk in chunks:
+                if not segment.append(chunk, is_head, closed):
+                    segment.close()
+                    return
+        except Exception:
+            segment.close()
+            raise
+        with self._cond:
+            segment.complete = True
+            self.segments += 1
+        return segment
+
+    def reserve(self, segment, size, is_head, closed):
+        '''Accounts *size* more bytes of *segment* in memory.
+
+        Returns False when closed and None when the segment has to be
+        spilled to disk.
+        '''
+        with self._cond:
+            waited = False
+            while self.size + size > self.max_size:
+                if self.closed or closed():
+                    return False
+                if is_head():
+                    break
+                if self.spool_dir:
+                    return
+                if self.size <= segment.memory:
+                    break
+                if not waited:
+                    self.waits += 1
+                    waited = True
+                self._cond.wait(0.5)
+            self.size += size
+            self.peak = max(self.peak, self.size)
+            return True
+
+    def spill(self, segment):
+        'Moves the chunks of *segment* held in memory to a temporary file.'
+        segment.file = tempfile.TemporaryFile(dir=self.spool_dir, prefix='segment_')
+        for chunk in segment.chunks:
+            segment.file.write(chunk)
+        with self._cond:
+            self.size -= segment.memory
+            self.spilled += 1
+            (segment.chunks, segment.memory) = ([], 0)
+            self._cond.notify_all()
+
+    def release(self, segment):
+        with self._cond:
+            self.size -= segment.memory
+            if segment.file is not None:
+                self.spilled_bytes += segment.size
+            if segment.complete:
+                self.segments -= 1
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {'size': self.size, 'peak': self.peak, 'segments': self.segments, 'spilled': self.spilled, 'spilled_bytes': self.spilled_bytes, 'waits': self.waits}
+__all__ = ['ReorderBuffer', 'BufferedSegment']
@@ -1,9 +1,13 @@
 import concurrent.futures.thread
 import logging
+from time import time
 from concurrent import futures
 from threading import Thread, Event
 from .stream import StreamIO
-from ..buffers import RingBuffer
+from .reorder import ReorderBuffer
+from ..buffers import CircularBuffer
+from ..governor import host_governor
+from ..bandwidth import bandwidth_scheduler
 from ..compat import queue
 log = logging.getLogger(__name__)
 
@@ -62,9 +66,14 @@ class SegmentedStreamWriter(Thread):
 
     This thread is responsible for fetching segments, processing them
     and finally writing the data to the buffer.
+
+    Up to *window* segments are queued ahead of the one being written,
+    independent of the number of fetch threads. Writers that read the
+    segments in the fetch threads keep them in a ReorderBuffer of
+    *reorder_size* bytes until they are written in order.
     """
 
-    def __init__(self, reader, size=3, retries=None, threads=None, timeout=None, ignore_names=None):
+    def __init__(self, reader, size=3, retries=None, threads=None, timeout=None, ignore_names=None, window=None, reorder_size=None, reorder_dir=None):
         self.closed = False
         self.reader = reader
         self.stream = reader.stream
@@ -75,15 +84,30 @@ class SegmentedStreamWriter(Thread):
             threads = self.session.options.get('stream-segment-threads')
         if not timeout:
             timeout = self.session.options.get('stream-segment-timeout')
+        if not window:
+            window = self.session.options.get('stream-segment-window')
+        if not reorder_size:
+            reorder_size = self.session.options.get('stream-segment-reorder-size')
+        if not reorder_dir:
+            reorder_dir = self.session.options.get('stream-segment-reorder-dir')
         self.retries = retries
         self.timeout = timeout
         self.ignore_names = ignore_names
         self.executor = futures.ThreadPoolExecutor(max_workers=threads)
-        if threads:
-            size = threads - 2
-            if size <= 0:
-                size = 3
+        if window:
+            size = window
+        elif threads:
+            size = max(threads*2, 3)
         self.threads = threads
+        self.window = size
+        self.reorder = ReorderBuffer(reorder_size, reorder_dir)
+        self.hol_stalls = 0
+        self.hol_wait = 0.0
+        self.hol_max_ready = 0
+        self.rate_request = None
+        self.rate_delay = 1
+        self.head = None
+        self.bandwidth = bandwidth_scheduler.owner(self.session.options.get('bandwidth-owner'))
         self.futures = queue.Queue(size)
         Thread.__init__(self, name='Thread-{0}'.format(self.__class__.__name__))
         self.daemon = True
@@ -94,13 +118,19 @@ class SegmentedStreamWriter(Thread):
             log.debug('Closing writer thread')
         self.closed = True
         self.reader.buffer.close()
+        self.reorder.close()
         self.executor.shutdown(wait=False)
         try:
-            pass
+            while True:
+                (segment, future) = self.futures.get_nowait()
+                if future and future.done() and not future.cancelled() and not future.exception():
+                    result = future.result()
+                    if result is not None:
+                        result.close()
         except queue.Empty:
             pass
-        if concurrent.futures.thread._threads_queues:
-            concurrent.futures.thread._threads_queues.clear()
+        for thread in list(self.executor._threads):
+            concurrent.futures.thread._threads_queues.pop(thread, None)
 
     def put(self, segment):
         'Adds a segment to the download pool and write queue.'
@@ -121,6 +151,30 @@ class SegmentedStreamWriter(Thread):
             except queue.Full:
                 continue
 
+    def isClosed(self):
+        return self.closed
+
+    def governed(self, url, segment, fetch, *args, **kwargs):
+        '''Calls *fetch* holding a connection slot on the host of *url*.
+
+        The slot stays held by the returned response until it is closed,
+        rate_request/rate_delay set a request rate shared by the host.
+        '''
+        if self.rate_request:
+            host_governor.ensure_rate(url, self.rate_request, self.rate_delay)
+        slot = host_governor.acquire(url, self.session.http, lambda: self.closed, lambda: self.head is segment)
+        if not slot:
+            return
+        try:
+            res = fetch(segment, *args, **kwargs)
+        except Exception:
+            slot.release()
+            raise
+        if res is None:
+            slot.release()
+            return
+        return host_governor.track(res, slot)
+
     def fetch(self, segment, **kwargs):
         '''Fetches a segment.
 
@@ -128,6 +182,20 @@ class SegmentedStreamWriter(Thread):
         '''
         pass
 
+    def buffer(self, segment, chunks):
+        '''Reads the *chunks* of a fetched segment into the reorder buffer.
+
+        Called from the fetch thread, returns a BufferedSegment to pass
+        to write or None when the writer was closed.
+        '''
+        return self.reorder.store(chunks, lambda: self.head is segment, self.isClosed)
+
+    def stats(self):
+        'Returns the prefetch window, head-of-line blocking and reorder buffer statistics.'
+        stats = {'window': self.window, 'hol_stalls': self.hol_stalls, 'hol_wait': self.hol_wait, 'hol_max_ready': self.hol_max_ready}
+        stats.update(('reorder_' + key, value) for (key, value) in self.reorder.stats().items())
+        return stats
+
     def write(self, segment, result, **kwargs):
         '''Writes a segment to the buffer.
 
@@ -135,6 +203,24 @@ class SegmentedStreamWriter(Thread):
         '''
         pass
 
+    def wait_head(self, future, interval=0.1):
+        '''Waits for the segment to write next.
+
+        Time spent waiting while later segments are already in the
+        reorder buffer is counted as head-of-line blocking.
+        '''
+        stalled = False
+        while not self.closed and not future.done():
+            ready = self.reorder.segments
+            started = time()
+            futures.wait([future], interval)
+            if ready:
+                self.hol_wait += time() - started
+                self.hol_max_ready = max(self.hol_max_ready, ready)
+                if not stalled:
+                    self.hol_stalls += 1
+                    stalled = True
+
     def run(self):
         while not self.closed:
             try:
@@ -143,6 +229,8 @@ class SegmentedStreamWriter(Thread):
                 continue
             if future is None:
                 break
+            self.head = segment
+            self.wait_head(future)
             while not self.closed:
                 try:
                     result = future.result(timeout=0.5)
@@ -153,6 +241,8 @@ class SegmentedStreamWriter(Thread):
                 if result is not None:
                     self.write(segment, result)
                 break
+        if self.hol_stalls:
+            log.debug('Head-of-line blocked {0} times for {1:.2f}s, up to {2} segments ready', self.hol_stalls, self.hol_wait, self.hol_max_ready)
         self.close()
 
 class SegmentedStreamReader(StreamIO):
@@ -175,7 +265,7 @@ class SegmentedStreamReader(StreamIO):
 
     def open(self):
         buffer_size = self.session.get_option('ringbuffer-size')
-        self.buffer = RingBuffer(buffer_size)
+        self.buffer = CircularBuffer(buffer_size)
         self.writer = self.__writer__(self)
         self.worker = self.__worker__(self)
         self.writer.start()
@@ -191,3 +281,8 @@ class SegmentedStreamReader(StreamIO):
             return b''
         return self.buffer.read(size, block=self.writer.is_alive(), timeout=self.timeout)
 
+    def readinto(self, b):
+        if not self.buffer:
+            return 0
+        return self.buffer.readinto(b, block=self.writer.is_alive(), timeout=self.timeout)
+
@@ -0,0 +1,141 @@
+import os
+import json
+import errno
+import shutil
+import logging
+from hashlib import md5
+from threading import Lock
+log = logging.getLogger(__name__)
+
+def playlist_signature(sequences):
+    '''Identifies a VOD playlist by its sequence numbers and segment durations.
+
+    Segment URIs are left out as they often carry expiring tokens.
+    '''
+    h = md5()
+    for sequence in sequences:
+        h.update(('%d:%.3f;' % (sequence.num, sequence.segment.duration or 0)).encode('ascii'))
+    return h.hexdigest()
+
+class SpooledSegment(object):
+    __doc__ = 'A segment already in the spool, returned by fetch in place of a response.'
+
+    def __init__(self, num, path):
+        self.num = num
+        self.path = path
+
+    def iter_content(self, chunk_size):
+        with open(self.path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+    def close(self):
+        pass
+
+class SegmentSpool(object):
+    __doc__ = """Directory of completed segments of one playlist, used to resume a download.
+
+    Every segment is written to ``<num>.ts.part`` and renamed once
+    complete, then ``<num> <size>`` is appended to ``done.log``. Entries
+    whose file is missing or has another size are ignored when the
+    spool is opened again. The spool is wiped when the playlist
+    signature changed.
+    """
+    INDEX = 'index.json'
+    LOG = 'done.log'
+
+    def __init__(self, path, signature):
+        self.path = path
+        self.signature = signature
+        self.done = {}
+        self._lock = Lock()
+        try:
+            os.makedirs(path)
+        except OSError as err:
+            if err.errno != errno.EEXIST:
+                raise
+        if self._read_index() != signature:
+            self.clear()
+            with open(os.path.join(path, self.INDEX), 'w') as f:
+                json.dump({'signature': signature}, f)
+        else:
+            self._load()
+        self._log = open(os.path.join(path, self.LOG), 'a')
+
+    def _read_index(self):
+        try:
+            with open(os.path.join(self.path, self.INDEX)) as f:
+                return json.load(f).get('signature')
+        except (IOError, OSError, ValueError):
+            return
+
+    def _load(self):
+        try:
+            with open(os.path.join(self.path, self.LOG)) as f:
+                for line in f:
+                    try:
+                        (num, size) = map(int, line.split())
+                    except ValueError:
+                        continue
+                    try:
+                        if os.path.getsize(self.file(num)) == size:
+                            self.done[num] = size
+                    except OSError:
+                        pass
+        except (IOError, OSError):
+            pass
+        if self.done:
+            log.info('Spool {0} has {1} segments', self.path, len(self.done))
+
+    def clear(self):
+        for name in os.listdir(self.path):
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                pass
+        self.done = {}
+
+    def file(self, num):
+        return os.path.join(self.path, '%d.ts' % num)
+
+    def has(self, num):
+        return num in self.done
+
+    def segment(self, num):
+        return SpooledSegment(num, self.file(num))
+
+    def open(self, num):
+        'Returns a file for writing segment *num*, pass it to commit or discard.'
+        return open(self.file(num) + '.part', 'wb')
+
+    def commit(self, num, f):
+        size = f.tell()
+        f.close()
+        os.replace(f.name, self.file(num))
+        with self._lock:
+            self.done[num] = size
+            self._log.write('%d %d\n' % (num, size))
+            self._log.flush()
+
+    def discard(self, f):
+        f.close()
+        try:
+            os.remove(f.name)
+        except OSError:
+            pass
+
+    def files(self):
+        'Returns the paths of the completed segments in sequence order.'
+        return [self.file(num) for num in sorted(self.done)]
+
+    def close(self):
+        with self._lock:
+            if not self._log.closed:
+                self._log.close()
+
+    @classmethod
+    def remove(cls, path):
+        shutil.rmtree(path, ignore_errors=True)
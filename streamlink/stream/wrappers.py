@@ -1,4 +1,4 @@
-from ..buffers import Buffer, RingBuffer
+from ..buffers import Buffer, CircularBuffer
 from threading import Thread
 import io
 
@@ -76,7 +76,7 @@ class StreamIOThreadWrapper(io.IOBase):
                     pass
 
     def __init__(self, session, fd, timeout=30):
-        self.buffer = RingBuffer(session.get_option('ringbuffer-size'))
+        self.buffer = CircularBuffer(session.get_option('ringbuffer-size'))
         self.fd = fd
         self.timeout = timeout
         self.filler = StreamIOThreadWrapper.Filler(self.fd, self.buffer)
@@ -87,6 +87,11 @@ class StreamIOThreadWrapper(io.IOBase):
             raise self.filler.error
         return self.buffer.read(size, block=self.filler.is_alive(), timeout=self.timeout)
 
+    def readinto(self, b):
+        if self.filler.error and self.buffer.length == 0:
+            raise self.filler.error
+        return self.buffer.readinto(b, block=self.filler.is_alive(), timeout=self.timeout)
+
     def close(self):
         self.filler.stop()
         if self.filler.is_alive():
@@ -0,0 +1,165 @@
+import json
+import logging
+import requests
+from hashlib import sha1
+from threading import Lock
+from streamlink.cache import Cache
+from streamlink.compat import getargspec
+from streamlink.stream.hls import HLSStream
+from streamlink.stream.http import HTTPStream
+INVALIDATE_STATUS = (403, 410)
+JSON_TYPES = (str, int, float, bool, type(None))
+log = logging.getLogger(__name__)
+
+def response_status(err):
+    'Returns the HTTP status of the response that caused *err*, or None.'
+    seen = set()
+    while err is not None and id(err) not in seen:
+        seen.add(id(err))
+        status = getattr(getattr(err, 'response', None), 'status_code', None)
+        if status:
+            return status
+        err = getattr(err, 'err', None) or err.__cause__ or err.__context__
+
+def is_json(value):
+    if isinstance(value, (list, tuple)):
+        return all(isinstance(v, JSON_TYPES) for v in value)
+    return isinstance(value, JSON_TYPES)
+
+def dump_stream(stream):
+    '''Returns the descriptor of *stream* built on its __json__, or None
+    when the stream can not be rebuilt from it.
+    '''
+    if type(stream) not in (HTTPStream, HLSStream):
+        return
+    request_args = getargspec(requests.Request.__init__).args
+    args = dict((k, v) for (k, v) in stream.args.items() if k not in request_args)
+    if any(k in stream.args for k in ('files', 'auth', 'hooks', 'json', 'data')) or not all(is_json(v) for v in args.values()):
+        return
+    desc = stream.__json__()
+    if not all(isinstance(v, str) for v in desc['headers'].values()):
+        return
+    desc.update(args=args, priority=stream.priority)
+    if type(stream) is HLSStream:
+        desc.update(toMp4=stream.toMp4, force_restart=stream.force_restart, start_offset=stream.start_offset, duration=stream.duration)
+    else:
+        desc.update(max_workers=stream.max_workers)
+    return desc
+
+def load_stream(session, desc):
+    'Rebuilds the stream described by *desc* in *session*.'
+    args = dict(desc['args'], headers=desc['headers'])
+    if desc['type'] == HLSStream.shortname():
+        stream = HLSStream(session, desc['url'], force_restart=desc['force_restart'], start_offset=desc['start_offset'], duration=desc['duration'], **args)
+        stream.setToMp4(desc['toMp4'])
+    else:
+        if desc['method'] != 'GET':
+            args['method'] = desc['method']
+        stream = HTTPStream(session, desc['url'], max_workers=desc['max_workers'], **args)
+    return stream.setPriority(desc['priority'])
+
+class StreamCache(object):
+    __doc__ = """Persistent cache of the streams resolved by plugins.
+
+    The streams found for a URL are stored as descriptors built on
+    their __json__, keyed by the URL and the request headers, so resumed,
+    restarted and retried tasks open them without running the plugin
+    again. Entries expire after the ``stream_cache_ttl`` of their plugin,
+    or *ttl* seconds when it is None. A *ttl* of 0 disables the cache.
+    Results holding streams that can not be rebuilt from a descriptor,
+    such as muxed or DASH streams, are not cached.
+    """
+
+    def __init__(self, filename='streams.json', ttl=3600):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.skipped = 0
+        self.invalidations = 0
+        self._cache = Cache(filename=filename)
+        self._lock = Lock()
+
+    def configure(self, ttl):
+        'Sets the default lifetime of the entries in seconds, 0 disables the cache.'
+        self.ttl = ttl
+
+    @staticmethod
+    def cache_key(url, headers, cookies=None):
+        headers = sorted((str(name).lower(), str(value)) for (name, value) in (headers or {}).items())
+        cookies = sorted((cookies or {}).items())
+        return sha1(json.dumps([url, headers, cookies]).encode('utf8')).hexdigest()
+
+    def get(self, session, key):
+        '''Returns the plugin and the streams cached for *key*, rebuilt in
+        *session*, or None.
+        '''
+        if not self.ttl:
+            return
+        entry = self._cache.get(key)
+        plugin_class = entry and session.get_plugins().get(entry['plugin'])
+        if not plugin_class:
+            with self._lock:
+                self.misses += 1
+            return
+        plugin = plugin_class(session, entry['url'])
+        for (lang, desc) in entry['subtitles'].items():
+            plugin.subtitles_streams[lang] = load_stream(session, desc)
+        loaded = [load_stream(session, desc) for desc in entry['streams']]
+        streams = dict((name, loaded[index]) for (name, index) in entry['names'].items())
+        with self._lock:
+            self.hits += 1
+        log.debug('Using {0} streams cached by plugin {1}', len(loaded), entry['plugin'])
+        return (plugin, streams)
+
+    def set(self, key, plugin, streams):
+        '''Stores the *streams* found by *plugin* under *key* unless the
+        plugin disables caching or a stream can not be described.
+        '''
+        ttl = plugin.stream_cache_ttl if plugin.stream_cache_ttl is not None else self.ttl
+        if not self.ttl or not ttl:
+            return False
+        entry = self.dump(plugin, streams)
+        if entry is None:
+            with self._lock:
+                self.skipped += 1
+            return False
+        self._cache.set(key, entry, expires=ttl)
+        with self._lock:
+            self.stores += 1
+        return True
+
+    def dump(self, plugin, streams):
+        (descs, names, indexes) = ([], {}, {})
+        for (name, stream) in streams.items():
+            if stream.meta.get('plugin') not in (None, plugin) and stream.meta['plugin'].subtitles():
+                return
+            if id(stream) not in indexes:
+                desc = dump_stream(stream)
+                if desc is None:
+                    return
+                indexes[id(stream)] = len(descs)
+                descs.append(desc)
+            names[name] = indexes[id(stream)]
+        subtitles = {}
+        for (lang, stream) in plugin.subtitles().items():
+            subtitles[lang] = dump_stream(stream)
+            if subtitles[lang] is None:
+                return
+        return {'plugin': type(plugin).__module__.rsplit('.', 1)[-1], 'url': plugin.url, 'streams': descs, 'names': names, 'subtitles': subtitles}
+
+    def invalidate(self, key):
+        if not self._cache.delete(key):
+            return False
+        with self._lock:
+            self.invalidations += 1
+        return True
+
+    def stats(self):
+        with self._lock:
+            stats = {'ttl': self.ttl, 'hits': self.hits, 'misses': self.misses, 'stores': self.stores, 'skipped': self.skipped, 'invalidations': self.invalidations}
+        stats.update(self._cache.stats())
+        return stats
+
+stream_cache = StreamCache()
+__all__ = ['StreamCache', 'stream_cache', 'response_status']
@@ -2,12 +2,21 @@ import os
 import json
 import logging
 from threading import Lock
-from models import TaskDB
+from hashlib import md5
+from models import TaskDB, task_version, DEFAULT_PAGE_SIZE
 from exceptions import TaskWasExisted, TaskListWasExisted, TaskNotExist
 from constants import QUEUING, RUNNING, STOPPED, COMPLETED, ERROR
-from appSettings import app_settings
-from utils import longPath, cleanName, sanitizePath, mkdirs
-from StreamDownloader import StreamDownloader
+from appSettings import app_settings, RemuxerName
+from utils import longPath, cleanName, sanitizePath, mkdirs, remove_file
+from StreamDownloader import StreamDownloader, remove_resume_files
+from StreamDownloader.utils import FormatFileSize, FormatSeconds, FormatPercent
+from streamlink.governor import host_governor
+from streamlink.bandwidth import bandwidth_scheduler
+from streamlink.keycache import key_cache
+from streamlink.streamcache import stream_cache
+from StreamDownloader.postprocess import post_processor
+from progress import ProgressJournal
+from events import EventBroker
 log = logging.getLogger(__name__)
 
 class TaskBase(object):
@@ -71,7 +80,7 @@ class TaskBase(object):
 class Task(TaskBase):
     __doc__ = 'docstring for Task'
 
-    def __init__(self, tid, url, path, headers, quality, threads, override_file=False):
+    def __init__(self, tid, url, path, headers, quality, threads, override_file=False, bandwidth_weight=1, bandwidth_limit=0, remuxer=''):
         super().__init__(tid)
         self.url = url
         self.headers = headers
@@ -79,7 +88,9 @@ class Task(TaskBase):
         self.override_file = override_file
         self.qualities = '[]'
         self.reset()
-        self.streamdown = StreamDownloader(url, path, headers, quality, threads, reporter=self.onProgress)
+        bandwidth_scheduler.set_owner(tid, bandwidth_weight, bandwidth_limit*1024)
+        options = {'stream-segment-window': app_settings.segment_window, 'stream-segment-reorder-size': app_settings.reorder_buffer*1048576, 'stream-segment-reorder-dir': os.path.dirname(os.path.abspath(path)) if app_settings.reorder_spill else None}
+        self.streamdown = StreamDownloader(url, path, headers, quality, threads, options=options, reporter=self.onProgress, bandwidth_owner=tid, hls_output=app_settings.hls_output, remuxer=remuxer or app_settings.remuxer, resumable=app_settings.hls_resume)
         self.closed = False
 
     def reset(self):
@@ -89,9 +100,9 @@ class Task(TaskBase):
 
     def onProgress(self, s):
         if s['state'] == 'Downloading':
-            self.speed = s['speed']
-            self.eta = s['eta']
-            self.percent = s['per']
+            self.speed = '%s/s' % FormatFileSize(s['speed']) if s.get('speed') is not None else ''
+            self.eta = FormatSeconds(int(s['eta'])) if s.get('eta') is not None else ''
+            self.percent = FormatPercent(s['per']) if s.get('per') is not None else ''
             self.fire()
         else:
             self.reset()
@@ -102,41 +113,204 @@ class Task(TaskBase):
             self.streamdown.download()
         finally:
             self.streamdown.close()
+            bandwidth_scheduler.remove(self.id)
 
     def stop(self):
         super().stop()
         self.streamdown.close()
 
+class TaskCache(object):
+    __doc__ = """Read-through/write-through cache of serialized tasks.
+
+    Rows are loaded from TaskDB on the first miss and then kept up to date
+    by patching the fields TaskManager writes, so reads of running tasks
+    never touch the database. Patches of tasks not cached yet are kept
+    while rows are being loaded and applied to them before they are
+    cached, so a row read before a patch does not overwrite it.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._tasks = {}
+        self._complete = False
+        self._generation = 0
+        self._loads = 0
+        self._pending = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _end_load(self):
+        'Forgets the pending patches once no load is running, the lock must be held.'
+        self._loads -= 1
+        if not self._loads:
+            self._pending.clear()
+
+    def _install(self, task):
+        'Caches a loaded row unless it is cached already, the lock must be held.'
+        cached = self._tasks.get(task['id'])
+        if cached is not None:
+            return cached
+        task.update(self._pending.get(task['id'], ()))
+        self._tasks[task['id']] = task
+        return task
+
+    def get(self, tid):
+        with self._lock:
+            task = self._tasks.get(tid)
+            if task is not None:
+                self.hits += 1
+                return dict(task)
+            self.misses += 1
+            generation = self._generation
+            self._loads += 1
+        try:
+            task = TaskDB.getTask(tid).serialize()
+        except Exception:
+            with self._lock:
+                self._end_load()
+            raise
+        with self._lock:
+            if generation == self._generation:
+                task = self._install(task)
+            self._end_load()
+            return dict(task)
+
+    def all(self):
+        with self._lock:
+            if self._complete:
+                self.hits += 1
+                return [dict(t) for t in self._tasks.values()]
+            self.misses += 1
+            generation = self._generation
+            self._loads += 1
+        try:
+            tasks = [t.serialize() for t in TaskDB.getAllTask()]
+        except Exception:
+            with self._lock:
+                self._end_load()
+            raise
+        with self._lock:
+            if generation != self._generation:
+                self._end_load()
+                return tasks
+            for task in tasks:
+                self._install(task)
+            self._end_load()
+            self._complete = True
+            return [dict(t) for t in self._tasks.values()]
+
+    def put(self, tid, task):
+        with self._lock:
+            self._tasks[tid] = task
+
+    def patch(self, tid, fields):
+        with self._lock:
+            task = self._tasks.get(tid)
+            if task is not None:
+                task.update(fields)
+            elif self._loads:
+                self._pending.setdefault(tid, {}).update(fields)
+
+    def delete(self, tid):
+        with self._lock:
+            self._generation += 1
+            self._tasks.pop(tid, None)
+            self._pending.pop(tid, None)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {'size': len(self._tasks), 'hits': self.hits, 'misses': self.misses, 'hit_ratio': float(self.hits)/total if total else 0.0}
+
 class TaskManager(object):
     __doc__ = 'docstring for TaskManager'
 
     def __init__(self):
         self.tasks_activating = {}
         self.worker_mgr = None
+        self._status_written = {}
+        self.progress = ProgressJournal(app_settings.progress_flush_interval)
+        self.progress.start()
+        self.events = EventBroker()
+        self.cache = TaskCache()
+        host_governor.configure(app_settings.host_connections, app_settings.host_limits)
+        bandwidth_scheduler.configure(app_settings.bandwidth_limit*1024)
+        post_processor.configure(app_settings.postprocess_workers)
+        stream_cache.configure(app_settings.stream_cache_ttl)
 
     def setWorkerMgr(self, worker_mgr):
         self.worker_mgr = worker_mgr
 
+    def wakeup(self):
+        if self.worker_mgr:
+            self.worker_mgr.wakeup()
+
+    def apply_settings(self):
+        self.progress.interval = app_settings.progress_flush_interval
+        host_governor.configure(app_settings.host_connections, app_settings.host_limits)
+        bandwidth_scheduler.configure(app_settings.bandwidth_limit*1024)
+        post_processor.configure(app_settings.postprocess_workers)
+        stream_cache.configure(app_settings.stream_cache_ttl)
+        self.wakeup()
+
+    def shutdown(self):
+        self.progress.shutdown()
+
+    def stats(self):
+        data = {'progress': self.progress.stats(), 'events': self.events.stats(), 'cache': self.cache.stats(), 'hosts': host_governor.stats(), 'bandwidth': bandwidth_scheduler.stats(), 'postprocess': post_processor.stats(), 'keys': key_cache.stats(), 'streams': stream_cache.stats()}
+        if self.worker_mgr:
+            data['scheduler'] = self.worker_mgr.stats()
+        return data
+
     def register(self, task):
         self.tasks_activating[task.id] = task
         task.register(self)
 
     def unregister(self, task):
         task.unregister(self)
+        self._status_written.pop(task.id, None)
         if task.id in self.tasks_activating:
             del self.tasks_activating[task.id]
 
     def update(self, task):
-        if task.status() == ERROR:
+        status = task.status()
+        if status == ERROR:
             log.error('Unable handle task id %s url %s with error %s', task.id, task.url, task.error)
             self.unregister(task)
-            TaskDB.update(task.id, status=task.status(), qualities=task.qualities, speed='', eta='', percent='', error=task.error)
+            fields = dict(status=status, qualities=task.qualities, speed='', eta='', percent='', error=task.error)
+            self.progress.write_through(task.id, **fields)
+            self.publish(task.id, **fields)
             return
-        if task.status() in [COMPLETED, STOPPED]:
+        if status in [COMPLETED, STOPPED]:
             self.unregister(task)
-            TaskDB.update(task.id, status=task.status(), qualities=task.qualities, speed='', eta='', percent='', error='')
+            fields = dict(status=status, qualities=task.qualities, speed='', eta='', percent='', error='')
+            self.progress.write_through(task.id, **fields)
+            self.publish(task.id, **fields)
+            return
+        if self._status_written.get(task.id) != status:
+            self._status_written[task.id] = status
+            fields = dict(status=status, qualities=task.qualities, speed=task.speed, eta=task.eta, percent=task.percent)
+            self.progress.write_through(task.id, **fields)
+            self.publish(task.id, **fields)
             return
-        TaskDB.update(task.id, status=task.status(), qualities=task.qualities, speed=task.speed, eta=task.eta, percent=task.percent)
+        self.progress.put(task.id, qualities=task.qualities, speed=task.speed, eta=task.eta, percent=task.percent)
+        self.publish(task.id, speed=task.speed, eta=task.eta, percent=task.percent)
+
+    def publish(self, tid, **fields):
+        if 'qualities' in fields:
+            fields['qualities'] = json.loads(fields['qualities'])
+        self.cache.patch(tid, fields)
+        self.events.publish(tid, fields)
+
+    def publish_task(self, tid):
+        try:
+            task = TaskDB.getTask(tid).serialize()
+        except TaskNotExist:
+            self.cache.delete(tid)
+            self.events.delete(tid)
+            return
+        self.cache.put(tid, task)
+        self.events.publish(tid, dict(task))
 
     def create_task(self, params, override=False):
         if 'album_name' in params and 'file_name' in params:
@@ -164,13 +338,45 @@ class TaskManager(object):
         try:
             TaskDB.getTask(tid)
             if override:
-                TaskDB.update(tid, headers=json.dumps(params['headers']), path=path, status=QUEUING, error='')
+                TaskDB.update(tid, headers=json.dumps(params['headers']), path=path, status=QUEUING, error='', priority=int(params.get('priority', 0)), **self.bandwidth_fields(params), **self.remuxer_fields(params))
+                self.publish_task(tid)
+                self.wakeup()
                 return tid
             raise TaskWasExisted(tid)
         except TaskNotExist:
-            TaskDB.create(tid, url, json.dumps(params['headers']), path)
+            TaskDB.create(tid, url, json.dumps(params['headers']), path, int(params.get('priority', 0)), **self.bandwidth_fields(params), **self.remuxer_fields(params))
+            self.publish_task(tid)
+            self.wakeup()
             return tid
 
+    def bandwidth_fields(self, params):
+        'Returns the bandwidth weight and limit (KiB/s, 0 is unlimited) given in *params*.'
+        fields = {}
+        if params.get('bandwidth_weight') is not None:
+            fields['bandwidth_weight'] = max(1, int(params['bandwidth_weight']))
+        if params.get('bandwidth_limit') is not None:
+            fields['bandwidth_limit'] = max(0, int(params['bandwidth_limit']))
+        return fields
+
+    def remuxer_fields(self, params):
+        'Returns the remuxer of the task given in *params*, empty uses the --remuxer setting.'
+        remuxer = params.get('remuxer')
+        if remuxer is None:
+            return {}
+        if remuxer and remuxer not in RemuxerName:
+            raise ValueError('Remuxer must be one of: %s' % ', '.join(RemuxerName))
+        return {'remuxer': remuxer}
+
+    def set_task_bandwidth(self, tid, params):
+        '''Changes the bandwidth weight and limit of a task, a running task applies them at once.'''
+        fields = self.bandwidth_fields(params)
+        if not fields:
+            return
+        TaskDB.update(tid, **fields)
+        task = TaskDB.getTask(tid)
+        bandwidth_scheduler.set_owner(tid, task.bandwidth_weight, task.bandwidth_limit*1024, create=False)
+        self.publish(tid, **fields)
+
     def override_task(self, params):
         self.create_task(params, True)
 
@@ -198,32 +404,67 @@ class TaskManager(object):
         params['path'] = longPath(os.path.join(dir_path, file_name))
         mkdirs(dir_path)
         params.pop('url', None)
-        params['status'] = QUEUING
+        params['status'] = RUNNING if force_run else QUEUING
         params['headers'] = json.dumps(params['headers'])
         params['error'] = ''
         TaskDB.update(tid, **params)
+        self.publish_task(tid)
         if force_run:
             self.worker_mgr.force_run_task(TaskDB.getTask(tid))
+        else:
+            self.wakeup()
 
     def stop_task(self, tid):
         if tid in self.tasks_activating:
             self.tasks_activating[tid].stop()
         else:
             TaskDB.update(tid, status=STOPPED)
+            self.publish(tid, status=STOPPED)
 
     def delete_task(self, tid):
+        'Deletes a task with the files kept to resume it, and its partial file.'
         if tid in self.tasks_activating:
             self.tasks_activating[tid].stop()
+        self.progress.discard(tid)
+        try:
+            task = TaskDB.getTask(tid)
+        except TaskNotExist:
+            task = None
+        if task is not None and task.status != COMPLETED and remove_resume_files(task.path):
+            try:
+                remove_file(task.path)
+            except OSError as err:
+                log.warning('Unable to remove partial file %s: %s', task.path, err)
         TaskDB.delete(tid)
+        self.cache.delete(tid)
+        self.events.delete(tid)
 
     def stop_all(self):
-        TaskDB.stop_tasks()
+        tids = TaskDB.stop_tasks()
         for task in list(self.tasks_activating.values()):
             task.stop()
+        for tid in tids:
+            self.publish(tid, status=STOPPED, speed='', eta='', percent='')
 
     def get_task(self, tid):
-        return TaskDB.getTask(tid).serialize()
+        return self.cache.get(tid)
 
     def get_tasks_list(self):
-        return [t.serialize() for t in TaskDB.getAllTask()]
+        return self.cache.all()
+
+    def get_tasks_changes(self, since=None, page=None, status=None, limit=None):
+        if since is not None:
+            return TaskDB.listChanges(since, status, limit)
+        return TaskDB.listPage(page, status, limit or DEFAULT_PAGE_SIZE)
+
+    def tasks_etag(self, query):
+        'Validator of a task listing, changes whenever any task is written.'
+        with task_version:
+            version = task_version.value
+        return md5(('%d:%s' % (version, query)).encode('utf8')).hexdigest()
+
+    def subscribe_events(self):
+        'Returns a generator of server-sent events, starting with a snapshot of all tasks.'
+        client = self.events.subscribe()
+        return client.stream(self.get_tasks_list())
 
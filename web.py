@@ -1,10 +1,11 @@
 import os
 import logging
 import logConfig
-from flask import Flask, request, render_template, jsonify, send_file
+from flask import Flask, Response, request, render_template, jsonify, send_file, stream_with_context
 from appSettings import app_settings
 from exceptions import TaskNotExist, TaskListWasExisted
 from constants import STATUS_RESP_SUCCESS
+from models import MAX_PAGE_SIZE
 CURRENT_DIR = os.getcwd()
 app = Flask(__name__, static_folder=os.path.join(CURRENT_DIR, 'data', 'static'), template_folder=os.path.join(CURRENT_DIR, 'data', 'templates'))
 log = logging.getLogger('web')
@@ -33,9 +34,32 @@ def handleTaskNotExist(err):
 def index():
     return render_template('index.html')
 
+def parseListArgs(args):
+    since = args.get('since', None, type=int)
+    limit = args.get('limit', None, type=int)
+    if limit is not None:
+        limit = min(max(limit, 1), MAX_PAGE_SIZE)
+    return dict(since=since, page=args.get('page') or None, status=args.get('status') or None, limit=limit)
+
 @app.route('/task/list', methods=['GET'])
 def getAllTasks():
-    return jsonify(task_mgr.get_tasks_list())
+    etag = task_mgr.tasks_etag(request.query_string.decode('latin1'))
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+        resp.set_etag(etag)
+        return resp
+    if request.args:
+        resp = jsonify(task_mgr.get_tasks_changes(**parseListArgs(request.args)))
+    else:
+        resp = jsonify(task_mgr.get_tasks_list())
+    resp.set_etag(etag)
+    return resp
+
+@app.route('/task/events', methods=['GET'])
+def task_events():
+    resp = Response(stream_with_context(task_mgr.subscribe_events()), mimetype='text/event-stream')
+    resp.headers['X-Accel-Buffering'] = 'no'
+    return resp
 
 @app.route('/task/batch', methods=['POST'])
 def add_multi_tasks():
@@ -79,14 +103,24 @@ def resume_task(tid):
     task_mgr.resume_task(tid, request.get_json())
     return jsonify(status=STATUS_RESP_SUCCESS)
 
+@app.route('/task/<tid>/bandwidth', methods=['PUT'])
+def set_task_bandwidth(tid):
+    task_mgr.set_task_bandwidth(tid, request.get_json())
+    return jsonify(status=STATUS_RESP_SUCCESS, data=task_mgr.get_task(tid))
+
 @app.route('/config', methods=['GET', 'POST'])
 def setting_handler():
     if request.method == 'GET':
         return jsonify(status=STATUS_RESP_SUCCESS, config=app_settings.dump())
     app_settings.load(request.get_data(as_text=True))
     logConfig.setup(app_settings.log_level)
+    task_mgr.apply_settings()
     return jsonify(status=STATUS_RESP_SUCCESS)
 
+@app.route('/stats', methods=['GET'])
+def get_stats():
+    return jsonify(status=STATUS_RESP_SUCCESS, data=task_mgr.stats())
+
 @app.route('/favicon.ico')
 def favicon():
     return send_file(os.path.join(os.getcwd(), 'data', 'static', 'imgs', 'logo.jpg'))
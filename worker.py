@@ -1,39 +1,50 @@
 import logging
 import json
-from time import sleep
-from queue import Queue, Empty
-from threading import Thread
+from time import time
+from queue import Queue
+from threading import Thread, Condition, Lock
 from models import TaskDB
 from task import Task
-from constants import QUEUING, RUNNING
+from constants import RUNNING
 from appSettings import app_settings
 log = logging.getLogger(__name__)
+IDLE_WAKEUP_INTERVAL = 30
 
 class Worker(Thread):
 
-    def __init__(self):
+    def __init__(self, on_done=None, reserved=False):
         super().__init__(daemon=True)
         self.queue = Queue()
-        self.active = False
+        self.active = reserved
         self.closed = False
+        self.on_done = on_done
         self.start()
 
     def run(self):
         while not self.closed:
+            func = self.queue.get()
+            if func is None:
+                break
             try:
-                func = self.queue.get(timeout=1)
-            except Empty:
-                continue
-            self.active = True
-            func()
-            self.active = False
+                func()
+            except Exception as err:
+                log.error('Worker run task error %s', err)
+            finally:
+                self.active = False
+                self.on_done and self.on_done()
         self.active = False
 
     def submit(self, func):
+        self.active = True
         self.queue.put(func)
 
+    def release(self):
+        'Frees a worker reserved without submitting a task to it.'
+        self.active = False
+
     def stop(self):
         self.closed = True
+        self.queue.put(None)
 
 class WorkerManager(Thread):
     __doc__ = 'docstring for WorkerManager'
@@ -43,66 +54,120 @@ class WorkerManager(Thread):
         self.task_mgr = task_mgr
         task_mgr.setWorkerMgr(self)
         self.workers = []
+        self._workers_lock = Lock()
+        self._cond = Condition()
+        self._wakeup = False
+        self._wakeup_at = None
+        self.dispatch_count = 0
+        self.dispatch_latency_last = 0.0
+        self.dispatch_latency_avg = 0.0
+        self.dispatch_latency_max = 0.0
         self.closed = False
 
-    def spawn_worker(self):
-        w = Worker()
-        self.workers.append(w)
+    def wakeup(self):
+        'Wakes the dispatcher up, called on task creation, resume, completion or config change.'
+        with self._cond:
+            if self._wakeup_at is None:
+                self._wakeup_at = time()
+            self._wakeup = True
+            self._cond.notify()
+
+    def spawn_worker(self, reserved=False):
+        w = Worker(self.wakeup, reserved)
+        with self._workers_lock:
+            self.workers.append(w)
+        return w
 
     def adjust_worker_count(self):
-        worker_count = len(self.workers)
-        if worker_count < app_settings.active_downloads:
+        with self._workers_lock:
+            worker_count = len(self.workers)
+        for _ in range(worker_count, app_settings.active_downloads):
             self.spawn_worker()
-            return
-        if worker_count > app_settings.active_downloads:
-            for w in self.workers:
+        with self._workers_lock:
+            excess = len(self.workers) - app_settings.active_downloads
+            for w in list(self.workers):
+                if excess <= 0:
+                    break
                 if not w.active:
                     w.stop()
                     self.workers.remove(w)
-                    return
+                    excess -= 1
 
     def fetchTask(self):
-        task_data = TaskDB.getTaskByStatus(QUEUING)
-        if task_data and task_data.id not in self.task_mgr.tasks_activating:
-            task = Task(task_data.id, task_data.url, task_data.path, json.loads(task_data.headers), task_data.quality, app_settings.connections)
-            return task
+        task_data = TaskDB.claimNextTask()
+        if not task_data:
+            return
+        if task_data.id in self.task_mgr.tasks_activating:
+            log.warning('Task %s claimed while still activating', task_data.id)
+            return self.fetchTask()
+        return Task(task_data.id, task_data.url, task_data.path, json.loads(task_data.headers), task_data.quality, app_settings.connections, bandwidth_weight=task_data.bandwidth_weight, bandwidth_limit=task_data.bandwidth_limit, remuxer=task_data.remuxer)
 
     def find_worker_free(self):
-        for w in self.workers:
-            if not w.active:
-                return w
+        '''Returns a free worker reserved for the caller, who submits a
+        task to it or releases it, so no other caller gets it meanwhile.
+        '''
+        with self._workers_lock:
+            for w in self.workers:
+                if not w.active:
+                    w.active = True
+                    return w
 
     def assign_task_for_worker(self, task):
-        for w in self.workers:
-            if not w.active:
-                w.submit(task.run)
-                return True
-        return False
+        w = self.find_worker_free()
+        if not w:
+            return False
+        w.submit(task.run)
+        return True
+
+    def record_dispatch_latency(self, wakeup_at):
+        latency = time() - wakeup_at
+        self.dispatch_count += 1
+        self.dispatch_latency_last = latency
+        self.dispatch_latency_max = max(self.dispatch_latency_max, latency)
+        self.dispatch_latency_avg += (latency - self.dispatch_latency_avg)/self.dispatch_count
+
+    def stats(self):
+        with self._workers_lock:
+            workers = len(self.workers)
+            active = sum(1 for w in self.workers if w.active)
+        return {'workers': workers, 'workers_active': active, 'dispatch_count': self.dispatch_count, 'dispatch_latency_last': self.dispatch_latency_last, 'dispatch_latency_avg': self.dispatch_latency_avg, 'dispatch_latency_max': self.dispatch_latency_max}
+
+    def dispatch(self, wakeup_at):
+        while not self.closed:
+            w = self.find_worker_free()
+            if not w:
+                return
+            try:
+                task = self.fetchTask()
+            except Exception as err:
+                w.release()
+                log.error('fetch task error %s', err)
+                return
+            if not task:
+                w.release()
+                return
+            self.task_mgr.register(task)
+            w.submit(task.run)
+            self.record_dispatch_latency(wakeup_at)
 
     def run(self):
         while not self.closed:
+            with self._cond:
+                if not self._wakeup:
+                    self._cond.wait(IDLE_WAKEUP_INTERVAL)
+                self._wakeup = False
+                wakeup_at = self._wakeup_at or time()
+                self._wakeup_at = None
+            if self.closed:
+                break
             self.adjust_worker_count()
-            w = self.find_worker_free()
-            if w:
-                task = None
-                try:
-                    task = self.fetchTask()
-                except Exception as err:
-                    log.error('fetch task error %s', err)
-                    continue
-                if task:
-                    w.submit(task.run)
-                    self.task_mgr.register(task)
-                else:
-                    sleep(5)
-            else:
-                sleep(5)
+            self.dispatch(wakeup_at)
 
     def force_run_task(self, task_data):
-        task = Task(task_data.id, task_data.url, task_data.path, json.loads(task_data.headers), task_data.quality, app_settings.connections)
-        self.spawn_worker()
+        task = Task(task_data.id, task_data.url, task_data.path, json.loads(task_data.headers), task_data.quality, app_settings.connections, bandwidth_weight=task_data.bandwidth_weight, bandwidth_limit=task_data.bandwidth_limit, remuxer=task_data.remuxer)
+        w = self.spawn_worker(reserved=True)
         self.task_mgr.register(task)
-        self.assign_task_for_worker(task)
+        w.submit(task.run)
 
     def load_task_unfinished(self):
         tasks_data = TaskDB.getAllTasksByStatus(RUNNING)
@@ -111,6 +176,7 @@ class WorkerManager(Thread):
 
     def shutdown(self):
         self.closed = True
-        for t in self.workers:
-            t.stop()
-
+        with self._workers_lock:
+            for t in self.workers:
+                t.stop()
+        self.wakeup()